@@ -0,0 +1,385 @@
+"""
+REST and WebSocket API for sessions, characters, messages and turns.
+
+Backed by the same SessionRegistry (and so the same ChatManagers) as the
+NiceGUI pages, so API clients and browser clients can share a session. All
+handlers are async and run on the event loop; database reads and writes (and
+creating a session's ChatManager) are moved to worker threads. A posted message
+is returned once it is stored; summarization it makes due runs in the background.
+REST requests use a session's manager without counting as a
+viewer; an open WebSocket counts as one, like a browser tab.
+
+Routes (prefix /api):
+- GET    /sessions?offset=&limit=                    list sessions
+- POST   /sessions                                   create a session ({"setting": ...} optional)
+- GET    /sessions/{id}                              session state (setting, location, characters, auto-chat)
+- DELETE /sessions/{id}                              delete a session
+- GET    /characters                                 available characters
+- POST   /sessions/{id}/characters                   add a character ({"name": ...})
+- DELETE /sessions/{id}/characters/{name}            remove a character
+- GET    /sessions/{id}/messages?before_id=&after_id=&limit=   a page of the history (see get_messages_page)
+- POST   /sessions/{id}/messages                     post a user message ({"text": ..., "sender": ...})
+- POST   /sessions/{id}/turns?wait=                  generate the next turn
+- PUT    /sessions/{id}/auto-chat                    start or stop automatic chat ({"enabled": true})
+- WS     /sessions/{id}/stream                       streamed output and session events
+
+The stream sends JSON frames: {"type": "session", "data": <session state>} on
+connect, then {"type": "partial", "character", "text"} with the text generated
+so far (coalesced: a slow client only gets the latest), {"type": "turn_done",
+"speaker"} and {"type": <event type>, "data"} for every session event (see
+chats.events). A client that falls too far behind is disconnected (code 1013).
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+from chats.chat_manager import ChatManager, SessionNotFound
+from chats.events import SessionEvent, get_event_bus
+from chats.session_registry import SessionRegistry
+from models.character import Character
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["api"])
+
+STREAM_QUEUE_SIZE = 256
+_PARTIAL = object()  # Queue marker: send the latest partial text
+
+_registry: Optional[SessionRegistry] = None
+_characters: Dict[str, Character] = {}
+
+
+def setup_api(session_registry: SessionRegistry, characters: Dict[str, Character]):
+    """Serve the API from `session_registry`; include `router` in the app to expose it."""
+    global _registry, _characters
+    _registry = session_registry
+    _characters = characters
+
+
+class CreateSessionRequest(BaseModel):
+    setting: Optional[str] = None
+
+
+class AddCharacterRequest(BaseModel):
+    name: str
+
+
+class UserMessageRequest(BaseModel):
+    text: str
+    sender: Optional[str] = None
+
+
+class AutoChatRequest(BaseModel):
+    enabled: bool
+
+
+#
+# Helpers
+#
+def registry() -> SessionRegistry:
+    if _registry is None:
+        raise HTTPException(status_code=503, detail="The API is not set up.")
+    return _registry
+
+
+async def get_manager(session_id: str) -> ChatManager:
+    """The manager of an existing session; 404 for unknown sessions rather than creating one."""
+    sessions = registry()
+    if await asyncio.to_thread(sessions.db.get_session, session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    try:
+        return await sessions.get_async(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+
+
+async def apply_setting(manager: ChatManager, setting_name: str):
+    setting = manager.settings.get(setting_name)
+    if setting is None:
+        raise HTTPException(status_code=404, detail=f"Setting '{setting_name}' not found.")
+    # Only used on a new session, which nobody is subscribed to yet, so its event can be published from the thread
+    await asyncio.to_thread(manager.set_current_setting, setting['name'], setting['description'], setting['start_location'])
+
+
+def read_characters(db, session_id: str, names: List[str]) -> List[Dict[str, Any]]:
+    characters = []
+    for name in names:
+        plan = db.get_character_plan(session_id, name)
+        characters.append({
+            'name': name,
+            'location': db.get_character_location(session_id, name),
+            'appearance': db.get_character_appearance(session_id, name),
+            'plan': {'goal': plan['goal'], 'steps': plan['steps']} if plan else None,
+        })
+    return characters
+
+
+async def session_state(manager: ChatManager) -> Dict[str, Any]:
+    db = manager.db
+    session_id = manager.session_id
+    names = manager.get_character_names()
+    session = await asyncio.to_thread(db.get_session, session_id)
+    characters = await asyncio.to_thread(read_characters, db, session_id, names)
+    return {
+        'session_id': session_id,
+        'name': session['name'] if session else None,
+        'setting': manager.current_setting,
+        'location': await asyncio.to_thread(db.get_current_location, session_id),
+        'you_name': manager.you_name,
+        'characters': characters,
+        'next_speaker': await asyncio.to_thread(manager.next_speaker),
+        'turn_in_progress': manager.turn_in_progress,
+        'auto_chat': {**manager.auto_chat.status(), 'running': manager.automatic_running},
+    }
+
+
+#
+# Sessions
+#
+@router.get('/sessions')
+async def list_sessions(offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    sessions = await asyncio.to_thread(registry().db.get_all_sessions)
+    return {'sessions': sessions[offset:offset + limit], 'total': len(sessions), 'offset': offset, 'limit': limit}
+
+
+@router.post('/sessions', status_code=201)
+async def create_session(request: CreateSessionRequest):
+    sessions = registry()
+    session_id = await asyncio.to_thread(sessions.new_session)
+    # Its manager applies the default setting
+    manager = await sessions.get_async(session_id)
+    if request.setting and request.setting != manager.current_setting:
+        await apply_setting(manager, request.setting)
+    logger.info(f"Session {manager.session_id} created through the API.")
+    return await session_state(manager)
+
+
+@router.get('/sessions/{session_id}')
+async def get_session(session_id: str):
+    return await session_state(await get_manager(session_id))
+
+
+@router.delete('/sessions/{session_id}', status_code=204)
+async def delete_session(session_id: str):
+    sessions = registry()
+    if await asyncio.to_thread(sessions.db.get_session, session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    sessions.discard(session_id)
+    await asyncio.to_thread(sessions.db.delete_session, session_id)
+    logger.info(f"Session {session_id} deleted through the API.")
+
+
+#
+# Characters
+#
+@router.get('/characters')
+async def list_characters():
+    return {'characters': sorted(_characters)}
+
+
+@router.post('/sessions/{session_id}/characters', status_code=201)
+async def add_character(session_id: str, request: AddCharacterRequest):
+    manager = await get_manager(session_id)
+    character = _characters.get(request.name)
+    if character is None:
+        raise HTTPException(status_code=404, detail=f"Character '{request.name}' not found.")
+    if request.name in manager.get_character_names():
+        raise HTTPException(status_code=409, detail=f"Character '{request.name}' is already in the session.")
+    await asyncio.to_thread(manager.add_character, request.name, character)
+    logger.info(f"Character '{request.name}' added to session {session_id} through the API.")
+    return await session_state(manager)
+
+
+@router.delete('/sessions/{session_id}/characters/{name}')
+async def remove_character(session_id: str, name: str):
+    manager = await get_manager(session_id)
+    if name not in manager.get_character_names():
+        raise HTTPException(status_code=404, detail=f"Character '{name}' is not in the session.")
+    await asyncio.to_thread(manager.remove_character, name)
+    logger.info(f"Character '{name}' removed from session {session_id} through the API.")
+    return await session_state(manager)
+
+
+#
+# Messages and turns
+#
+@router.get('/sessions/{session_id}/messages')
+async def list_messages(
+    session_id: str,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    A page of the history in ascending order: the newest messages (before `before_id`),
+    or the oldest after `after_id`. Pass the returned before_id / after_id to page on.
+    """
+    db = registry().db
+    if await asyncio.to_thread(db.get_session, session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    messages = await asyncio.to_thread(db.get_messages_page, session_id, before_id, after_id, limit)
+    return {
+        'messages': messages,
+        'before_id': messages[0]['id'] if messages else None,
+        'after_id': messages[-1]['id'] if messages else None,
+    }
+
+
+@router.post('/sessions/{session_id}/messages', status_code=201)
+async def post_message(session_id: str, request: UserMessageRequest):
+    text = request.text.strip()
+    if not text:
+        raise HTTPException(status_code=422, detail="Empty message.")
+    manager = await get_manager(session_id)
+    if request.sender and request.sender.strip():
+        manager.set_you_name(request.sender.strip())
+    message_id = await manager.add_message(
+        manager.you_name, text, visible=True, message_type="user", summarize_in_background=True
+    )
+    if message_id is None:
+        return {'message': None}
+    return {'message': await asyncio.to_thread(manager.db.get_message, message_id)}
+
+
+@router.post('/sessions/{session_id}/turns')
+async def next_turn(session_id: str, wait: bool = False):
+    """
+    Generate the next turn and return its speaker and message. Without `wait`, 409 if a
+    turn is already in progress; with it, the request queues for the session's turn lock.
+    """
+    manager = await get_manager(session_id)
+    if manager.automatic_running:
+        raise HTTPException(status_code=409, detail="Automatic chat is running.")
+    if not manager.get_character_names():
+        raise HTTPException(status_code=409, detail="No characters in the session.")
+    if not wait and manager.turn_in_progress:
+        raise HTTPException(status_code=409, detail="A message is already being generated.")
+
+    speaker = await manager.generate_next_turn(on_partial=manager.auto_chat.broadcast_partial, wait=wait)
+    manager.auto_chat.broadcast_turn_done(speaker)
+    message = None
+    if speaker is not None:
+        recent = await asyncio.to_thread(manager.db.get_messages_page, session_id, None, None, 5)
+        message = next((m for m in reversed(recent) if m['sender'] == speaker), None)
+    return {'speaker': speaker, 'message': message}
+
+
+@router.put('/sessions/{session_id}/auto-chat')
+async def set_auto_chat(session_id: str, request: AutoChatRequest):
+    manager = await get_manager(session_id)
+    if request.enabled and not manager.automatic_running:
+        if not manager.get_character_names():
+            raise HTTPException(status_code=409, detail="No characters added. Cannot start automatic chat.")
+        manager.start_automatic_chat(started_by="api")
+        logger.info(f"Automatic chat started for session {session_id} through the API.")
+    elif not request.enabled and manager.automatic_running:
+        manager.stop_automatic_chat()
+        logger.info(f"Automatic chat stopped for session {session_id} through the API.")
+    return {**manager.auto_chat.status(), 'running': manager.automatic_running}
+
+
+#
+# Streaming
+#
+class SessionStream:
+    """Forwards the partial output, turns and events of one session to one WebSocket."""
+
+    def __init__(self, websocket: WebSocket, manager: ChatManager):
+        self.websocket = websocket
+        self.manager = manager
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.partial: Optional[Dict[str, Any]] = None
+        self.overflowed = False
+        self.sender: Optional[asyncio.Task] = None
+
+    # Listeners; called on the event loop (events may also be published from another thread)
+    def on_partial(self, character_name: str, text: str):
+        pending = self.partial is not None
+        self.partial = {'type': 'partial', 'character': character_name, 'text': text}
+        if not pending:
+            self.put(_PARTIAL)
+
+    def on_turn_done(self, speaker: Optional[str]):
+        self.partial = None
+        self.put({'type': 'turn_done', 'speaker': speaker})
+
+    def on_event(self, event: SessionEvent):
+        frame = {'type': event.type, 'data': event.data}
+        if threading.get_ident() == self.thread_id:
+            # Queued right away, so the frames stay in the order things happened
+            self.put(frame)
+        else:
+            self.loop.call_soon_threadsafe(self.put, frame)
+
+    def put(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # The client does not keep up; it has to reconnect and resync from the REST API
+            self.overflowed = True
+            if self.sender is not None:
+                self.sender.cancel()
+
+    async def send(self):
+        while True:
+            frame = await self.queue.get()
+            if frame is _PARTIAL:
+                frame, self.partial = self.partial, None
+                if frame is None:
+                    continue
+            await self.websocket.send_text(json.dumps(frame, default=str))
+
+    async def receive(self):
+        # Nothing is expected from the client; this only notices the disconnect
+        while True:
+            await self.websocket.receive_text()
+
+    async def run(self):
+        session_id = self.manager.session_id
+        self.manager.auto_chat.add_listener(self.on_partial, self.on_turn_done)
+        get_event_bus().subscribe(session_id, self.on_event)
+        try:
+            await self.websocket.send_text(json.dumps({'type': 'session', 'data': await session_state(self.manager)}, default=str))
+            self.sender = asyncio.create_task(self.send())
+            receiver = asyncio.create_task(self.receive())
+            done, pending = await asyncio.wait({self.sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                if not task.cancelled() and isinstance(task.exception(), Exception) \
+                        and not isinstance(task.exception(), WebSocketDisconnect):
+                    logger.warning(f"Stream of session {session_id} failed: {task.exception()}")
+            if self.overflowed:
+                logger.warning(f"Stream client of session {session_id} fell behind; disconnecting it.")
+                await self.websocket.close(code=1013, reason="Client too slow.")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.manager.auto_chat.remove_listener(self.on_partial, self.on_turn_done)
+            get_event_bus().unsubscribe(session_id, self.on_event)
+
+
+@router.websocket('/sessions/{session_id}/stream')
+async def stream_session(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+    sessions = registry()
+    if await asyncio.to_thread(sessions.db.get_session, session_id) is None:
+        await websocket.close(code=4404, reason="Session not found.")
+        return
+    try:
+        manager = await sessions.acquire_async(session_id)
+    except SessionNotFound:
+        await websocket.close(code=4404, reason="Session not found.")
+        return
+    try:
+        await SessionStream(websocket, manager).run()
+    finally:
+        # Like a browser tab: the last viewer leaving cancels the session's work
+        sessions.release(session_id)
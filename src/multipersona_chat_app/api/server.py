@@ -0,0 +1,54 @@
+"""
+The API of api/router.py without the NiceGUI pages, for other services and load tests.
+
+Run from the repository root:
+    PYTHONPATH=src/multipersona_chat_app python -m api.server --port 8081
+"""
+import argparse
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI
+
+from api.router import router, setup_api
+from chats.session_registry import create_session_registry
+from telemetry.log_pipeline import setup_logging
+from utils import load_settings, get_available_characters
+
+CHARACTERS_DIR = os.path.join("src", "multipersona_chat_app", "characters")
+
+
+def create_app() -> FastAPI:
+    characters = get_available_characters(CHARACTERS_DIR)
+    session_registry = create_session_registry(load_settings(), characters)
+    setup_api(session_registry, characters)
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI):
+        eviction = asyncio.create_task(session_registry.run_eviction_loop())
+        yield
+        eviction.cancel()
+        for manager in session_registry.managers():
+            manager.stop_automatic_chat()
+            manager.cancel_session_work("Server shutting down.")
+
+    app = FastAPI(title="Multipersona Chat API", lifespan=lifespan)
+    app.include_router(router)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the REST and WebSocket API without the UI.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    os.makedirs("output", exist_ok=True)
+    setup_logging("output")
+    uvicorn.run(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,576 @@
+"""
+A stand-in Ollama server for offline load and latency tests.
+
+Implements the parts of the Ollama API the application uses:
+- POST /api/generate    (streamed or not; structured output when "format" is a JSON schema)
+- POST /api/chat
+- POST /api/embeddings  and  POST /api/embed
+- GET  /api/tags        and  GET  /api/ps
+
+Generation speed is simulated with a configurable time to first token and a
+token rate. Structured requests get canned outputs that validate against the
+requested schema (Interaction, LeanInteraction, CharacterPlan,
+CharacterIntroductionOutput, InteractionValidationOutput, ...); the texts are
+picked deterministically from a hash of the prompt, so a run can be reproduced
+while consecutive turns still differ. Embeddings are hashed bags of words:
+deterministic, and similar texts get similar vectors.
+
+Errors can be injected before a response (HTTP status) or in the middle of a
+stream. Request, byte and token counters are served at GET /fake/stats; the
+simulation settings can be changed at runtime with POST /fake/config.
+
+In-process use (e.g. from a benchmark):
+    server = FakeOllamaServer(FakeOllamaSettings(time_to_first_token=0.2)).start()
+    ... point 'endpoints' / 'api_url' of the LLM config at server.base_url ...
+    server.stop()
+
+FakeOllamaProcess has the same interface but runs the server in a separate
+process, so it does not compete with the code under test for the GIL or show
+up in its profiles.
+
+Standalone, from the repository root:
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.fake_ollama --port 11435 --ttft 0.3 --tps 40
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = ["dolphin-mixtral:8x22b-v2.9-q3_K_S", "snowflake-arctic-embed2:latest"]
+
+# Characters per simulated token (roughly what Llama-style tokenizers produce for English)
+CHARS_PER_TOKEN = 4
+
+
+class FakeOllamaSettings(BaseModel):
+    time_to_first_token: float = 0.05   # seconds before the first chunk
+    tokens_per_second: float = 200.0    # generation speed after the first token (0 = no delay)
+    embedding_latency: float = 0.005    # seconds per embedding request
+    embedding_dimensions: int = 1024
+    error_rate: float = 0.0             # probability that a request fails with error_status
+    error_status: int = 500
+    stream_error_rate: float = 0.0      # probability that a stream breaks off halfway
+    seed: int = 0                       # seeds error injection and the canned texts
+    models: List[str] = DEFAULT_MODELS
+
+
+class FakeOllamaStats:
+    """Counters of everything the fake server has handled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests: Dict[str, int] = {}
+            self.errors = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.prompt_tokens = 0
+            self.tokens_out = 0
+            self.active_streams = 0
+            self.max_active_streams = 0
+
+    def record_request(self, path: str, size: int):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.bytes_in += size
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.max_active_streams = max(self.max_active_streams, self.active_streams)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': sum(self.requests.values()),
+                'errors': self.errors,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'prompt_tokens': self.prompt_tokens,
+                'tokens_out': self.tokens_out,
+                'active_streams': self.active_streams,
+                'max_active_streams': self.max_active_streams,
+            }
+
+
+#
+# Deterministic content
+#
+FIELD_TEXTS: Dict[str, List[str]] = {
+    'purpose': [
+        "Find out what the others are planning",
+        "Keep the conversation going",
+        "Get a closer look at the surroundings",
+        "Earn the trust of the group",
+    ],
+    'affect': ["Curious", "Calm but alert", "Slightly impatient", "Amused", "Cautious"],
+    'action': [
+        "Leans against the wall and glances around the room",
+        "Takes a slow sip from a cup and sets it down",
+        "Steps closer to the table and studies the map",
+        "Crosses the arms and waits for an answer",
+        "Adjusts a sleeve and looks toward the door",
+    ],
+    'dialogue': [
+        "So, what brings everyone here tonight?",
+        "I have a feeling we are being watched.",
+        "Let's not waste any more time.",
+        "That is an interesting idea. Tell me more.",
+        "I did not expect to see you here.",
+    ],
+    'introduction_text': [
+        "A traveler in a weathered coat stands near the entrance, taking in the room with quiet attention.",
+        "A figure with a calm expression waits by the window, hands resting on a worn leather bag.",
+    ],
+    'current_location': ["Near the entrance", "By the window", "At the corner table"],
+    'goal': ["Learn what the others know", "Find a safe place to rest", "Uncover the secret of the place"],
+    'steps': ["Listen to the conversation", "Ask a careful question", "Follow up on the answer"],
+    'is_valid': ["yes"],
+    'hair': ["Short and tidy", "Long, tied back"],
+    'clothing': ["A weathered travel coat", "A simple linen shirt"],
+}
+
+# Fields left empty: an empty location or appearance means "unchanged"
+EMPTY_FIELDS = {
+    'new_location', 'accessories_and_held_items', 'posture_and_body_language', 'other_relevant_details'
+}
+
+SUMMARY_TEXTS = [
+    "The characters met and exchanged a few cautious words. Nobody has changed location.",
+    "The group discussed their plans and agreed to keep an eye on each other.",
+    "Tension rose briefly, then the conversation turned to the surroundings.",
+]
+
+
+def _pick(options: List[str], seed: str, salt: str) -> str:
+    digest = hashlib.sha256(f"{seed}\0{salt}".encode('utf-8')).digest()
+    return options[int.from_bytes(digest[:4], 'big') % len(options)]
+
+
+def _resolve(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    ref = schema.get('$ref')
+    if ref and ref.startswith('#/'):
+        node: Any = root
+        for part in ref[2:].split('/'):
+            node = node.get(part, {})
+        return _resolve(node, root)
+    return schema
+
+
+def instance_for_schema(schema: Dict[str, Any], seed: str, root: Optional[Dict[str, Any]] = None, name: str = "") -> Any:
+    """A value that validates against `schema`, with texts chosen by field name and `seed`."""
+    root = root if root is not None else schema
+    schema = _resolve(schema, root)
+
+    if 'anyOf' in schema:
+        # Optional[...] fields: prefer null, which every Optional field accepts
+        options = [_resolve(option, root) for option in schema['anyOf']]
+        if any(option.get('type') == 'null' for option in options):
+            return None
+        return instance_for_schema(options[0], seed, root, name)
+    if 'enum' in schema:
+        return schema['enum'][0]
+
+    kind = schema.get('type')
+    if kind == 'object' or 'properties' in schema:
+        return {
+            prop: instance_for_schema(sub, seed, root, prop)
+            for prop, sub in schema.get('properties', {}).items()
+        }
+    if kind == 'array':
+        if name in FIELD_TEXTS:
+            return list(FIELD_TEXTS[name])
+        return [instance_for_schema(schema.get('items', {}), seed, root, name)]
+    if kind == 'integer':
+        return 0
+    if kind == 'number':
+        return 0.0
+    if kind == 'boolean':
+        return True
+    if kind == 'null':
+        return None
+    if name in EMPTY_FIELDS:
+        return ""
+    if name in FIELD_TEXTS:
+        return _pick(FIELD_TEXTS[name], seed, name)
+    if name.startswith('why_'):
+        return f"Because of what just happened ({_pick(FIELD_TEXTS['affect'], seed, name).lower()})."
+    return _pick(SUMMARY_TEXTS, seed, name)
+
+
+def canned_output(prompt: str, output_format: Any = None) -> str:
+    """The full output for a prompt: JSON for a schema (or "json"), plain text otherwise."""
+    seed = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    if isinstance(output_format, dict):
+        return json.dumps(instance_for_schema(output_format, seed))
+    if output_format == 'json':
+        return json.dumps({'response': _pick(SUMMARY_TEXTS, seed, 'json')})
+    return _pick(SUMMARY_TEXTS, seed, 'text')
+
+
+def split_tokens(text: str) -> List[str]:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def hash_embedding(text: str, dimensions: int = 1024) -> List[float]:
+    """
+    A deterministic, L2-normalized bag-of-words embedding: every word adds +-1 at a
+    position derived from its hash. Texts sharing words get a high cosine similarity.
+    """
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'big') % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return vector
+    return [v / norm for v in vector]
+
+
+#
+# ASGI app
+#
+def create_app(settings: Optional[FakeOllamaSettings] = None, stats: Optional[FakeOllamaStats] = None) -> FastAPI:
+    settings = settings or FakeOllamaSettings()
+    stats = stats or FakeOllamaStats()
+    rng = random.Random(settings.seed)
+    app = FastAPI(title="Fake Ollama")
+    app.state.settings = settings
+    app.state.stats = stats
+
+    def current() -> FakeOllamaSettings:
+        return app.state.settings
+
+    async def read_json(request: Request) -> Dict[str, Any]:
+        raw = await request.body()
+        stats.record_request(request.url.path, len(raw))
+        return json.loads(raw) if raw else {}
+
+    def injected_error() -> Optional[JSONResponse]:
+        if current().error_rate and rng.random() < current().error_rate:
+            stats.add(errors=1)
+            return JSONResponse({'error': "injected error"}, status_code=current().error_status)
+        return None
+
+    def respond(payload: Dict[str, Any]) -> JSONResponse:
+        response = JSONResponse(payload)
+        stats.add(bytes_out=len(response.body))
+        return response
+
+    def timings(prompt_tokens: int, tokens: int, started: float) -> Dict[str, Any]:
+        elapsed = int((time.monotonic() - started) * 1e9)
+        first_token = int(current().time_to_first_token * 1e9)
+        return {
+            'total_duration': elapsed,
+            'load_duration': 0,
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': min(first_token, elapsed),
+            'eval_count': tokens,
+            'eval_duration': max(0, elapsed - first_token),
+        }
+
+    async def generation(body: Dict[str, Any], chunk_frame, done_frame) -> Any:
+        """Simulate a generation; returns a streaming response or, for stream=false, the full JSON."""
+        if body.get('prompt') is None and not body.get('messages'):
+            # An empty request only loads or unloads the model
+            return respond(done_frame("", {}, 'unload' if body.get('keep_alive') == 0 else 'load'))
+
+        prompt = body.get('prompt') or json.dumps(body.get('messages', []))
+        system = body.get('system') or ""
+        output = canned_output(system + prompt, body.get('format'))
+        tokens = split_tokens(output)
+        num_predict = (body.get('options') or {}).get('num_predict')
+        if num_predict and num_predict > 0:
+            tokens = tokens[:num_predict]
+        prompt_tokens = max(1, len(system + prompt) // CHARS_PER_TOKEN)
+        stats.add(prompt_tokens=prompt_tokens)
+        started = time.monotonic()
+        delay = 1.0 / current().tokens_per_second if current().tokens_per_second > 0 else 0.0
+        break_at = (
+            len(tokens) // 2
+            if current().stream_error_rate and rng.random() < current().stream_error_rate else None
+        )
+
+        if not body.get('stream', True):
+            await asyncio.sleep(current().time_to_first_token + delay * len(tokens))
+            stats.add(tokens_out=len(tokens))
+            return respond(done_frame("".join(tokens), timings(prompt_tokens, len(tokens), started), 'stop'))
+
+        async def stream() -> AsyncIterator[bytes]:
+            stats.add(active_streams=1)
+            try:
+                await asyncio.sleep(current().time_to_first_token)
+                for index, token in enumerate(tokens):
+                    if index == break_at:
+                        stats.add(errors=1)
+                        line = json.dumps({'error': "injected stream error"}).encode('utf-8') + b"\n"
+                        stats.add(bytes_out=len(line))
+                        yield line
+                        return
+                    if index > 0 and delay:
+                        await asyncio.sleep(delay)
+                    line = json.dumps(chunk_frame(token)).encode('utf-8') + b"\n"
+                    stats.add(bytes_out=len(line), tokens_out=1)
+                    yield line
+                line = json.dumps(done_frame("", timings(prompt_tokens, len(tokens), started), 'stop')).encode('utf-8') + b"\n"
+                stats.add(bytes_out=len(line))
+                yield line
+            finally:
+                # Also reached when the client closes the stream (cancelled generation)
+                stats.add(active_streams=-1)
+
+        return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+    def now() -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    @app.post('/api/generate')
+    async def api_generate(request: Request):
+        body = await read_json(request)
+        error = injected_error()
+        if error:
+            return error
+        model = body.get('model', "")
+
+        def chunk_frame(token: str) -> Dict[str, Any]:
+            return {'model': model, 'created_at': now(), 'response': token, 'done': False}
+
+        def done_frame(text: str, stats_fields: Dict[str, Any], reason: str) -> Dict[str, Any]:
+            return {'model': model, 'created_at': now(), 'response': text, 'done': True, 'done_reason': reason, **stats_fields}
+
+        return await generation(body, chunk_frame, done_frame)
+
+    @app.post('/api/chat')
+    async def api_chat(request: Request):
+        body = await read_json(request)
+        error = injected_error()
+        if error:
+            return error
+        model = body.get('model', "")
+
+        def chunk_frame(token: str) -> Dict[str, Any]:
+            return {'model': model, 'created_at': now(), 'message': {'role': 'assistant', 'content': token}, 'done': False}
+
+        def done_frame(text: str, stats_fields: Dict[str, Any], reason: str) -> Dict[str, Any]:
+            return {
+                'model': model, 'created_at': now(), 'message': {'role': 'assistant', 'content': text},
+                'done': True, 'done_reason': reason, **stats_fields
+            }
+
+        return await generation(body, chunk_frame, done_frame)
+
+    @app.post('/api/embeddings')
+    async def api_embeddings(request: Request):
+        body = await read_json(request)
+        error = injected_error()
+        if error:
+            return error
+        await asyncio.sleep(current().embedding_latency)
+        return respond({'embedding': hash_embedding(body.get('prompt') or "", current().embedding_dimensions)})
+
+    @app.post('/api/embed')
+    async def api_embed(request: Request):
+        body = await read_json(request)
+        error = injected_error()
+        if error:
+            return error
+        inputs = body.get('input') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await asyncio.sleep(current().embedding_latency)
+        return respond({
+            'model': body.get('model', ""),
+            'embeddings': [hash_embedding(text, current().embedding_dimensions) for text in inputs],
+        })
+
+    @app.get('/api/tags')
+    async def api_tags(request: Request):
+        stats.record_request(request.url.path, 0)
+        return respond({'models': [{'name': m, 'model': m, 'size': 0} for m in current().models]})
+
+    @app.get('/api/ps')
+    async def api_ps(request: Request):
+        stats.record_request(request.url.path, 0)
+        return respond({'models': [{'name': m, 'model': m, 'size': 0} for m in current().models]})
+
+    @app.get('/fake/stats')
+    async def fake_stats():
+        return stats.snapshot()
+
+    @app.post('/fake/stats/reset')
+    async def fake_stats_reset():
+        stats.reset()
+        return stats.snapshot()
+
+    @app.post('/fake/config')
+    async def fake_config(request: Request):
+        changes = json.loads(await request.body() or b"{}")
+        app.state.settings = current().model_copy(update=changes)
+        return app.state.settings.model_dump()
+
+    return app
+
+
+class FakeOllamaServer:
+    """Runs the fake server with uvicorn in a background thread."""
+
+    def __init__(self, settings: Optional[FakeOllamaSettings] = None, host: str = "127.0.0.1", port: int = 0):
+        self.settings = settings or FakeOllamaSettings()
+        self.stats = FakeOllamaStats()
+        self.app = create_app(self.settings, self.stats)
+        self.host = host
+        self.port = port
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 10.0) -> "FakeOllamaServer":
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="fake-ollama", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Fake Ollama server did not start.")
+            time.sleep(0.01)
+        if self.port == 0:
+            # Port 0 lets the OS pick a free port; read back which one
+            self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        logger.info(f"Fake Ollama server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+            self._server = None
+
+    def configure(self, **changes):
+        """Change the simulation settings of the running server."""
+        self.app.state.settings = self.app.state.settings.model_copy(update=changes)
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeOllamaProcess:
+    """Runs the fake server in a child process (python -m benchmarks.fake_ollama)."""
+
+    def __init__(self, settings: Optional[FakeOllamaSettings] = None, host: str = "127.0.0.1", port: int = 0):
+        self.settings = settings or FakeOllamaSettings()
+        self.host = host
+        self.port = port
+        self._process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 20.0) -> "FakeOllamaProcess":
+        if self.port == 0:
+            with socket.socket() as s:
+                s.bind((self.host, 0))
+                self.port = s.getsockname()[1]
+        settings = self.settings
+        command = [
+            sys.executable, '-m', 'benchmarks.fake_ollama', '--host', self.host, '--port', str(self.port),
+            '--ttft', str(settings.time_to_first_token), '--tps', str(settings.tokens_per_second),
+            '--embedding-latency', str(settings.embedding_latency), '--error-rate', str(settings.error_rate),
+            '--error-status', str(settings.error_status), '--stream-error-rate', str(settings.stream_error_rate),
+            '--seed', str(settings.seed), '--models', *settings.models
+        ]
+        app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [app_dir, os.environ.get('PYTHONPATH')])))
+        self._process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError("Fake Ollama server process exited during startup.")
+            try:
+                requests.get(f"{self.base_url}/api/tags", timeout=1).raise_for_status()
+                logger.info(f"Fake Ollama server process listening on {self.base_url}")
+                return self
+            except requests.RequestException:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Fake Ollama server process did not start within {timeout}s.")
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait(timeout=10)
+            self._process = None
+
+    def configure(self, **changes):
+        """Change the simulation settings of the running server."""
+        requests.post(f"{self.base_url}/fake/config", json=changes, timeout=5).raise_for_status()
+
+    def __enter__(self) -> "FakeOllamaProcess":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server for offline load and latency tests.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--ttft', type=float, default=0.05, help="time to first token in seconds")
+    parser.add_argument('--tps', type=float, default=200.0, help="generated tokens per second (0 = no delay)")
+    parser.add_argument('--embedding-latency', type=float, default=0.005)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--stream-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--models', nargs='*', default=DEFAULT_MODELS)
+    args = parser.parse_args()
+
+    settings = FakeOllamaSettings(
+        time_to_first_token=args.ttft,
+        tokens_per_second=args.tps,
+        embedding_latency=args.embedding_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_error_rate=args.stream_error_rate,
+        seed=args.seed,
+        models=args.models
+    )
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the per-call overhead of structured LLM requests before the
+first byte is sent, and for parsing the accumulated output afterwards.
+
+Compares the old per-call path (new OllamaClient reading the YAML config, schema
+rebuilt with model_json_schema(), parse_raw) against the shared client factory
+and schema registry.
+
+Run from the repository root:
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.request_overhead
+"""
+import argparse
+import json
+import timeit
+import warnings
+
+from llm.ollama_client import OllamaClient
+from llm.client_factory import get_llm_client, DEFAULT_LLM_CONFIG_PATH
+from llm.schema_registry import parse_output
+from models.interaction import Interaction, AppearanceSegments
+from chats.chat_manager import CharacterPlan, InteractionValidationOutput
+from templates import CharacterIntroductionOutput
+
+PROMPT = "Generate the next interaction. " * 200
+SYSTEM = "You are a character in a story. " * 100
+
+SAMPLE_OUTPUT = Interaction(
+    purpose="Get the party's attention",
+    why_purpose="Nobody has praised her today",
+    affect="Impatient",
+    why_affect="She has been ignored",
+    action="Taps her staff on the floor repeatedly",
+    why_action="To make noise",
+    dialogue="Hey! Is nobody going to thank me?",
+    why_dialogue="She wants recognition",
+    new_location="",
+    why_new_location="She stays where she is",
+    new_appearance=AppearanceSegments(posture_and_body_language="Hands on hips"),
+    why_new_appearance="Her stance shows her annoyance"
+).model_dump_json()
+
+
+def request_setup_per_call(model):
+    """The baseline path: a fresh client and a freshly built schema for every call."""
+    client = OllamaClient(DEFAULT_LLM_CONFIG_PATH, output_model=model)
+    settings = client.get_profile('interaction')
+    payload = {
+        'model': settings['model'],
+        'prompt': PROMPT,
+        'system': SYSTEM,
+        'stream': True,
+        'options': {'temperature': settings['temperature']},
+        'format': model.model_json_schema()
+    }
+    return json.dumps(payload).encode('utf-8')
+
+
+def request_setup_shared(model):
+    """The shared path: cached client, config and pre-serialized schema."""
+    client = get_llm_client(model)
+    _, _, body = client.build_request(PROMPT, client.get_profile('interaction'), system=SYSTEM)
+    return body
+
+
+def parse_per_call():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return Interaction.parse_raw(SAMPLE_OUTPUT)
+
+
+def parse_shared():
+    return parse_output(Interaction, SAMPLE_OUTPUT)
+
+
+def measure(func, number: int, *args) -> float:
+    """Mean time per call in microseconds."""
+    func(*args)  # warm-up
+    total = timeit.timeit(lambda: func(*args), number=number)
+    return total / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-call LLM request overhead.")
+    parser.add_argument("--number", type=int, default=500, help="Calls per measurement")
+    args = parser.parse_args()
+
+    models = [Interaction, CharacterPlan, CharacterIntroductionOutput, InteractionValidationOutput]
+    print(f"{'measurement':<45} {'per call (us)':>15} {'shared (us)':>15} {'speedup':>9}")
+    for model in models:
+        before = measure(request_setup_per_call, args.number, model)
+        after = measure(request_setup_shared, args.number, model)
+        print(f"{'request setup: ' + model.__name__:<45} {before:>15.1f} {after:>15.1f} {before / after:>8.1f}x")
+
+    before = measure(parse_per_call, args.number)
+    after = measure(parse_shared, args.number)
+    print(f"{'parse output: Interaction':<45} {before:>15.1f} {after:>15.1f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
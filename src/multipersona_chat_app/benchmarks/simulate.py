@@ -0,0 +1,330 @@
+"""
+Headless multi-session simulation for throughput and capacity tests.
+
+Starts N independent sessions, each with its own setting and a random subset of
+the characters in characters/, and runs the automatic chat of every session for
+M turns concurrently through ChatManager, without NiceGUI. Sessions run either
+as asyncio tasks in one process (--mode asyncio, like the app) or spread over a
+process pool (--mode process; every process has its own LLM scheduler and
+database, so the backend sees up to workers x slots concurrent requests).
+
+The backend is the fake Ollama server (benchmarks/fake_ollama.py, run in its own
+process) or any Ollama host or pool given with --backend-url. Reports, as JSON:
+- turns/sec over the whole run, turn latency percentiles,
+- LLM calls per turn and latency percentiles per call type (from the
+  llm_calls ledger),
+- database size growth, in total and per turn.
+
+With --record, all LLM traffic is written to a cassette (llm/cassette.py);
+--replay serves it back instead of a backend, so the same workload can be
+rerun to compare DB or scheduling changes. In process mode every worker has its
+own cassette file (<name>.worker<i>.<ext>); replay with the same --workers.
+
+Run from the repository root:
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.simulate --sessions 8 --turns 20
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.simulate --sessions 32 --turns 10 --mode process --workers 4
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.simulate --record output/sim.jsonl.gz
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.simulate --replay output/sim.jsonl.gz --replay-speed 0
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fake_ollama import FakeOllamaProcess, FakeOllamaSettings
+from benchmarks.turn_latency import CHARACTERS_DIR, BackendCounters, configure_backend, git_revision, percentiles
+from chats.chat_manager import ChatManager
+from db.db_manager import DBManager
+from llm.call_ledger import get_call_ledger
+from llm.cassette import close_cassettes, get_cassette
+from llm.client_factory import get_llm_config
+from utils import load_settings, get_available_characters
+
+REPLAY_BASE_URL = "http://cassette-replay:11434"
+
+
+def plan_sessions(args, settings: List[Dict], character_names: List[str]) -> List[Dict[str, Any]]:
+    """The setting and characters of every session, reproducible from --seed."""
+    rng = random.Random(args.seed)
+    order = list(settings)
+    rng.shuffle(order)
+    size = max(1, min(args.characters, len(character_names)))
+    return [
+        {
+            'session_id': f"sim-{args.seed}-{i}",
+            'setting': order[i % len(order)]['name'],
+            'characters': sorted(rng.sample(character_names, size)),
+        }
+        for i in range(args.sessions)
+    ]
+
+
+def configure_scheduler(slots: Optional[int]):
+    """Override the scheduler slots of the LLM config; must run before the scheduler is first used."""
+    if not slots:
+        return
+    scheduler = get_llm_config().setdefault('scheduler', {})
+    scheduler['total_slots'] = slots
+    scheduler.setdefault('limits', {})['turn'] = slots
+
+
+def configure_cassette(options: Dict[str, Any], worker: Optional[int] = None):
+    """Record to or replay from the cassette of the options; each worker process gets its own file."""
+    path = options['cassette_path']
+    if not path:
+        return
+    if worker is not None:
+        directory, name = os.path.split(path)
+        stem, dot, ext = name.partition('.')
+        path = os.path.join(directory, f"{stem}.worker{worker}{dot}{ext}")
+    get_llm_config()['cassette'] = {'mode': options['cassette_mode'], 'path': path, 'speed': options['replay_speed']}
+
+
+def cassette_stats() -> Optional[Dict[str, Any]]:
+    cassette = get_cassette(get_llm_config())
+    return cassette.stats() if cassette else None
+
+
+def database_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal", f"{path}-journal") if os.path.exists(p))
+
+
+async def run_session(spec: Dict[str, Any], options: Dict[str, Any], db: DBManager, settings, characters) -> Dict[str, Any]:
+    ordered = [s for s in settings if s['name'] == spec['setting']] + [s for s in settings if s['name'] != spec['setting']]
+    manager = ChatManager(you_name="You", session_id=spec['session_id'], settings=ordered, db=db)
+    for name in spec['characters']:
+        manager.add_character(name, characters[name])
+
+    turns = options['turns']
+    latencies: List[float] = []
+    stats = {'turns': 0, 'empty_turns': 0}
+    generate_next_turn = manager.generate_next_turn
+
+    async def timed_turn(*args, **kwargs):
+        started = time.perf_counter()
+        speaker = await generate_next_turn(*args, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        if speaker is None:
+            stats['empty_turns'] += 1
+            # Give up on a session whose turns keep failing
+            if stats['empty_turns'] >= max(3, turns):
+                manager.stop_automatic_chat()
+        return speaker
+
+    def on_turn_done(speaker: Optional[str]):
+        if speaker is None:
+            return
+        stats['turns'] += 1
+        if stats['turns'] >= turns:
+            manager.stop_automatic_chat()
+
+    manager.generate_next_turn = timed_turn
+    manager.auto_chat.min_delay = options['think_time']
+    manager.auto_chat.pacing_factor = 0.0
+    manager.auto_chat.add_listener(on_turn_done=on_turn_done)
+
+    started = time.perf_counter()
+    manager.start_automatic_chat()
+    await manager.auto_chat.task
+    if manager.background_tasks:
+        await asyncio.gather(*manager.background_tasks, return_exceptions=True)
+    return {
+        'session_id': spec['session_id'],
+        'turns': stats['turns'],
+        'empty_turns': stats['empty_turns'],
+        'wall_time_s': time.perf_counter() - started,
+        'latencies': latencies,
+    }
+
+
+async def run_sessions(specs: List[Dict[str, Any]], options: Dict[str, Any], db_path: str) -> List[Dict[str, Any]]:
+    settings = load_settings()
+    characters = get_available_characters(CHARACTERS_DIR)
+    db = DBManager(db_path)
+    get_call_ledger().attach(db)
+    # LLM validation is sampled at random; a fixed seed keeps record and replay on the same calls
+    random.seed(options['seed'])
+    sessions = await asyncio.gather(*(run_session(spec, options, db, settings, characters) for spec in specs))
+    # The report reads the ledger from the database
+    get_call_ledger().flush()
+    return sessions
+
+
+def run_worker(specs: List[Dict[str, Any]], options: Dict[str, Any], db_path: str, worker: int) -> Dict[str, Any]:
+    """Process pool entry point: run a share of the sessions with this process's own scheduler and database."""
+    configure_backend(options['base_url'], f"{db_path}.llm_cache")
+    configure_scheduler(options['slots'])
+    configure_cassette(options, worker)
+    sessions = asyncio.run(run_sessions(specs, options, db_path))
+    stats = cassette_stats()
+    # Pool workers do not run atexit handlers, so the cassette is closed here
+    close_cassettes()
+    return {'sessions': sessions, 'cassette': stats}
+
+
+def llm_call_report(db_paths: List[str], turns: int) -> Dict[str, Any]:
+    calls = defaultdict(list)
+    outcomes = defaultdict(int)
+    for path in db_paths:
+        for call in DBManager(path).get_llm_calls(limit=10 ** 9):
+            calls[call['call_type']].append(call['total_ms'])
+            outcomes[call['outcome']] += 1
+    total = sum(len(v) for v in calls.values())
+    return {
+        'calls': total,
+        'calls_per_turn': round(total / turns, 3) if turns else None,
+        'calls_per_turn_by_type': {k: round(len(v) / turns, 3) for k, v in calls.items()} if turns else {},
+        'latency_ms_by_type': {k: percentiles(v) for k, v in sorted(calls.items())},
+        'outcomes': dict(outcomes),
+    }
+
+
+def run_simulation(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="simulate-")
+    backend = None
+    if args.replay:
+        # Nothing is sent to this host: the cassette answers every request
+        base_url = REPLAY_BASE_URL
+    elif args.backend_url:
+        base_url = args.backend_url.rstrip('/')
+    else:
+        backend = FakeOllamaProcess(FakeOllamaSettings(
+            time_to_first_token=args.ttft,
+            tokens_per_second=args.tps,
+            error_rate=args.error_rate,
+            seed=args.seed
+        )).start()
+        base_url = backend.base_url
+
+    try:
+        settings = load_settings()
+        character_names = sorted(get_available_characters(CHARACTERS_DIR))
+        if not character_names:
+            raise RuntimeError(f"No characters found in {CHARACTERS_DIR}.")
+        specs = plan_sessions(args, settings, character_names)
+        options = {
+            'turns': args.turns,
+            'think_time': args.think_time,
+            'slots': args.slots,
+            'base_url': base_url,
+            'seed': args.seed,
+            'cassette_mode': 'replay' if args.replay else 'record' if args.record else None,
+            'cassette_path': args.replay or args.record,
+            'replay_speed': args.replay_speed,
+        }
+        counters = BackendCounters(base_url)
+        backend_before = counters.read() if not args.replay else None
+
+        started = time.perf_counter()
+        if args.mode == 'process':
+            workers = max(1, min(args.workers, len(specs)))
+            shares = [specs[i::workers] for i in range(workers)]
+            db_paths = [os.path.join(workdir, f"simulate-{i}.db") for i in range(workers)]
+            # Spawn rather than fork: the parent may already run threads (HTTP pools, health checks)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [
+                    pool.submit(run_worker, share, options, path, i)
+                    for i, (share, path) in enumerate(zip(shares, db_paths))
+                ]
+                results = [future.result() for future in futures]
+            sessions = [session for result in results for session in result['sessions']]
+            cassettes = [result['cassette'] for result in results if result['cassette']]
+        else:
+            db_paths = [os.path.join(workdir, "simulate.db")]
+            configure_backend(base_url, os.path.join(workdir, "llm_cache"))
+            configure_scheduler(args.slots)
+            configure_cassette(options)
+            # An empty database is created before the clock starts, so growth is only the sessions' data
+            DBManager(db_paths[0])
+            sessions = asyncio.run(run_sessions(specs, options, db_paths[0]))
+            cassettes = [c for c in [cassette_stats()] if c]
+        wall_time = time.perf_counter() - started
+
+        by_id = {s['session_id']: s for s in sessions}
+        turns = sum(s['turns'] for s in sessions)
+        latencies = [latency for s in sessions for latency in s['latencies']]
+        db_bytes = sum(database_size(path) for path in db_paths)
+        backend_after = counters.read() if backend_before else None
+        return {
+            'benchmark': 'simulate',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+            'backend': 'cassette' if args.replay else base_url if args.backend_url else 'fake_ollama',
+            'cassettes': cassettes or None,
+            'sessions': [
+                {**spec, 'turns': by_id[spec['session_id']]['turns'], 'empty_turns': by_id[spec['session_id']]['empty_turns'],
+                 'wall_time_s': round(by_id[spec['session_id']]['wall_time_s'], 3)}
+                for spec in specs
+            ],
+            'throughput': {
+                'turns': turns,
+                'empty_turns': sum(s['empty_turns'] for s in sessions),
+                'wall_time_s': round(wall_time, 3),
+                'turns_per_second': round(turns / wall_time, 3) if wall_time else None,
+            },
+            'turn_latency_ms': percentiles(latencies, scale=1000.0),
+            'llm': llm_call_report(db_paths, turns),
+            'database': {
+                'bytes': db_bytes,
+                'bytes_per_turn': round(db_bytes / turns, 1) if turns else None,
+                'files': len(db_paths),
+            },
+            'backend_stats': {
+                'requests': backend_after['total_requests'] - backend_before['total_requests'],
+                'bytes_in': backend_after['bytes_in'] - backend_before['bytes_in'],
+                'bytes_out': backend_after['bytes_out'] - backend_before['bytes_out'],
+                'max_concurrent_streams': backend_after.get('max_active_streams'),
+            } if backend_before and backend_after else None,
+        }
+    finally:
+        if backend is not None:
+            backend.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many auto-chat sessions concurrently and report throughput.")
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=10, help="turns per session")
+    parser.add_argument('--characters', type=int, default=2, help="characters per session")
+    parser.add_argument('--mode', choices=['asyncio', 'process'], default='asyncio')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="process mode: number of processes")
+    parser.add_argument('--slots', type=int, default=None, help="override scheduler total_slots (per process)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="auto-chat delay between the turns of a session")
+    parser.add_argument('--backend-url', default=None, help="Ollama host to use instead of a fake server")
+    parser.add_argument('--ttft', type=float, default=0.05, help="fake backend: time to first token in seconds")
+    parser.add_argument('--tps', type=float, default=200.0, help="fake backend: tokens per second")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fake backend: share of failing requests")
+    parser.add_argument('--seed', type=int, default=0)
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', default=None, metavar='CASSETTE', help="record all LLM traffic to this cassette")
+    cassette.add_argument('--replay', default=None, metavar='CASSETTE', help="serve all LLM traffic from this cassette")
+    parser.add_argument('--replay-speed', type=float, default=1.0, help="replay: 1.0 = recorded timing, 0 = instantly")
+    parser.add_argument('--output', default=None, help="write the JSON result to this file (default: stdout)")
+    args = parser.parse_args()
+
+    result = run_simulation(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    print(
+        f"{result['throughput']['turns']} turns in {result['throughput']['wall_time_s']}s "
+        f"({result['throughput']['turns_per_second']} turns/s), "
+        f"p95 turn latency {result['turn_latency_ms'].get('p95')} ms",
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    main()
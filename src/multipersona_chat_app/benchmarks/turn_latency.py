@@ -0,0 +1,349 @@
+"""
+End-to-end turn latency benchmark.
+
+Drives a ChatManager through character introductions, N turns, user messages
+and the summarization threshold against the fake Ollama server
+(benchmarks/fake_ollama.py, started in-process) or any server given with
+--backend-url. Reports, as JSON:
+- p50/p95/p99 per stage: turn, plan update, prompt build, generation,
+  validation, repetition check, DB writes, summarization, and every LLM call
+  by generation profile,
+- per turn: DB queries (statements sent to SQLite) and bytes sent to and
+  received from the backend.
+
+Results can be compared with an earlier run: with --baseline, every stage whose
+p95 grew by more than --tolerance is reported and the exit code is 1.
+
+Run from the repository root:
+    PYTHONPATH=src/multipersona_chat_app python -m benchmarks.turn_latency --turns 30 --output turns.json
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import requests
+
+from benchmarks.fake_ollama import FakeOllamaServer, FakeOllamaSettings
+from chats.chat_manager import ChatManager
+from db.db_manager import DBManager
+from llm.call_ledger import get_call_ledger
+from llm.client_factory import get_llm_config, reset_llm_clients
+from llm.ollama_client import OllamaClient
+from utils import load_settings, get_available_characters
+
+CHARACTERS_DIR = os.path.join("src", "multipersona_chat_app", "characters")
+
+# Stage name -> ChatManager method timed as that stage
+MANAGER_STAGES = {
+    'turn': 'generate_next_turn',
+    'plan_update': 'update_character_plan',
+    'prompt_build': 'build_prompt_for_character',
+    'introduction_prompt_build': 'build_introduction_prompts_for_character',
+    'introduction': 'generate_character_introduction_message',
+    'validation': 'validate_and_possibly_correct_interaction',
+    'repetition_check': 'check_and_regenerate_if_repetitive',
+    'summarization': 'summarize_history_for_character',
+    'store_message': 'add_message',
+}
+
+# LLM calls of these profiles are the generation of the turn itself
+GENERATION_PROFILES = {'interaction', 'introduction'}
+
+DB_WRITE_PREFIXES = ('save_', 'update_', 'add_', 'hide_', 'remove_', 'delete_', 'create_')
+
+
+def percentiles(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    if not values:
+        return {'count': 0}
+    data = np.array(values) * scale
+    return {
+        'count': len(values),
+        'mean': round(float(data.mean()), 3),
+        'p50': round(float(np.percentile(data, 50)), 3),
+        'p95': round(float(np.percentile(data, 95)), 3),
+        'p99': round(float(np.percentile(data, 99)), 3),
+        'max': round(float(data.max()), 3),
+        'total': round(float(data.sum()), 3),
+    }
+
+
+class StageRecorder:
+    """Collects the duration of every call of the instrumented methods, by stage."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        # list.append is atomic, so LLM calls running in worker threads can record too
+        self.samples[stage].append(seconds)
+
+    def timed(self, stage: str, fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return wrapper
+
+    def instrument(self, obj: Any, method: str, stage: str):
+        setattr(obj, method, self.timed(stage, getattr(obj, method)))
+
+    def instrument_llm_calls(self):
+        """Time every OllamaClient.generate / get_embedding call, by generation profile."""
+        recorder = self
+        generate = OllamaClient.generate
+        get_embedding = OllamaClient.get_embedding
+
+        @functools.wraps(generate)
+        def timed_generate(client, *args, **kwargs):
+            profile = kwargs.get('profile') or 'default'
+            started = time.perf_counter()
+            try:
+                return generate(client, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                recorder.record(f"llm_{profile}", elapsed)
+                if profile in GENERATION_PROFILES:
+                    recorder.record('generation', elapsed)
+
+        OllamaClient.generate = timed_generate
+        OllamaClient.get_embedding = self.timed('llm_embedding', get_embedding)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: percentiles(values, scale=1000.0) for stage, values in sorted(self.samples.items())}
+
+
+class QueryCounter:
+    """Counts the SQL statements a DBManager sends, and times its write methods as the 'db_writes' stage."""
+
+    def __init__(self, db: DBManager, recorder: StageRecorder):
+        self.statements = 0
+        self.writes = 0
+        connect = db._ensure_connection
+
+        def counting_connection():
+            conn = connect()
+            conn.set_trace_callback(self._on_statement)
+            return conn
+
+        db._ensure_connection = counting_connection
+        for name in dir(db):
+            if name.startswith(DB_WRITE_PREFIXES) and callable(getattr(db, name)):
+                recorder.instrument(db, name, 'db_writes')
+
+    def _on_statement(self, statement: str):
+        self.statements += 1
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            self.writes += 1
+
+
+class BackendCounters:
+    """Bytes exchanged with the backend, from the fake server's /fake/stats (absent on a real Ollama)."""
+
+    def __init__(self, base_url: str):
+        self.url = f"{base_url}/fake/stats"
+        self.available = True
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        if not self.available:
+            return None
+        try:
+            response = requests.get(self.url, timeout=5)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            self.available = False
+            return None
+
+
+def configure_backend(base_url: str, cache_file: str):
+    """Point the shared LLM configuration at the benchmark backend, with an empty response cache."""
+    reset_llm_clients()
+    config = get_llm_config()
+    config['endpoints'] = [base_url]
+    config['api_url'] = f"{base_url}/api/generate"
+    config['api_url_embeddings'] = f"{base_url}/api/embeddings"
+    config['cache_file'] = cache_file
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="turn-latency-")
+    server = None
+    if args.backend_url:
+        base_url = args.backend_url.rstrip('/')
+    else:
+        server = FakeOllamaServer(FakeOllamaSettings(
+            time_to_first_token=args.ttft,
+            tokens_per_second=args.tps,
+            embedding_latency=args.embedding_latency,
+            error_rate=args.error_rate,
+            seed=args.seed
+        )).start()
+        base_url = server.base_url
+    configure_backend(base_url, os.path.join(workdir, "llm_cache"))
+
+    try:
+        settings = load_settings()
+        if args.setting:
+            settings = [s for s in settings if s['name'] == args.setting] + [s for s in settings if s['name'] != args.setting]
+        characters = get_available_characters(CHARACTERS_DIR)
+        names = sorted(characters)[:args.characters]
+        if not names:
+            raise RuntimeError(f"No characters found in {CHARACTERS_DIR}.")
+
+        recorder = StageRecorder()
+        recorder.instrument_llm_calls()
+        db = DBManager(os.path.join(workdir, "benchmark.db"))
+        get_call_ledger().attach(db)
+        queries = QueryCounter(db, recorder)
+        backend = BackendCounters(base_url)
+
+        manager = ChatManager(you_name="You", session_id=f"benchmark-{uuid.uuid4()}", settings=settings, db=db)
+        if args.summarization_threshold:
+            manager.summarization_threshold = args.summarization_threshold
+            manager.to_summarize_count = manager.summarization_threshold - manager.recent_dialogue_lines
+        for stage, method in MANAGER_STAGES.items():
+            recorder.instrument(manager, method, stage)
+        for name in names:
+            manager.add_character(name, characters[name])
+
+        per_turn = defaultdict(list)
+        started = time.perf_counter()
+        for turn in range(args.turns):
+            if args.user_every and turn and turn % args.user_every == 0:
+                await manager.add_message(manager.you_name, f"What happens next? ({turn})", visible=True, message_type="user")
+
+            statements, writes = queries.statements, queries.writes
+            before = backend.read()
+            turn_started = time.perf_counter()
+            speaker = await manager.generate_next_turn()
+            per_turn['latency'].append(time.perf_counter() - turn_started)
+            per_turn['db_queries'].append(queries.statements - statements)
+            per_turn['db_write_statements'].append(queries.writes - writes)
+            after = backend.read()
+            if before and after:
+                per_turn['bytes_sent'].append(after['bytes_in'] - before['bytes_in'])
+                per_turn['bytes_received'].append(after['bytes_out'] - before['bytes_out'])
+                per_turn['llm_requests'].append(after['total_requests'] - before['total_requests'])
+            if speaker is None:
+                print(f"Turn {turn + 1} produced no message.", file=sys.stderr)
+
+        # Wait for work the turns left running in the background (e.g. two-stage state updates)
+        if manager.background_tasks:
+            await asyncio.gather(*manager.background_tasks, return_exceptions=True)
+        wall_time = time.perf_counter() - started
+        backend_stats = backend.read()
+
+        return {
+            'benchmark': 'turn_latency',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+            'backend': base_url if args.backend_url else 'fake_ollama',
+            'stages_ms': recorder.summary(),
+            'per_turn': {
+                'latency_ms': percentiles(per_turn['latency'], scale=1000.0),
+                'db_queries': percentiles(per_turn['db_queries']),
+                'db_write_statements': percentiles(per_turn['db_write_statements']),
+                'bytes_sent': percentiles(per_turn['bytes_sent']),
+                'bytes_received': percentiles(per_turn['bytes_received']),
+                'llm_requests': percentiles(per_turn['llm_requests']),
+            },
+            'totals': {
+                'turns': args.turns,
+                'messages': len(db.get_messages(manager.session_id)),
+                'wall_time_s': round(wall_time, 3),
+                'db_queries': queries.statements,
+                'db_write_statements': queries.writes,
+                'backend': backend_stats,
+            },
+        }
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """The stages (and per-turn metrics) whose p95 grew by more than `tolerance` (0.2 = 20%)."""
+    regressions = []
+    pairs = [('stages_ms', stage) for stage in result['stages_ms']] + [('per_turn', metric) for metric in result['per_turn']]
+    for section, name in pairs:
+        new = result[section].get(name, {}).get('p95')
+        old = baseline.get(section, {}).get(name, {}).get('p95')
+        if new is None or not old:
+            continue
+        if new > old * (1 + tolerance):
+            regressions.append(f"{section}.{name}: p95 {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChatManager turns against a stand-in Ollama backend.")
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--characters', type=int, default=2, help="number of characters in the session")
+    parser.add_argument('--setting', default=None, help="name of the setting to use (default: the first one)")
+    parser.add_argument('--user-every', type=int, default=5, help="add a user message every N turns (0 = never)")
+    parser.add_argument('--summarization-threshold', type=int, default=None, help="override chat_manager_config.yaml")
+    parser.add_argument('--backend-url', default=None, help="use this server instead of an in-process fake Ollama")
+    parser.add_argument('--ttft', type=float, default=0.05, help="fake backend: time to first token in seconds")
+    parser.add_argument('--tps', type=float, default=200.0, help="fake backend: tokens per second")
+    parser.add_argument('--embedding-latency', type=float, default=0.005, help="fake backend: seconds per embedding")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fake backend: share of failing requests")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write the JSON result to this file (default: stdout)")
+    parser.add_argument('--baseline', default=None, help="JSON result of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed p95 growth against the baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
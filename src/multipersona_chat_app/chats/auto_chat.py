@@ -0,0 +1,129 @@
+"""
+Automatic conversation driver of a session.
+
+One AutoChatDriver per ChatManager runs a single loop coroutine that generates
+one turn at a time under the session's turn lock, so turns never overlap and
+no backend slot is spent on a duplicate turn for the same speaker.
+
+Between turns the loop waits `pacing_factor` times the (exponentially averaged)
+turn latency, bounded by `min_delay` and `max_delay`. A slow or busy backend
+therefore automatically spaces out automatic turns, leaving room for the user
+and for other sessions.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llm.scheduler import get_scheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+PartialListener = Callable[[str, str], None]
+TurnListener = Callable[[Optional[str]], None]
+
+
+class AutoChatDriver:
+    def __init__(
+        self,
+        chat_manager,
+        min_delay: float = 1.0,
+        max_delay: float = 30.0,
+        pacing_factor: float = 0.5,
+        smoothing: float = 0.3
+    ):
+        self.chat_manager = chat_manager
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.pacing_factor = pacing_factor
+        self.smoothing = smoothing
+
+        self.task: Optional[asyncio.Task] = None
+        self.turns_generated = 0
+        self.average_latency: Optional[float] = None
+        self.next_delay = min_delay
+        self._listeners: List[Tuple[Optional[PartialListener], Optional[TurnListener]]] = []
+
+    #
+    # Listeners (one pair per client viewing the session)
+    #
+    def add_listener(self, on_partial: Optional[PartialListener] = None, on_turn_done: Optional[TurnListener] = None):
+        self._listeners.append((on_partial, on_turn_done))
+
+    def remove_listener(self, on_partial: Optional[PartialListener] = None, on_turn_done: Optional[TurnListener] = None):
+        if (on_partial, on_turn_done) in self._listeners:
+            self._listeners.remove((on_partial, on_turn_done))
+
+    def broadcast_partial(self, character_name: str, text: str):
+        for on_partial, _ in list(self._listeners):
+            if on_partial:
+                on_partial(character_name, text)
+
+    def broadcast_turn_done(self, character_name: Optional[str]):
+        for _, on_turn_done in list(self._listeners):
+            if on_turn_done:
+                try:
+                    on_turn_done(character_name)
+                except Exception as e:
+                    logger.error(f"Error in turn listener: {e}", exc_info=True)
+
+    #
+    # Loop
+    #
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        """Start the loop unless it is already running (never more than one per session)."""
+        if self.running:
+            return
+        self.task = asyncio.create_task(self.run())
+
+    def record_latency(self, seconds: float):
+        if self.average_latency is None:
+            self.average_latency = seconds
+        else:
+            self.average_latency = self.smoothing * seconds + (1 - self.smoothing) * self.average_latency
+        self.next_delay = min(self.max_delay, max(self.min_delay, self.pacing_factor * self.average_latency))
+
+    async def run(self):
+        manager = self.chat_manager
+        logger.info(f"Automatic chat loop started for session {manager.session_id}.")
+        try:
+            while manager.automatic_running:
+                started = time.monotonic()
+                speaker = await manager.generate_next_turn(on_partial=self.broadcast_partial)
+                if not manager.automatic_running:
+                    self.broadcast_turn_done(None)
+                    break
+                if speaker is None:
+                    # Nobody to speak, or the turn produced nothing; do not spin
+                    await asyncio.sleep(self.max_delay if not manager.get_character_names() else self.min_delay)
+                    continue
+                self.turns_generated += 1
+                self.record_latency(time.monotonic() - started)
+                self.broadcast_turn_done(speaker)
+                logger.debug(
+                    f"Auto-chat turn by {speaker} took {time.monotonic() - started:.1f}s; "
+                    f"next turn in {self.next_delay:.1f}s."
+                )
+                await asyncio.sleep(self.next_delay)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Automatic chat loop failed: {e}", exc_info=True)
+        finally:
+            logger.info(f"Automatic chat loop stopped for session {manager.session_id}.")
+
+    def status(self) -> Dict:
+        scheduler = get_scheduler()
+        return {
+            'running': self.running,
+            'turns_generated': self.turns_generated,
+            'average_turn_latency': self.average_latency,
+            'next_delay': self.next_delay,
+            'pending_turns': self.chat_manager.pending_turns,
+            'queued_turn_requests': scheduler.queue_depth(Priority.TURN),
+            'queued_llm_requests': scheduler.queue_depth(),
+        }
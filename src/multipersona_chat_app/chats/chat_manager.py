@@ -1,9 +1,15 @@
 import os
 import logging
-from typing import List, Dict, Tuple, Optional
+import functools
+from typing import List, Dict, Tuple, Optional, Type, Callable
 from models.character import Character
 from db.db_manager import DBManager
-from llm.ollama_client import OllamaClient
+from llm.client_factory import get_llm_client
+from llm.schema_registry import parse_output
+from llm.json_repair import IncrementalJSONRepairer, partial_fields
+from llm.scheduler import get_scheduler, Priority
+from llm.cancellation import CancellationToken, GenerationCancelled
+from llm.call_ledger import llm_call_context
 from datetime import datetime
 import yaml
 from templates import (
@@ -11,15 +17,59 @@ from templates import (
     CHARACTER_INTRODUCTION_SYSTEM_PROMPT_TEMPLATE,
     CharacterIntroductionOutput
 )
-from models.interaction import Interaction, AppearanceSegments
+from models.interaction import (
+    Interaction,
+    AppearanceSegments,
+    LeanInteraction,
+    InteractionReasoningBatch,
+    DialogueTurn,
+    StateUpdate,
+    ReasonedStateUpdate,
+    REASONING_FIELDS,
+    strip_reasoning_fields
+)
 from pydantic import BaseModel, Field
 import utils
 import json
+import random
+from chats.interaction_validator import LocalInteractionValidator
+from chats.auto_chat import AutoChatDriver
+from chats.events import (
+    get_event_bus,
+    SessionEvent,
+    MESSAGE_ADDED,
+    LOCATION_CHANGED,
+    APPEARANCE_CHANGED,
+    PLAN_CHANGED,
+    SUMMARY_ADDED,
+    CHARACTER_ADDED,
+    CHARACTER_REMOVED
+)
+from telemetry.tracing import traced
 
 import asyncio  # <-- used for async background calls
 
 logger = logging.getLogger(__name__)
 
+# Streamed output is re-parsed for the UI when a chunk may end a string or a line,
+# or after this many characters otherwise
+PARTIAL_PARSE_INTERVAL = 64
+PARTIAL_PARSE_BOUNDARIES = ('"', '\n')
+
+
+def _span_attributes(self, character_name: str, *args, **kwargs) -> Dict[str, str]:
+    return {'session_id': self.session_id, 'character': character_name}
+
+
+def _attribute_llm_calls(fn):
+    """Record the LLM calls made by `fn(self, character_name, ...)` in the ledger under the session and character."""
+    @functools.wraps(fn)
+    async def wrapper(self, character_name: str, *args, **kwargs):
+        with llm_call_context(session_id=self.session_id, character=character_name):
+            return await fn(self, character_name, *args, **kwargs)
+    return wrapper
+
+
 class InteractionValidationOutput(BaseModel):
     """
     A structured output to check if the interaction is valid according to
@@ -30,6 +80,14 @@ class InteractionValidationOutput(BaseModel):
     corrected_interaction: Optional[Interaction] = None
 
 
+class LeanInteractionValidationOutput(BaseModel):
+    """
+    Same as InteractionValidationOutput, for the lean schema without why_* fields.
+    """
+    is_valid: str
+    corrected_interaction: Optional[LeanInteraction] = None
+
+
 #
 # UPDATED Pydantic Model for Character Plans
 #
@@ -41,11 +99,24 @@ class CharacterPlan(BaseModel):
     why_new_plan_goal: str = ""  # <-- New field for storing reason(s) behind a changed plan/goal
 
 
+class SessionNotFound(LookupError):
+    """The session does not exist (anymore)."""
+
+
 class ChatManager:
-    def __init__(self, you_name: str = "You", session_id: Optional[str] = None, settings: List[Dict] = []):
+    def __init__(
+        self,
+        you_name: str = "You",
+        session_id: Optional[str] = None,
+        settings: List[Dict] = [],
+        db: Optional[DBManager] = None,
+        create_session: bool = True
+    ):
         self.characters: Dict[str, Character] = {}
         self.turn_index = 0
         self.automatic_running = False
+        # Who started automatic chat: "client" (a page viewing the session) or "api"
+        self.automatic_started_by: Optional[str] = None
         self.you_name = you_name
         self.session_id = session_id if session_id else "default_session"
         # Store settings in a dict keyed by setting name
@@ -65,11 +136,56 @@ class ChatManager:
         # New similarity threshold from config
         self.similarity_threshold = self.config.get("similarity_threshold", 0.8)
 
-        db_path = os.path.join("output", "conversations.db")
-        self.db = DBManager(db_path)
+        # Interaction schema mode: full, lean or deferred
+        self.interaction_schema = self.config.get("interaction_schema", "full")
+        if self.interaction_schema not in ("full", "lean", "deferred"):
+            logger.warning(f"Unknown interaction_schema '{self.interaction_schema}'. Falling back to 'full'.")
+            self.interaction_schema = "full"
+
+        # Turn pipeline: single (one Interaction call) or two_stage (action/dialogue first, state in background)
+        self.turn_pipeline = self.config.get("turn_pipeline", "single")
+        self.background_tasks = set()
+        self.summarization_task: Optional[asyncio.Task] = None
+
+        # Cancellation: every LLM call of this session derives its token from session_token,
+        # and turns in progress are tracked so the Stop button can cancel them
+        self.session_token = CancellationToken()
+        self.active_turn_tokens = set()
+
+        # One turn at a time per session; the auto-chat driver and manual turns both take this lock
+        self.turn_lock = asyncio.Lock()
+        # Summarization after a turn and in the background (schedule_summarization) never overlap
+        self.summarization_lock = asyncio.Lock()
+        self.pending_turns = 0
+        self.summarization_backlog = 0
+        # Sender of the newest message, read from the DB once and then kept up to date from MESSAGE_ADDED events
+        self._last_sender: Optional[str] = None
+        self._last_sender_loaded = False
+        self.auto_chat = AutoChatDriver(
+            self,
+            min_delay=self.config.get("auto_chat_min_delay", 1.0),
+            max_delay=self.config.get("auto_chat_max_delay", 30.0),
+            pacing_factor=self.config.get("auto_chat_pacing_factor", 0.5)
+        )
+
+        # Local rule-based validation, run before (and mostly instead of) the LLM validation loop
+        self.local_validation = self.config.get("local_validation", True)
+        self.llm_validation_sample_rate = self.config.get("llm_validation_sample_rate", 0.0)
+        self.local_validator = LocalInteractionValidator(
+            required_fields=["action"] if self.turn_pipeline == "two_stage" else ["action", "purpose", "affect"],
+            max_action_length=self.config.get("max_action_length", 1200),
+            max_dialogue_length=self.config.get("max_dialogue_length", 1200)
+        )
+
+        # A shared DBManager can be passed in (see chats.session_registry)
+        if db is None:
+            db = DBManager(os.path.join("output", "conversations.db"))
+        self.db = db
 
         existing_sessions = {s['session_id']: s for s in self.db.get_all_sessions()}
         if self.session_id not in existing_sessions:
+            if not create_session:
+                raise SessionNotFound(f"Session '{self.session_id}' not found.")
             # Create a new session in the DB
             self.db.create_session(self.session_id, f"Session {self.session_id}")
             # Default to the first setting in the provided settings list if available
@@ -107,6 +223,9 @@ class ChatManager:
                     self.current_setting = None
                     logger.error("No matching stored setting and no default setting found. No setting applied.")
 
+        # Messages stored by any holder of this session (not only add_message here) update the last sender
+        get_event_bus().subscribe(self.session_id, self.on_session_event)
+
     @staticmethod
     def load_config(config_path: str) -> dict:
         try:
@@ -118,14 +237,37 @@ class ChatManager:
             logger.error(f"Error loading config from {config_path}: {e}")
             return {}
 
+    @property
+    def uses_lean_interaction(self) -> bool:
+        return self.interaction_schema in ("lean", "deferred")
+
+    def get_interaction_output_model(self) -> Type[BaseModel]:
+        return LeanInteraction if self.uses_lean_interaction else Interaction
+
+    @staticmethod
+    def to_full_interaction(result) -> Optional[Interaction]:
+        """
+        Normalize an LLM result (full or lean) into an Interaction. Returns None for anything else.
+        """
+        if isinstance(result, LeanInteraction):
+            return result.to_interaction()
+        if isinstance(result, Interaction):
+            return result
+        return None
+
     @property
     def current_location(self) -> Optional[str]:
         return self.db.get_current_location(self.session_id)
 
+    def publish(self, event_type: str, **data):
+        """Publish a change of this session to its subscribers (see chats.events)."""
+        get_event_bus().publish(event_type, self.session_id, **data)
+
     def set_current_setting(self, setting_name: str, setting_description: str, start_location: str):
         self.current_setting = setting_name
         self.db.update_current_setting(self.session_id, self.current_setting)
         self.db.update_current_location(self.session_id, start_location, None)
+        self.publish(LOCATION_CHANGED, character=None, location=start_location)
         logger.info(f"Setting changed to '{self.current_setting}'. (Global location updated for reference.)")
 
     def get_character_names(self) -> List[str]:
@@ -156,11 +298,13 @@ class ChatManager:
             logger.warning(f"No system/dynamic prompts found in YAML for '{char_name}'.")
 
         self.ensure_character_plan_exists(char_name)
+        self.publish(CHARACTER_ADDED, character=char_name)
 
     def remove_character(self, char_name: str):
         if char_name in self.characters:
             del self.characters[char_name]
         self.db.remove_character_from_session(self.session_id, char_name)
+        self.publish(CHARACTER_REMOVED, character=char_name)
 
     def ensure_character_plan_exists(self, char_name: str):
         plan_data = self.db.get_character_plan(self.session_id, char_name)
@@ -182,19 +326,18 @@ class ChatManager:
 
     def save_character_plan(self, char_name: str, plan: CharacterPlan):
         self.db.save_character_plan(self.session_id, char_name, plan.goal, plan.steps, plan.why_new_plan_goal)
+        self.publish(PLAN_CHANGED, character=char_name, goal=plan.goal, steps=plan.steps)
 
     def next_speaker(self) -> Optional[str]:
         chars = self.get_character_names()
         if not chars:
             return None
 
-        all_msgs = self.db.get_messages(self.session_id)
-        if not all_msgs:
+        last_speaker = self.last_sender()
+        if last_speaker is None:
             # If no conversation yet, default to the first added character
             return chars[0]
 
-        last_speaker = all_msgs[-1]['sender']
-
         if last_speaker == self.you_name:
             return chars[0]
 
@@ -205,10 +348,59 @@ class ChatManager:
 
         return chars[0]
 
+    def on_session_event(self, event: SessionEvent):
+        if event.type == MESSAGE_ADDED:
+            self._last_sender = event.data.get('sender')
+            self._last_sender_loaded = True
+
+    def last_sender(self) -> Optional[str]:
+        """Sender of the newest message, read from the DB when not known yet."""
+        if not self._last_sender_loaded:
+            newest = self.db.get_messages_page(self.session_id, limit=1)
+            self._last_sender = newest[-1]['sender'] if newest else None
+            self._last_sender_loaded = True
+        return self._last_sender
+
     def advance_turn(self):
         # No-op placeholder for UI usage
         pass
 
+    @property
+    def turn_in_progress(self) -> bool:
+        return self.turn_lock.locked()
+
+    async def generate_next_turn(
+        self,
+        on_partial: Optional[Callable[[str, str], None]] = None,
+        wait: bool = True
+    ) -> Optional[str]:
+        """
+        Generate one message for the next speaker under the session's turn lock.
+        With wait=False nothing happens if a turn is already in progress.
+        Returns the speaker, or None if no turn was taken (or it was cancelled).
+        """
+        if not wait and self.turn_lock.locked():
+            logger.debug("A turn is already in progress. Not starting another one.")
+            return None
+        self.pending_turns += 1
+        try:
+            await self.turn_lock.acquire()
+        finally:
+            self.pending_turns -= 1
+        try:
+            # The next speaker is only known once the previous turn is stored
+            next_char = self.next_speaker()
+            if not next_char:
+                return None
+            turn_token = self.new_turn_token()
+            await self.generate_character_message(next_char, on_partial=on_partial, cancel_token=turn_token)
+            if turn_token.cancelled:
+                return None
+            self.advance_turn()
+            return next_char
+        finally:
+            self.turn_lock.release()
+
     def get_visible_history_for_character(self, character_name: str) -> List[Dict]:
         return self.db.get_visible_messages_for_character(self.session_id, character_name)
 
@@ -226,8 +418,13 @@ class ChatManager:
                           why_new_location: Optional[str] = None,
                           why_new_appearance: Optional[str] = None,
                           new_location: Optional[str] = None,
-                          new_appearance: Optional[AppearanceSegments] = None
+                          new_appearance: Optional[AppearanceSegments] = None,
+                          summarize_in_background: bool = False
                          ) -> Optional[int]:
+        """
+        Store a message and publish it. Histories that grew past the summarization threshold are
+        summarized before returning, or with `summarize_in_background` after it.
+        """
         if message_type == "system" or message.strip() == "...":
             return None
 
@@ -260,27 +457,60 @@ class ChatManager:
         )
 
         self.db.add_message_visibility_for_session_characters(self.session_id, message_id)
+        self.publish(MESSAGE_ADDED, **self.db.get_message(message_id))
 
-        await self.check_summarization()
+        if summarize_in_background:
+            self.schedule_summarization()
+        else:
+            await self.check_summarization()
 
         return message_id
 
+    def schedule_summarization(self):
+        """Run check_summarization as a background task, unless one is still running."""
+        if self.summarization_task is not None and not self.summarization_task.done():
+            return
+        task = asyncio.create_task(self.run_background_summarization())
+        self.summarization_task = task
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def run_background_summarization(self):
+        try:
+            await self.check_summarization()
+        except Exception as e:
+            logger.error(f"Background summarization for session {self.session_id} failed: {e}", exc_info=True)
+
     async def check_summarization(self):
+        async with self.summarization_lock:
+            await self.summarize_due_histories()
+
+    async def summarize_due_histories(self):
         all_msgs = self.db.get_messages(self.session_id)
         if not all_msgs:
             return
 
         participants = set(m["sender"] for m in all_msgs if m["message_type"] in ["user", "character"])
-        for char_name in participants:
-            if char_name not in self.characters:
-                continue
-
-            visible_for_char = self.db.get_visible_messages_for_character(self.session_id, char_name)
-            if len(visible_for_char) >= self.summarization_threshold:
+        due = [
+            char_name for char_name in participants
+            if char_name in self.characters
+            and len(self.db.get_visible_messages_for_character(self.session_id, char_name)) >= self.summarization_threshold
+        ]
+        # Characters whose history is waiting to be summarized (exported as a metric)
+        self.summarization_backlog = len(due)
+        for char_name in due:
+            try:
                 await self.summarize_history_for_character(char_name)
+            except GenerationCancelled:
+                logger.info(f"Summarization for '{char_name}' cancelled.")
+                return
+            self.summarization_backlog -= 1
 
+    @traced("chat.summarize", root=True, attributes=_span_attributes)
+    @_attribute_llm_calls
     async def summarize_history_for_character(self, character_name: str):
-        summarize_llm = OllamaClient('src/multipersona_chat_app/config/llm_config.yaml')
+        summarize_llm = get_llm_client()
+        session_token = self.session_token
 
         while True:
             msgs = self.db.get_visible_messages_for_character(self.session_id, character_name)
@@ -291,6 +521,9 @@ class ChatManager:
             chunk = msgs[: self.to_summarize_count]
             chunk_ids = [m['id'] for m in chunk]
 
+            if self.interaction_schema == "deferred":
+                await self.backfill_interaction_reasoning(character_name, chunk, cancel_token=session_token)
+
             history_lines = []
             max_message_id_in_chunk = 0
             for m in chunk:
@@ -366,11 +599,23 @@ Messages to summarize:
 Now produce a short summary from {character_name}'s viewpoint, emphasizing why changes happened when relevant.
 """
 
-            new_summary = await asyncio.to_thread(summarize_llm.generate, prompt=prompt)
+            new_summary = await get_scheduler().submit(
+                Priority.SUMMARY,
+                summarize_llm.generate,
+                prompt=prompt,
+                profile='summary',
+                cancel_token=session_token
+            )
             if not new_summary:
                 new_summary = "No significant new events."
 
             self.db.save_new_summary(self.session_id, character_name, new_summary, max_message_id_in_chunk)
+            self.publish(
+                SUMMARY_ADDED,
+                character=character_name,
+                summary=new_summary,
+                covered_up_to_message_id=max_message_id_in_chunk
+            )
             self.db.hide_messages_for_character(self.session_id, character_name, chunk_ids)
 
             logger.info(
@@ -378,6 +623,78 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
                 f"Newest remaining count: {len(self.db.get_visible_messages_for_character(self.session_id, character_name))}."
             )
 
+    @_attribute_llm_calls
+    async def backfill_interaction_reasoning(
+        self,
+        character_name: str,
+        messages: List[Dict],
+        cancel_token: Optional[CancellationToken] = None
+    ):
+        """
+        In 'deferred' schema mode the why_* fields are not generated with each turn.
+        Fill them in for the messages of `character_name` in one pass, right before
+        they get summarized. Updates both the DB and the given message dicts.
+        """
+        missing = [
+            m for m in messages
+            if m["sender"] == character_name
+            and m["message_type"] == "character"
+            and m.get("purpose")
+            and not any(m.get(field) for field in REASONING_FIELDS)
+        ]
+        if not missing:
+            return
+
+        message_lines = "\n".join(
+            f"[{m['id']}] (Affect={m.get('affect')}, Purpose={m.get('purpose')}) {m['message']}"
+            for m in missing
+        )
+        prompt = f"""Below are messages written by {character_name}, each prefixed with its message id.
+For every message, briefly explain from {character_name}'s perspective why the purpose, affect, action,
+dialogue, location and appearance were what they were. Keep each explanation to one short sentence,
+and leave a field empty if nothing meaningful can be said.
+
+Messages:
+{message_lines}
+
+Output strictly in JSON:
+{{
+"reasoning": [
+  {{
+    "message_id": <id>,
+    "why_purpose": "...",
+    "why_affect": "...",
+    "why_action": "...",
+    "why_dialogue": "...",
+    "why_new_location": "...",
+    "why_new_appearance": "..."
+  }}
+]
+}}
+"""
+        reasoning_client = get_llm_client(InteractionReasoningBatch)
+        result = await get_scheduler().submit(
+            Priority.BACKFILL,
+            reasoning_client.generate,
+            prompt=prompt,
+            use_cache=False,
+            profile='summary',
+            cancel_token=cancel_token
+        )
+        if not isinstance(result, InteractionReasoningBatch):
+            logger.warning(f"Deferred reasoning pass for '{character_name}' returned no usable result.")
+            return
+
+        by_id = {m["id"]: m for m in missing}
+        for entry in result.reasoning:
+            msg = by_id.get(entry.message_id)
+            if msg is None:
+                continue
+            values = {field: getattr(entry, field).strip() for field in REASONING_FIELDS}
+            self.db.update_message_reasoning(entry.message_id, **values)
+            msg.update(values)
+        logger.info(f"Filled deferred reasoning for {len(result.reasoning)} message(s) of '{character_name}'.")
+
     def get_latest_dialogue(self, character_name: str) -> str:
         """
         We gather the last few visible lines of conversation from the perspective
@@ -410,6 +727,10 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
 
         system_prompt = existing_prompts['character_system_prompt']
         dynamic_prompt_template = existing_prompts['dynamic_prompt_template']
+        if self.uses_lean_interaction:
+            # Do not ask for the why_* fields the lean schema drops (stripped before any history is filled in)
+            system_prompt = strip_reasoning_fields(system_prompt)
+            dynamic_prompt_template = strip_reasoning_fields(dynamic_prompt_template)
 
         latest_dialogue = self.get_latest_dialogue(character_name)
 
@@ -439,7 +760,7 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
             logger.error(f"Error replacing placeholders in dynamic_prompt_template: {e}")
             raise
 
-        logger.debug(f"Built prompt for character '{character_name}':\n{formatted_prompt}")
+        logger.debug("Built prompt for character '%s':\n%s", character_name, formatted_prompt)
         return system_prompt, formatted_prompt
 
     def build_introduction_prompts_for_character(self, character_name: str) -> Tuple[str, str]:
@@ -521,47 +842,145 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
                 return "No active character locations known."
         return " | ".join(parts)
 
-    def start_automatic_chat(self):
+    def start_automatic_chat(self, started_by: str = "client"):
+        if not self.automatic_running:
+            self.automatic_started_by = started_by
         self.automatic_running = True
+        self.auto_chat.start()
 
     def stop_automatic_chat(self):
         self.automatic_running = False
+        self.automatic_started_by = None
+        self.cancel_active_turns("Stopped by user.")
 
-    async def generate_character_message(self, character_name: str):
-        logger.info(f"Generating message for character: {character_name}")
+    def new_turn_token(self) -> CancellationToken:
+        """A token for one turn. It is cancelled by Stop and when the session is left."""
+        return self.session_token.child()
 
-        all_msgs = self.db.get_messages(self.session_id)
-        triggered_message_id = all_msgs[-1]['id'] if all_msgs else None
-        await self.update_character_plan(character_name, triggered_message_id)
+    def cancel_active_turns(self, reason: str = "Turn cancelled."):
+        for token in list(self.active_turn_tokens):
+            token.cancel(reason)
 
-        char_spoken_before = any(
-            m for m in all_msgs
-            if m["sender"] == character_name and m["message_type"] == "character"
-        )
-        if not char_spoken_before:
-            await self.generate_character_introduction_message(character_name)
-            return
+    def close(self):
+        """Stop following the session's events; the manager is not used anymore."""
+        get_event_bus().unsubscribe(self.session_id, self.on_session_event)
 
-        try:
-            system_prompt, formatted_prompt = self.build_prompt_for_character(character_name)
-            llm_client = OllamaClient('src/multipersona_chat_app/config/llm_config.yaml', output_model=Interaction)
-            interaction = await asyncio.to_thread(
-                llm_client.generate,
-                prompt=formatted_prompt,
-                system=system_prompt,
-                use_cache=False
-            )
+    def cancel_session_work(self, reason: str = "Session closed."):
+        """
+        Cancel all outstanding LLM work of the current session (turns, plans, summaries and
+        background state updates), so nothing more is written into it. Call this before
+        switching to or deleting a session.
+        """
+        logger.info(f"Cancelling outstanding work for session {self.session_id}: {reason}")
+        self.session_token.cancel(reason)
+        self.session_token = CancellationToken()
+        self.active_turn_tokens.clear()
 
-            if not interaction:
-                logger.warning(f"No response for {character_name}. Not storing.")
+    def make_partial_forwarder(
+        self,
+        character_name: str,
+        on_partial: Optional[Callable[[str, str], None]],
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Optional[Callable[[str], None]]:
+        """
+        Wrap a UI callback so it can be fed from the LLM worker thread. The callback runs
+        on the event loop and receives the character name and the action/dialogue so far.
+        Parsing the output so far costs its whole length, so it is only done at string or
+        line boundaries and every PARTIAL_PARSE_INTERVAL characters, not for every chunk.
+        """
+        if on_partial is None:
+            return None
+        loop = asyncio.get_running_loop()
+        repairer = IncrementalJSONRepairer()
+        fed = 0
+        parsed = 0
+        shown = ""
+
+        def forward(raw_output: str):
+            nonlocal fed, parsed, shown
+            if cancel_token and cancel_token.cancelled:
+                return
+            chunk = raw_output[fed:]
+            repairer.feed(chunk)
+            fed = len(raw_output)
+            if fed - parsed < PARTIAL_PARSE_INTERVAL and not any(b in chunk for b in PARTIAL_PARSE_BOUNDARIES):
                 return
-            if not isinstance(interaction, Interaction):
-                logger.error(f"Invalid interaction type from LLM: {type(interaction)}. Value: {interaction}")
+            parsed = fed
+            fields = partial_fields(repairer)
+            action = fields.get("action") if isinstance(fields.get("action"), str) else ""
+            dialogue = fields.get("dialogue") if isinstance(fields.get("dialogue"), str) else ""
+            if not action and not dialogue:
                 return
+            text = f"*{action}*\n{dialogue}" if action else dialogue
+            if text != shown:
+                shown = text
+                loop.call_soon_threadsafe(on_partial, character_name, text)
+
+        return forward
+
+    @traced("chat.turn", root=True, attributes=_span_attributes)
+    @_attribute_llm_calls
+    async def generate_character_message(
+        self,
+        character_name: str,
+        on_partial: Optional[Callable[[str, str], None]] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ):
+        """
+        Generate and store the next message of `character_name`. Cancelling `cancel_token`
+        (by default a new turn token) stops the LLM requests of this turn and stores nothing.
+        """
+        logger.info(f"Generating message for character: {character_name}")
+        turn_token = cancel_token or self.new_turn_token()
+        self.active_turn_tokens.add(turn_token)
+
+        try:
+            all_msgs = self.db.get_messages(self.session_id)
+            triggered_message_id = all_msgs[-1]['id'] if all_msgs else None
+            await self.update_character_plan(character_name, triggered_message_id, cancel_token=turn_token)
+
+            char_spoken_before = any(
+                m for m in all_msgs
+                if m["sender"] == character_name and m["message_type"] == "character"
+            )
+            if not char_spoken_before:
+                await self.generate_character_introduction_message(character_name, cancel_token=turn_token)
+                return
+
+            system_prompt, formatted_prompt = self.build_prompt_for_character(character_name)
+            partial_forwarder = self.make_partial_forwarder(character_name, on_partial, turn_token)
+            two_stage = self.turn_pipeline == "two_stage"
+
+            if two_stage:
+                interaction = await self.generate_dialogue_turn(
+                    character_name, system_prompt, formatted_prompt, partial_forwarder, turn_token
+                )
+                if interaction is None:
+                    return
+            else:
+                llm_client = get_llm_client(self.get_interaction_output_model())
+                result = await get_scheduler().submit(
+                    Priority.TURN,
+                    llm_client.generate,
+                    prompt=formatted_prompt,
+                    system=system_prompt,
+                    use_cache=False,
+                    profile='interaction',
+                    on_partial=partial_forwarder,
+                    cancel_token=turn_token
+                )
+
+                if not result:
+                    logger.warning(f"No response for {character_name}. Not storing.")
+                    return
+                interaction = self.to_full_interaction(result)
+                if interaction is None:
+                    logger.error(f"Invalid interaction type from LLM: {type(result)}. Value: {result}")
+                    return
 
             # Validate & possibly correct
             validated = await self.validate_and_possibly_correct_interaction(
-                character_name, system_prompt, formatted_prompt, interaction
+                character_name, system_prompt, formatted_prompt, interaction, turn_token
             )
             if not validated:
                 logger.warning(f"Interaction for {character_name} could not be validated or corrected. Not storing.")
@@ -569,7 +988,7 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
 
             # Check for repetitive lines
             final_interaction = await self.check_and_regenerate_if_repetitive(
-                character_name, system_prompt, formatted_prompt, validated
+                character_name, system_prompt, formatted_prompt, validated, turn_token
             )
             if not final_interaction:
                 logger.warning(f"Repetitive interaction could not be resolved for {character_name}.")
@@ -581,6 +1000,24 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
 
 
             formatted_message = f"*{final_interaction.action}*\n{final_interaction.dialogue.replace('[Latest]', '')}"
+
+            # The user may have pressed Stop or left the session while the last request finished
+            turn_token.raise_if_cancelled()
+
+            if two_stage:
+                # Show the message right away; its state is derived in the background
+                msg_id = await self.add_message(
+                    character_name,
+                    formatted_message,
+                    visible=True,
+                    message_type="character"
+                )
+                if msg_id is not None and not turn_token.cancelled:
+                    self.schedule_state_update(
+                        character_name, system_prompt, formatted_prompt, final_interaction, msg_id
+                    )
+                return
+
             msg_id = await self.add_message(
                 character_name,
                 formatted_message,
@@ -598,44 +1035,201 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
                 new_appearance=final_interaction.new_appearance
             )
 
-            if final_interaction.new_location.strip():
-                await self.handle_new_location_for_character(character_name, final_interaction.new_location, msg_id)
-            if final_interaction.new_appearance and any([
-                final_interaction.new_appearance.hair.strip(),
-                final_interaction.new_appearance.clothing.strip(),
-                final_interaction.new_appearance.accessories_and_held_items.strip(),
-                final_interaction.new_appearance.posture_and_body_language.strip(),
-                final_interaction.new_appearance.other_relevant_details.strip()
-            ]):
-                await self.handle_new_appearance_for_character(
-                    character_name,
-                    AppearanceSegments(
-                        hair=final_interaction.new_appearance.hair,
-                        clothing=final_interaction.new_appearance.clothing,
-                        accessories_and_held_items=final_interaction.new_appearance.accessories_and_held_items,
-                        posture_and_body_language=final_interaction.new_appearance.posture_and_body_language,
-                        other_relevant_details=final_interaction.new_appearance.other_relevant_details
-                    ),
-                    msg_id
-                )
+            await self.apply_state_changes(character_name, final_interaction, msg_id)
+        except GenerationCancelled as e:
+            logger.info(f"Message generation for {character_name} cancelled: {e}")
         except Exception as e:
             logger.error(f"Error generating message for {character_name}: {e}", exc_info=True)
+        finally:
+            self.active_turn_tokens.discard(turn_token)
+            turn_token.release()
+
+    async def apply_state_changes(self, character_name: str, state, msg_id: int):
+        """
+        Apply the new_location/new_appearance of an Interaction or StateUpdate through
+        the location and appearance handlers.
+        """
+        if state.new_location.strip():
+            await self.handle_new_location_for_character(character_name, state.new_location, msg_id)
+        if state.new_appearance and any([
+            (state.new_appearance.hair or "").strip(),
+            (state.new_appearance.clothing or "").strip(),
+            (state.new_appearance.accessories_and_held_items or "").strip(),
+            (state.new_appearance.posture_and_body_language or "").strip(),
+            (state.new_appearance.other_relevant_details or "").strip()
+        ]):
+            await self.handle_new_appearance_for_character(
+                character_name,
+                AppearanceSegments(
+                    hair=state.new_appearance.hair,
+                    clothing=state.new_appearance.clothing,
+                    accessories_and_held_items=state.new_appearance.accessories_and_held_items,
+                    posture_and_body_language=state.new_appearance.posture_and_body_language,
+                    other_relevant_details=state.new_appearance.other_relevant_details
+                ),
+                msg_id
+            )
+
+    #
+    # Two-stage turn generation
+    #
+    async def generate_dialogue_turn(
+        self,
+        character_name: str,
+        system_prompt: str,
+        dynamic_prompt: str,
+        partial_forwarder: Optional[Callable[[str], None]] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Optional[Interaction]:
+        """
+        Stage one: generate (and stream) only the action and dialogue. The result is
+        returned as an Interaction with empty state fields so it can go through the
+        regular validation and repetition checks.
+        """
+        stage_prompt = dynamic_prompt + """
+
+For this step, respond ONLY with the "action" and "dialogue" fields of the JSON structure.
+All other fields are determined separately afterwards.
+"""
+        dialogue_client = get_llm_client(DialogueTurn)
+        result = await get_scheduler().submit(
+            Priority.TURN,
+            dialogue_client.generate,
+            prompt=stage_prompt,
+            system=system_prompt,
+            use_cache=False,
+            profile='interaction',
+            on_partial=partial_forwarder,
+            cancel_token=cancel_token
+        )
+        if not isinstance(result, DialogueTurn):
+            logger.warning(f"No valid action/dialogue for {character_name}. Not storing.")
+            return None
+
+        return Interaction(
+            purpose="",
+            affect="",
+            action=result.action,
+            dialogue=result.dialogue,
+            new_location="",
+            new_appearance=AppearanceSegments(),
+            **{field: "" for field in REASONING_FIELDS}
+        )
 
-    async def generate_character_introduction_message(self, character_name: str):
+    def schedule_state_update(
+        self,
+        character_name: str,
+        system_prompt: str,
+        dynamic_prompt: str,
+        interaction: Interaction,
+        msg_id: int
+    ):
+        task = asyncio.create_task(
+            self.derive_and_apply_state_update(
+                character_name, system_prompt, dynamic_prompt, interaction, msg_id, self.session_token
+            )
+        )
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    @_attribute_llm_calls
+    async def derive_and_apply_state_update(
+        self,
+        character_name: str,
+        system_prompt: str,
+        dynamic_prompt: str,
+        interaction: Interaction,
+        msg_id: int,
+        cancel_token: Optional[CancellationToken] = None
+    ):
+        """
+        Stage two: derive purpose, affect, location and appearance for an already stored
+        message, then apply them through the regular location/appearance handlers.
+        """
+        with_reasoning = self.interaction_schema == "full"
+        output_model = ReasonedStateUpdate if with_reasoning else StateUpdate
+        reasoning_instructions = ""
+        if with_reasoning:
+            reasoning_instructions = """- For each of "purpose", "affect", "action", "dialogue", "new_location" and "new_appearance",
+  give a one-sentence reason in the matching "why_*" field.
+"""
+
+        state_prompt = f"""{dynamic_prompt}
+
+{character_name} has just performed the following interaction:
+Action: {interaction.action}
+Dialogue: {interaction.dialogue}
+
+Based on the context above and this interaction, determine {character_name}'s resulting state:
+- "purpose": {character_name}'s short-term goal or current mindset.
+- "affect": {character_name}'s internal feelings.
+- "new_location": only if the interaction changed {character_name}'s location; otherwise an empty string.
+- "new_appearance": only the subfields that changed because of the interaction; leave the others empty.
+{reasoning_instructions}"""
+
+        try:
+            state_client = get_llm_client(output_model)
+            state = await get_scheduler().submit(
+                Priority.PLAN,
+                state_client.generate,
+                prompt=state_prompt,
+                system=system_prompt,
+                use_cache=False,
+                profile='state',
+                cancel_token=cancel_token
+            )
+            if not isinstance(state, StateUpdate):
+                logger.warning(f"No state update derived for message {msg_id} of {character_name}.")
+                return
+
+            appearance = state.new_appearance
+            self.db.update_message_state(
+                msg_id,
+                state.affect,
+                state.purpose,
+                state.new_location.strip() or None,
+                (appearance.hair or "").strip(),
+                (appearance.clothing or "").strip(),
+                (appearance.accessories_and_held_items or "").strip(),
+                (appearance.posture_and_body_language or "").strip(),
+                (appearance.other_relevant_details or "").strip()
+            )
+            if isinstance(state, ReasonedStateUpdate):
+                self.db.update_message_reasoning(
+                    msg_id,
+                    **{field: getattr(state, field) for field in REASONING_FIELDS}
+                )
+
+            await self.apply_state_changes(character_name, state, msg_id)
+            logger.info(f"Applied background state update for message {msg_id} of {character_name}.")
+        except GenerationCancelled:
+            logger.info(f"Background state update for message {msg_id} of {character_name} cancelled.")
+        except Exception as e:
+            logger.error(f"Error deriving state update for {character_name}: {e}", exc_info=True)
+
+    @_attribute_llm_calls
+    async def generate_character_introduction_message(
+        self,
+        character_name: str,
+        cancel_token: Optional[CancellationToken] = None
+    ):
         logger.info(f"Building introduction prompts for character: {character_name}")
         system_prompt, introduction_prompt = self.build_introduction_prompts_for_character(character_name)
-        introduction_llm_client = OllamaClient(
-            'src/multipersona_chat_app/config/llm_config.yaml',
-            output_model=CharacterIntroductionOutput
-        )
+        introduction_llm_client = get_llm_client(CharacterIntroductionOutput)
 
         try:
-            introduction_response = await asyncio.to_thread(
+            introduction_response = await get_scheduler().submit(
+                Priority.TURN,
                 introduction_llm_client.generate,
                 prompt=introduction_prompt,
-                system=system_prompt
+                system=system_prompt,
+                profile='introduction',
+                cancel_token=cancel_token
             )
 
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+
             if isinstance(introduction_response, CharacterIntroductionOutput):
                 intro_text = introduction_response.introduction_text.strip()
                 app_seg = introduction_response.current_appearance
@@ -664,6 +1258,8 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
             else:
                 logger.warning(f"Invalid response received for introduction of {character_name}. Response: {introduction_response}")
 
+        except GenerationCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error generating introduction for {character_name}: {e}", exc_info=True)
 
@@ -687,6 +1283,11 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
         )
         if updated:
             logger.info(f"Character '{character_name}' location updated to '{new_location}'.")
+            self.publish(
+                LOCATION_CHANGED,
+                character=character_name,
+                location=self.db.get_character_location(self.session_id, character_name)
+            )
 
     async def handle_new_appearance_for_character(self, character_name: str, new_appearance: AppearanceSegments, triggered_message_id: int) -> bool:
         updated = self.db.update_character_appearance(
@@ -697,26 +1298,87 @@ Now produce a short summary from {character_name}'s viewpoint, emphasizing why c
         )
         if updated:
             logger.info(f"Character '{character_name}' appearance updated: {new_appearance.dict()}")
+            self.publish(
+                APPEARANCE_CHANGED,
+                character=character_name,
+                appearance=self.db.get_character_appearance(self.session_id, character_name)
+            )
         return updated
 
     def get_all_visible_messages(self) -> List[Dict]:
         visible_msgs = self.db.get_messages(self.session_id)
         return [m for m in visible_msgs if m["message_type"] in ("user","character","assistant","system")]
 
+    @traced("chat.validation", attributes=_span_attributes)
     async def validate_and_possibly_correct_interaction(
         self,
         character_name: str,
         system_prompt: str,
         dynamic_prompt: str,
-        initial_interaction: Interaction
+        initial_interaction: Interaction,
+        cancel_token: Optional[CancellationToken] = None
     ) -> Optional[Interaction]:
+        if self.local_validation:
+            local_result = self.local_validator.validate(
+                character_name,
+                initial_interaction,
+                current_location=self.db.get_character_location(self.session_id, character_name),
+                current_appearance=self.db.get_character_appearance_segments(self.session_id, character_name)
+            )
+            for fix in local_result.fixes:
+                logger.info(f"Local validation fix for {character_name}: {fix}")
+            for issue in local_result.issues:
+                logger.info(f"Local validation issue for {character_name}: {issue}")
+            initial_interaction = local_result.interaction
+
+            if self.validation_loop_setting == 0:
+                return initial_interaction
+            if local_result.passed and random.random() >= self.llm_validation_sample_rate:
+                logger.debug(f"Interaction for {character_name} passed local validation. Skipping LLM validation.")
+                return initial_interaction
+
         if self.validation_loop_setting == 0:
             return initial_interaction
 
-        validation_client = OllamaClient(
-            'src/multipersona_chat_app/config/llm_config.yaml',
-            output_model=InteractionValidationOutput
-        )
+        validation_model = LeanInteractionValidationOutput if self.uses_lean_interaction else InteractionValidationOutput
+        validation_client = get_llm_client(validation_model)
+        interaction_exclude = set(REASONING_FIELDS) if self.uses_lean_interaction else None
+        if self.uses_lean_interaction:
+            corrected_example = """{
+      "purpose": "...",
+      "affect": "...",
+      "action": "...",
+      "dialogue": "...",
+      "new_location": "...",
+      "new_appearance": {
+         "hair": "...",
+         "clothing": "...",
+         "accessories_and_held_items": "...",
+         "posture_and_body_language": "...",
+         "other_relevant_details": "..."
+      }
+  }"""
+        else:
+            corrected_example = """{
+      "purpose": "...",
+      "why_purpose": "...",
+      "affect": "...",
+      "why_affect": "...",
+      "action": "...",
+      "why_action": "...",
+      "dialogue": "...",
+      "why_dialogue": "...",
+      "new_location": "...",
+      "why_new_location": "...",
+      "new_appearance": {
+         "hair": "...",
+         "clothing": "...",
+         "accessories_and_held_items": "...",
+         "posture_and_body_language": "...",
+         "other_relevant_details": "..."
+      },
+      "why_new_appearance": "..."
+  }"""
 
         current_interaction = initial_interaction
         iteration = 0
@@ -732,31 +1394,12 @@ Dynamic Prompt (with relevant context):
 {dynamic_prompt}
 
 The user-generated interaction JSON to validate:
-{current_interaction.model_dump_json()}
+{current_interaction.model_dump_json(exclude=interaction_exclude)}
 
 Please reply in valid JSON format with the following fields:
 {{
   "is_valid": "yes" or "no",
-  "corrected_interaction": {{
-      "purpose": "...",
-      "why_purpose": "...",
-      "affect": "...",
-      "why_affect": "...",
-      "action": "...",
-      "why_action": "...",
-      "dialogue": "...",
-      "why_dialogue": "...",
-      "new_location": "...",
-      "why_new_location": "...",
-      "new_appearance": {{
-         "hair": "...",
-         "clothing": "...",
-         "accessories_and_held_items": "...",
-         "posture_and_body_language": "...",
-         "other_relevant_details": "..."
-      }},
-      "why_new_appearance": "..."
-  }}
+  "corrected_interaction": {corrected_example}
 }}
 - If is_valid is "yes", do NOT provide a corrected_interaction (or leave it empty).
 - If is_valid is "no", provide a corrected_interaction with valid fields.
@@ -764,11 +1407,14 @@ Please reply in valid JSON format with the following fields:
 Only produce valid JSON with these two top-level keys: "is_valid" and "corrected_interaction". 
 """
 
-            result = await asyncio.to_thread(
+            result = await get_scheduler().submit(
+                Priority.VALIDATION,
                 validation_client.generate,
                 prompt=validation_prompt,
                 system=None,
-                use_cache=False
+                use_cache=False,
+                profile='validation',
+                cancel_token=cancel_token
             )
 
             if not result:
@@ -776,11 +1422,11 @@ Only produce valid JSON with these two top-level keys: "is_valid" and "corrected
                     return None
                 continue
 
-            if isinstance(result, InteractionValidationOutput):
+            if isinstance(result, validation_model):
                 validation_output = result
             else:
                 try:
-                    validation_output = InteractionValidationOutput.parse_raw(result)
+                    validation_output = parse_output(validation_model, result)
                 except Exception:
                     if self.validation_loop_setting > 0 and iteration >= self.validation_loop_setting:
                         return None
@@ -789,7 +1435,7 @@ Only produce valid JSON with these two top-level keys: "is_valid" and "corrected
             if validation_output.is_valid.lower() == "yes":
                 return current_interaction
 
-            corrected = validation_output.corrected_interaction
+            corrected = self.to_full_interaction(validation_output.corrected_interaction)
             if not corrected:
                 if self.validation_loop_setting > 0 and iteration >= self.validation_loop_setting:
                     return None
@@ -802,12 +1448,14 @@ Only produce valid JSON with these two top-level keys: "is_valid" and "corrected
     #
     # NEW: check for repeated lines from the same character
     #
+    @traced("chat.repetition_check", attributes=_span_attributes)
     async def check_and_regenerate_if_repetitive(
         self,
         character_name: str,
         system_prompt: str,
         dynamic_prompt: str,
-        interaction: Interaction
+        interaction: Interaction,
+        cancel_token: Optional[CancellationToken] = None
     ) -> Optional[Interaction]:
         """
         We compare 'interaction.action' and 'interaction.dialogue' to the recent lines
@@ -823,7 +1471,7 @@ Only produce valid JSON with these two top-level keys: "is_valid" and "corrected
         recent_speaker_lines = same_speaker_lines[-5:] if len(same_speaker_lines) > 5 else same_speaker_lines
 
         # 2) We'll embed the new action and dialogue, compare each with the recent lines
-        embed_client = OllamaClient('src/multipersona_chat_app/config/llm_config.yaml')
+        embed_client = get_llm_client()
         tries = 0
         max_tries = 2  # how many times we allow regeneration
 
@@ -831,17 +1479,17 @@ Only produce valid JSON with these two top-level keys: "is_valid" and "corrected
 
         while True:
             # Check similarity for action
-            action_embedding = embed_client.get_embedding(current_interaction.action)
+            action_embedding = await get_scheduler().submit(Priority.VALIDATION, embed_client.get_embedding, current_interaction.action, cancel_token=cancel_token)
             is_action_similar = False
             # Check similarity for dialogue
-            dialogue_embedding = embed_client.get_embedding(current_interaction.dialogue)
+            dialogue_embedding = await get_scheduler().submit(Priority.VALIDATION, embed_client.get_embedding, current_interaction.dialogue, cancel_token=cancel_token)
             is_dialogue_similar = False
-            actiondialogue_embedding = embed_client.get_embedding(current_interaction.action+' '+current_interaction.dialogue)
+            actiondialogue_embedding = await get_scheduler().submit(Priority.VALIDATION, embed_client.get_embedding, current_interaction.action+' '+current_interaction.dialogue, cancel_token=cancel_token)
             is_actiondialogue_similar = False
 
             for line_obj in recent_speaker_lines:
                 old_msg = line_obj["message"]
-                old_embedding = embed_client.get_embedding(old_msg)
+                old_embedding = await get_scheduler().submit(Priority.VALIDATION, embed_client.get_embedding, old_msg, cancel_token=cancel_token)
                 if old_embedding:
                     # Compare with action
                     sim_action = embed_client.compute_cosine_similarity(action_embedding, old_embedding)
@@ -889,20 +1537,24 @@ avoids repetition, and moves the story forward.
             # Let's append the extra instruction to the dynamic_prompt
             revised_prompt = dynamic_prompt + "\n\n" + extra_instruction
 
-            regen_client = OllamaClient('src/multipersona_chat_app/config/llm_config.yaml', output_model=Interaction)
-            new_interaction = await asyncio.to_thread(
+            regen_client = get_llm_client(self.get_interaction_output_model())
+            regen_result = await get_scheduler().submit(
+                Priority.TURN,
                 regen_client.generate,
                 prompt=revised_prompt,
                 system=system_prompt,
-                use_cache=False
+                use_cache=False,
+                profile='interaction',
+                cancel_token=cancel_token
             )
-            if not new_interaction or not isinstance(new_interaction, Interaction):
+            new_interaction = self.to_full_interaction(regen_result)
+            if not new_interaction:
                 logger.warning("No valid regeneration received; returning None.")
                 return None
 
             # Validate again
             revalidated = await self.validate_and_possibly_correct_interaction(
-                character_name, system_prompt, revised_prompt, new_interaction
+                character_name, system_prompt, revised_prompt, new_interaction, cancel_token=cancel_token
             )
             if not revalidated:
                 logger.warning("Regenerated interaction not valid. Trying again if tries remain.")
@@ -914,11 +1566,15 @@ avoids repetition, and moves the story forward.
     #
     # Plan Updating
     #
-    async def update_character_plan(self, character_name: str, triggered_message_id: Optional[int] = None):
-        plan_client = OllamaClient(
-            config_path='src/multipersona_chat_app/config/llm_config.yaml',
-            output_model=CharacterPlan
-        )
+    @traced("chat.plan_update", attributes=_span_attributes)
+    @_attribute_llm_calls
+    async def update_character_plan(
+        self,
+        character_name: str,
+        triggered_message_id: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ):
+        plan_client = get_llm_client(CharacterPlan)
 
         existing_plan = self.get_character_plan(character_name)
         old_goal = existing_plan.goal
@@ -976,11 +1632,14 @@ Update or confirm the plan if needed. Output strictly in JSON:
 If no changes are needed, simply repeat the existing plan in the same JSON format (including "why_new_plan_goal" if relevant).
 """
 
-        plan_result = await asyncio.to_thread(
+        plan_result = await get_scheduler().submit(
+            Priority.PLAN,
             plan_client.generate,
             prompt=user_prompt,
             system=system_prompt,
-            use_cache=False
+            use_cache=False,
+            profile='plan',
+            cancel_token=cancel_token or self.session_token
         )
 
         if not plan_result:
@@ -1013,6 +1672,7 @@ If no changes are needed, simply repeat the existing plan in the same JSON forma
                     triggered_message_id,
                     change_explanation
                 )
+                self.publish(PLAN_CHANGED, character=character_name, goal=new_goal, steps=new_steps)
             else:
                 self.db.save_character_plan_with_history(
                     self.session_id,
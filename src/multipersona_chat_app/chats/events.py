@@ -0,0 +1,94 @@
+"""
+In-process event bus for session changes.
+
+The ChatManager publishes an event whenever it stores something a viewer of the
+session may want to show:
+- message_added:      data is the stored message (as returned by DBManager.get_message)
+- location_changed:   character (None for the session-level location), location
+- appearance_changed: character, appearance (combined description)
+- plan_changed:       character, goal, steps
+- summary_added:      character, summary, covered_up_to_message_id
+- character_added:    character
+- character_removed:  character
+- session_deleted:    no data; viewers should move to another session
+
+Subscribers (e.g. every browser client viewing the session) apply these deltas
+instead of re-reading the whole session after every turn. Listeners are called
+synchronously on the publishing thread. That is usually the event loop, but not
+always (e.g. background state updates, API calls run in worker threads), so
+listeners that touch the UI must hop onto the loop themselves.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ADDED = "message_added"
+LOCATION_CHANGED = "location_changed"
+APPEARANCE_CHANGED = "appearance_changed"
+PLAN_CHANGED = "plan_changed"
+SUMMARY_ADDED = "summary_added"
+CHARACTER_ADDED = "character_added"
+CHARACTER_REMOVED = "character_removed"
+SESSION_DELETED = "session_deleted"
+
+
+class SessionEvent(BaseModel):
+    type: str
+    session_id: str
+    data: Dict[str, Any] = Field(default_factory=dict)
+
+
+EventListener = Callable[[SessionEvent], None]
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, List[EventListener]] = {}
+
+    def subscribe(self, session_id: str, listener: EventListener):
+        with self._lock:
+            self._listeners.setdefault(session_id, []).append(listener)
+
+    def unsubscribe(self, session_id: str, listener: EventListener):
+        with self._lock:
+            listeners = self._listeners.get(session_id)
+            if listeners and listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self._listeners.pop(session_id, None)
+
+    def subscriber_count(self, session_id: str) -> int:
+        with self._lock:
+            return len(self._listeners.get(session_id, []))
+
+    def publish(self, event_type: str, session_id: str, **data):
+        with self._lock:
+            listeners = list(self._listeners.get(session_id, []))
+        if not listeners:
+            return
+        event = SessionEvent(type=event_type, session_id=session_id, data=data)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                # A broken subscriber must not fail the turn that published the event
+                logger.error(f"Error in listener for '{event_type}' of session '{session_id}': {e}", exc_info=True)
+
+
+_event_bus: Optional[EventBus] = None
+_event_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """Return the process-wide event bus."""
+    global _event_bus
+    if _event_bus is None:
+        with _event_bus_lock:
+            if _event_bus is None:
+                _event_bus = EventBus()
+    return _event_bus
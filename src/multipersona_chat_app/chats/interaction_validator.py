@@ -0,0 +1,145 @@
+"""
+Fast rule-based checks for generated interactions.
+
+The LocalInteractionValidator runs before the (expensive) LLM validation loop.
+It fixes what it can on its own and reports the issues it cannot fix, so the
+ChatManager only needs to call the LLM validator when the rules fail.
+"""
+import re
+import logging
+from typing import List, Optional
+from pydantic import BaseModel
+from models.interaction import Interaction, AppearanceSegments
+import utils
+
+logger = logging.getLogger(__name__)
+
+APPEARANCE_SUBFIELDS = [
+    "hair",
+    "clothing",
+    "accessories_and_held_items",
+    "posture_and_body_language",
+    "other_relevant_details",
+]
+
+LATEST_TAG_PATTERN = re.compile(r'\s*\[Latest\]\s*', flags=re.IGNORECASE)
+
+
+class LocalValidationResult(BaseModel):
+    interaction: Interaction   # The (possibly auto-fixed) interaction
+    fixes: List[str] = []      # Problems that were fixed automatically
+    issues: List[str] = []     # Problems that could not be fixed locally
+
+    @property
+    def passed(self) -> bool:
+        return not self.issues
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+class LocalInteractionValidator:
+    def __init__(
+        self,
+        required_fields: Optional[List[str]] = None,
+        max_action_length: int = 1200,
+        max_dialogue_length: int = 1200
+    ):
+        self.required_fields = required_fields if required_fields is not None else ["action"]
+        self.max_action_length = max_action_length
+        self.max_dialogue_length = max_dialogue_length
+
+    def validate(
+        self,
+        character_name: str,
+        interaction: Interaction,
+        current_location: str = "",
+        current_appearance: Optional[AppearanceSegments] = None
+    ) -> LocalValidationResult:
+        fixed = interaction.model_copy(deep=True)
+        fixes: List[str] = []
+        issues: List[str] = []
+
+        self._strip_latest_tags(fixed, fixes)
+        self._strip_markdown(fixed, fixes)
+        self._check_character_name(character_name, fixed, fixes, issues)
+        self._check_lengths(fixed, fixes)
+        self._check_completeness(fixed, issues)
+        self._check_state_consistency(fixed, current_location, current_appearance, fixes)
+
+        return LocalValidationResult(interaction=fixed, fixes=fixes, issues=issues)
+
+    def _strip_latest_tags(self, interaction: Interaction, fixes: List[str]):
+        for field in ("action", "dialogue", "new_location"):
+            value = getattr(interaction, field)
+            if LATEST_TAG_PATTERN.search(value):
+                setattr(interaction, field, LATEST_TAG_PATTERN.sub(" ", value).strip())
+                fixes.append(f"Removed [Latest] tag from {field}.")
+
+    def _strip_markdown(self, interaction: Interaction, fixes: List[str]):
+        for field in ("action", "dialogue"):
+            value = getattr(interaction, field)
+            cleaned = utils.remove_markdown(value)
+            if cleaned != value.strip():
+                setattr(interaction, field, cleaned)
+                fixes.append(f"Removed Markdown from {field}.")
+
+    def _check_character_name(self, character_name: str, interaction: Interaction, fixes: List[str], issues: List[str]):
+        name_pattern = re.compile(r'\b' + re.escape(character_name) + r'\b', flags=re.IGNORECASE)
+        # A leading "Name:" or "Name " is a common slip that can simply be dropped
+        prefix_pattern = re.compile(r'^\s*' + re.escape(character_name) + r'\s*[:\-]\s*', flags=re.IGNORECASE)
+        for field in ("action", "dialogue"):
+            value = getattr(interaction, field)
+            stripped = prefix_pattern.sub("", value)
+            if stripped != value:
+                setattr(interaction, field, stripped.strip())
+                fixes.append(f"Removed leading '{character_name}' from {field}.")
+                value = stripped
+            if name_pattern.search(value):
+                issues.append(f"The {field} mentions '{character_name}' by name.")
+
+    def _check_lengths(self, interaction: Interaction, fixes: List[str]):
+        for field, limit in (("action", self.max_action_length), ("dialogue", self.max_dialogue_length)):
+            value = getattr(interaction, field)
+            if limit and len(value) > limit:
+                truncated = value[:limit]
+                # Cut at the last sentence end inside the limit, if there is one
+                last_end = max(truncated.rfind(". "), truncated.rfind("! "), truncated.rfind("? "))
+                if last_end > 0:
+                    truncated = truncated[:last_end + 1]
+                setattr(interaction, field, truncated.strip())
+                fixes.append(f"Truncated {field} from {len(value)} to {len(truncated.strip())} characters.")
+
+    def _check_completeness(self, interaction: Interaction, issues: List[str]):
+        for field in self.required_fields:
+            if not (getattr(interaction, field, "") or "").strip():
+                issues.append(f"Required field '{field}' is empty.")
+
+    def _check_state_consistency(
+        self,
+        interaction: Interaction,
+        current_location: str,
+        current_appearance: Optional[AppearanceSegments],
+        fixes: List[str]
+    ):
+        # A "new" location identical to the current one is not a change
+        if interaction.new_location.strip() and _normalize(interaction.new_location) == _normalize(current_location):
+            interaction.new_location = ""
+            fixes.append("Cleared new_location identical to the current location.")
+
+        if interaction.new_appearance is None:
+            interaction.new_appearance = AppearanceSegments()
+            fixes.append("Added missing new_appearance.")
+            return
+
+        for subfield in APPEARANCE_SUBFIELDS:
+            new_val = getattr(interaction.new_appearance, subfield) or ""
+            if not new_val.strip():
+                if new_val:
+                    setattr(interaction.new_appearance, subfield, "")
+                continue
+            old_val = getattr(current_appearance, subfield) if current_appearance else ""
+            if _normalize(new_val) == _normalize(old_val or ""):
+                setattr(interaction.new_appearance, subfield, "")
+                fixes.append(f"Cleared new_appearance.{subfield} identical to the current appearance.")
@@ -0,0 +1,237 @@
+"""
+Registry of live ChatManagers, one per session.
+
+Every browser client has its own page with its own current session. Clients
+get the ChatManager for a session from this registry, so two clients looking
+at the same session share one manager, and clients looking at different
+sessions never touch each other's state. All managers share one DBManager
+(and, through llm.client_factory, the same LLM clients).
+
+Managers are kept in least-recently-used order. A manager that no client is
+viewing has its outstanding work cancelled, and is evicted once it has been
+idle for `idle_timeout` seconds or when more than `max_sessions` are live.
+API requests (see api/router.py) use a manager without viewing it (`get`); a
+session whose automatic chat was started that way is not evicted while it runs.
+
+Sessions are created with `new_session`; the registry never creates a session
+row while building a manager. A deleted session (`discard`) is remembered, so a
+manager still being built for it is dropped, and its manager is only evicted
+once no client holds it anymore (viewers are told with a session_deleted event).
+
+The registry is only used from the event loop, so it needs no locking. Async
+callers (the API) use `get_async`/`acquire_async`, which build a new manager
+(DB reads and writes) in a worker thread.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from chats.chat_manager import ChatManager, SessionNotFound
+from chats.events import get_event_bus, SESSION_DELETED
+from db.db_manager import DBManager
+from llm.call_ledger import get_call_ledger
+from models.character import Character
+
+logger = logging.getLogger(__name__)
+
+CHAT_MANAGER_CONFIG_PATH = os.path.join("src", "multipersona_chat_app", "config", "chat_manager_config.yaml")
+
+
+class SessionRegistry:
+    def __init__(
+        self,
+        settings: List[Dict],
+        characters: Dict[str, Character],
+        db: Optional[DBManager] = None,
+        max_sessions: int = 32,
+        idle_timeout: float = 1800
+    ):
+        self.settings = settings
+        self.characters = characters
+        self.db = db if db is not None else DBManager(os.path.join("output", "conversations.db"))
+        # All managers share this database, so the LLM call ledger is written there
+        get_call_ledger().attach(self.db)
+        self.max_sessions = max(1, max_sessions)
+        self.idle_timeout = idle_timeout
+        self._managers: "OrderedDict[str, ChatManager]" = OrderedDict()
+        self._clients: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        self._creating: Dict[str, asyncio.Future] = {}
+        self._deleted: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._managers)
+
+    def managers(self) -> List[ChatManager]:
+        return list(self._managers.values())
+
+    def viewed_count(self) -> int:
+        """Number of live sessions at least one client is viewing."""
+        return sum(1 for count in self._clients.values() if count > 0)
+
+    def new_session(self) -> str:
+        """Create an empty session with the default (first) setting and return its id."""
+        session_id = str(uuid.uuid4())
+        self.db.create_session(session_id, f"Session {session_id}")
+        if self.settings:
+            self.db.update_current_setting(session_id, self.settings[0]['name'])
+        return session_id
+
+    def list_sessions(self) -> List[Dict]:
+        """The sessions in the database, without those being deleted."""
+        return [s for s in self.db.get_all_sessions() if s['session_id'] not in self._deleted]
+
+    def create_manager(self, session_id: str) -> ChatManager:
+        """Build the manager of an existing session; raises SessionNotFound otherwise."""
+        manager = ChatManager(
+            you_name="You", session_id=session_id, settings=self.settings, db=self.db, create_session=False
+        )
+        for c_name in self.db.get_session_characters(session_id):
+            if c_name in self.characters:
+                manager.add_character(c_name, self.characters[c_name])
+            else:
+                logger.warning(f"Character '{c_name}' found in DB but not in the available characters.")
+        logger.info(f"Created ChatManager for session {session_id} ({len(self._managers) + 1} live).")
+        return manager
+
+    def _use(self, session_id: str) -> ChatManager:
+        if session_id in self._deleted:
+            raise SessionNotFound(f"Session '{session_id}' was deleted.")
+        manager = self._managers.get(session_id)
+        if manager is None:
+            manager = self.create_manager(session_id)
+            self._managers[session_id] = manager
+        self._managers.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
+        return manager
+
+    async def _create_in_thread(self, session_id: str):
+        """Create the manager for `session_id` in a worker thread, unless it is live already."""
+        if session_id in self._managers or session_id in self._deleted:
+            return
+        creating = self._creating.get(session_id)
+        if creating is None:
+            # Concurrent requests for the same new session wait for one manager
+            creating = asyncio.ensure_future(asyncio.to_thread(self.create_manager, session_id))
+            self._creating[session_id] = creating
+            creating.add_done_callback(lambda _: self._creating.pop(session_id, None))
+        manager = await creating
+        if session_id in self._deleted:
+            # Deleted while the manager was being built: remove anything it wrote meanwhile; _use reports it
+            manager.close()
+            await asyncio.to_thread(self.db.delete_session, session_id)
+            return
+        self._managers.setdefault(session_id, manager)
+
+    def acquire(self, session_id: str) -> ChatManager:
+        """Return the manager for `session_id` (creating it if needed) and count one more client viewing it."""
+        manager = self._use(session_id)
+        self._clients[session_id] = self._clients.get(session_id, 0) + 1
+        self.enforce_limit(keep=session_id)
+        return manager
+
+    async def acquire_async(self, session_id: str) -> ChatManager:
+        """acquire(), creating a new manager in a worker thread."""
+        await self._create_in_thread(session_id)
+        return self.acquire(session_id)
+
+    def get(self, session_id: str) -> ChatManager:
+        """
+        Return the manager for `session_id` (creating it if needed) without counting a client,
+        e.g. for a single API request. Such a manager is evicted like one nobody views.
+        """
+        manager = self._use(session_id)
+        self.enforce_limit(keep=session_id)
+        return manager
+
+    async def get_async(self, session_id: str) -> ChatManager:
+        """get(), creating a new manager in a worker thread."""
+        await self._create_in_thread(session_id)
+        return self.get(session_id)
+
+    def release(self, session_id: str):
+        """
+        A client stopped viewing `session_id`. The last one leaving cancels the session's work,
+        unless automatic chat was started through the API; that keeps running without viewers.
+        """
+        if session_id not in self._managers:
+            return
+        remaining = max(0, self._clients.get(session_id, 0) - 1)
+        self._clients[session_id] = remaining
+        self._last_used[session_id] = time.monotonic()
+        if remaining == 0 and session_id in self._deleted:
+            self._evict(session_id, "Session deleted.")
+        elif remaining == 0:
+            manager = self._managers[session_id]
+            if manager.automatic_running and manager.automatic_started_by == "api":
+                return
+            manager.stop_automatic_chat()
+            manager.cancel_session_work("No client is viewing the session anymore.")
+
+    def discard(self, session_id: str):
+        """
+        Mark `session_id` as deleted (call before deleting it from the database). Its work is
+        cancelled and its viewers are told to leave; the manager is evicted once nobody holds it.
+        """
+        self._deleted.add(session_id)
+        manager = self._managers.get(session_id)
+        if manager is not None:
+            manager.stop_automatic_chat()
+            manager.cancel_session_work("Session deleted.")
+        get_event_bus().publish(SESSION_DELETED, session_id)
+        if not self._clients.get(session_id):
+            self._evict(session_id, "Session deleted.")
+
+    def _evict(self, session_id: str, reason: str):
+        manager = self._managers.pop(session_id, None)
+        self._clients.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        if manager is not None:
+            manager.stop_automatic_chat()
+            manager.cancel_session_work(reason)
+            manager.close()
+            logger.info(f"Evicted ChatManager for session {session_id}: {reason}")
+
+    def enforce_limit(self, keep: Optional[str] = None):
+        """
+        Evict least recently used sessions until within the limit. Sessions with clients or
+        running automatic chat are kept, and so is `keep` (the session just used).
+        """
+        for session_id in list(self._managers.keys()):
+            if len(self._managers) <= self.max_sessions:
+                break
+            if session_id == keep or self._clients.get(session_id) or self._managers[session_id].automatic_running:
+                continue
+            self._evict(session_id, "Too many live sessions.")
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session_id in list(self._managers.keys()):
+            if self._clients.get(session_id) or self._managers[session_id].automatic_running:
+                # Automatic chat started through the API keeps running without a viewer
+                continue
+            if now - self._last_used.get(session_id, now) >= self.idle_timeout:
+                self._evict(session_id, "Idle.")
+
+    async def run_eviction_loop(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error evicting idle sessions: {e}", exc_info=True)
+
+
+def create_session_registry(settings: List[Dict], characters: Dict[str, Character]) -> SessionRegistry:
+    """A registry configured from chat_manager_config.yaml."""
+    config = ChatManager.load_config(CHAT_MANAGER_CONFIG_PATH)
+    return SessionRegistry(
+        settings,
+        characters,
+        max_sessions=config.get('max_live_sessions', 32),
+        idle_timeout=config.get('session_idle_timeout', 1800)
+    )
@@ -5,9 +5,13 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
 from models.interaction import AppearanceSegments
+from telemetry.tracing import trace_methods
 
 logger = logging.getLogger(__name__)
 
+# Larger than any message id (SQLite integers are 64-bit)
+MAX_MESSAGE_ID = 2 ** 63 - 1
+
 
 def merge_location_update(old_location: str, new_location: str) -> str:
     """
@@ -27,6 +31,7 @@ def merge_appearance_subfield(old_val: str, new_val: str) -> str:
     return new_val
 
 
+@trace_methods("db")
 class DBManager:
     def __init__(self, db_path: str):
         self.db_path = db_path
@@ -258,6 +263,37 @@ class DBManager:
         except sqlite3.OperationalError:
             logger.debug("Column 'why_new_plan_goal' already exists in 'character_plans_history'. Skipping.")
 
+        # Index for paging through the messages of a session
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)')
+
+        # Ledger of LLM and embedding calls (see llm/call_ledger.py). Durations are in milliseconds.
+        # Rows are kept when their session is deleted, so GPU time stays accounted for.
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                session_id TEXT,
+                character_name TEXT,
+                kind TEXT NOT NULL,
+                call_type TEXT NOT NULL,
+                model TEXT,
+                endpoint TEXT,
+                outcome TEXT NOT NULL,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                retries INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER,
+                response_tokens INTEGER,
+                ttft_ms REAL,
+                total_ms REAL,
+                ollama_total_ms REAL,
+                load_ms REAL,
+                prompt_eval_ms REAL,
+                eval_ms REAL,
+                tokens_per_second REAL
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_llm_calls_session_id ON llm_calls (session_id, call_type)')
+
         conn.commit()
         conn.close()
         logger.info("Database initialized with required tables (including new columns for segmented appearance).")
@@ -275,6 +311,104 @@ class DBManager:
         finally:
             conn.close()
 
+    #
+    # LLM call ledger
+    #
+    LLM_CALL_COLUMNS = (
+        'created_at', 'session_id', 'character_name', 'kind', 'call_type', 'model', 'endpoint',
+        'outcome', 'cache_hit', 'retries', 'prompt_tokens', 'response_tokens', 'ttft_ms', 'total_ms',
+        'ollama_total_ms', 'load_ms', 'prompt_eval_ms', 'eval_ms', 'tokens_per_second'
+    )
+    LLM_CALL_GROUPS = ('session_id', 'call_type', 'character_name', 'model', 'kind', 'outcome')
+
+    def add_llm_call(self, record: Dict[str, Any]):
+        self.add_llm_calls([record])
+
+    def add_llm_calls(self, records: List[Dict[str, Any]]):
+        """Insert ledger records in one transaction."""
+        rows = []
+        for record in records:
+            values = {col: record.get(col) for col in self.LLM_CALL_COLUMNS}
+            values['cache_hit'] = int(bool(values['cache_hit']))
+            values['retries'] = values['retries'] or 0
+            rows.append(tuple(values.values()))
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.executemany(
+            f"INSERT INTO llm_calls ({', '.join(self.LLM_CALL_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in self.LLM_CALL_COLUMNS)})",
+            rows
+        )
+        conn.commit()
+        conn.close()
+
+    def get_llm_calls(self, session_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """The most recent ledger entries, newest first."""
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        query = f"SELECT id, {', '.join(self.LLM_CALL_COLUMNS)} FROM llm_calls"
+        params: list = []
+        if session_id is not None:
+            query += " WHERE session_id = ?"
+            params.append(session_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        c.execute(query, params)
+        rows = c.fetchall()
+        conn.close()
+        return [dict(zip(('id',) + self.LLM_CALL_COLUMNS, row)) for row in rows]
+
+    def get_llm_call_stats(
+        self,
+        group_by: Optional[List[str]] = None,
+        session_id: Optional[str] = None,
+        since: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregates of the ledger grouped by any of LLM_CALL_GROUPS (default: call type),
+        e.g. group_by=['session_id', 'call_type']; an empty list gives the overall totals.
+        gpu_ms is Ollama's total_duration summed over the calls that reached the server; `since` is an
+        ISO timestamp.
+        """
+        group_by = list(group_by) if group_by is not None else ['call_type']
+        unknown = [g for g in group_by if g not in self.LLM_CALL_GROUPS]
+        if unknown:
+            raise ValueError(f"Cannot group LLM calls by {unknown}; allowed: {self.LLM_CALL_GROUPS}")
+
+        conditions, params = [], []
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        group = f"GROUP BY {', '.join(group_by)} ORDER BY gpu_ms DESC" if group_by else ""
+
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT {''.join(g + ', ' for g in group_by)}
+                   COUNT(*) AS calls,
+                   SUM(cache_hit) AS cache_hits,
+                   SUM(retries) AS retries,
+                   SUM(outcome NOT IN ('ok', 'cache_hit', 'shared')) AS failures,
+                   COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                   COALESCE(SUM(response_tokens), 0) AS response_tokens,
+                   COALESCE(SUM(ollama_total_ms), 0) AS gpu_ms,
+                   COALESCE(SUM(load_ms), 0) AS load_ms,
+                   COALESCE(SUM(total_ms), 0) AS wall_ms,
+                   AVG(ttft_ms) AS avg_ttft_ms,
+                   SUM(response_tokens) * 1000.0 / NULLIF(SUM(eval_ms), 0) AS tokens_per_second
+            FROM llm_calls
+            {where}
+            {group}
+        ''', params)
+        columns = [d[0] for d in c.description]
+        rows = c.fetchall()
+        conn.close()
+        return [dict(zip(columns, row)) for row in rows]
+
     def delete_session(self, session_id: str):
         conn = self._ensure_connection()
         c = conn.cursor()
@@ -287,6 +421,7 @@ class DBManager:
         c.execute('DELETE FROM character_plans WHERE session_id = ?', (session_id,))
         c.execute('DELETE FROM character_plans_history WHERE session_id = ?', (session_id,))
         c.execute('DELETE FROM message_visibility WHERE session_id = ?', (session_id,))
+        c.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
         conn.commit()
         conn.close()
         logger.info(f"Session with ID '{session_id}' and all associated data deleted.")
@@ -301,6 +436,16 @@ class DBManager:
         logger.debug(f"Retrieved {len(sessions)} sessions.")
         return sessions
 
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute('SELECT session_id, name, current_setting FROM sessions WHERE session_id = ?', (session_id,))
+        row = c.fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return {'session_id': row[0], 'name': row[1], 'current_setting': row[2]}
+
     def get_current_setting(self, session_id: str) -> Optional[str]:
         conn = self._ensure_connection()
         c = conn.cursor()
@@ -451,6 +596,29 @@ class DBManager:
             return " | ".join(combined)
         return ""
 
+    def get_character_appearance_segments(self, session_id: str, character_name: str) -> AppearanceSegments:
+        """
+        Returns the current appearance subfields of a character (empty if unknown).
+        """
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT hair, clothing, accessories_and_held_items, posture_and_body_language, other_relevant_details
+            FROM session_characters
+            WHERE session_id = ? AND character_name = ?
+        ''', (session_id, character_name))
+        row = c.fetchone()
+        conn.close()
+        if not row:
+            return AppearanceSegments()
+        return AppearanceSegments(
+            hair=row[0] or "",
+            clothing=row[1] or "",
+            accessories_and_held_items=row[2] or "",
+            posture_and_body_language=row[3] or "",
+            other_relevant_details=row[4] or ""
+        )
+
     def get_all_character_locations(self, session_id: str) -> Dict[str, str]:
         conn = self._ensure_connection()
         c = conn.cursor()
@@ -685,6 +853,77 @@ class DBManager:
         logger.debug(f"Message saved with ID {message_id} for session '{session_id}'.")
         return message_id
 
+    def update_message_reasoning(self,
+                                 message_id: int,
+                                 why_purpose: Optional[str],
+                                 why_affect: Optional[str],
+                                 why_action: Optional[str],
+                                 why_dialogue: Optional[str],
+                                 why_new_location: Optional[str],
+                                 why_new_appearance: Optional[str]
+                                ):
+        """
+        Fill in the why_* fields of a stored message, e.g. when they were
+        generated in a deferred pass instead of together with the message.
+        """
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute('''
+            UPDATE messages
+            SET why_purpose = ?, why_affect = ?, why_action = ?, why_dialogue = ?,
+                why_new_location = ?, why_new_appearance = ?
+            WHERE id = ?
+        ''', (
+            why_purpose,
+            why_affect,
+            why_action,
+            why_dialogue,
+            why_new_location,
+            why_new_appearance,
+            message_id
+        ))
+        conn.commit()
+        conn.close()
+        logger.debug(f"Reasoning fields updated for message ID {message_id}.")
+
+    def update_message_state(self,
+                             message_id: int,
+                             affect: Optional[str],
+                             purpose: Optional[str],
+                             new_location: Optional[str],
+                             hair: Optional[str],
+                             clothing: Optional[str],
+                             accessories_and_held_items: Optional[str],
+                             posture_and_body_language: Optional[str],
+                             other_relevant_details: Optional[str]
+                            ):
+        """
+        Fill in the state fields of a stored message that were derived after the
+        message itself was saved (two-stage turn generation).
+        """
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute('''
+            UPDATE messages
+            SET affect = ?, purpose = ?, new_location = ?,
+                hair = ?, clothing = ?, accessories_and_held_items = ?,
+                posture_and_body_language = ?, other_relevant_details = ?
+            WHERE id = ?
+        ''', (
+            affect,
+            purpose,
+            new_location,
+            hair,
+            clothing,
+            accessories_and_held_items,
+            posture_and_body_language,
+            other_relevant_details,
+            message_id
+        ))
+        conn.commit()
+        conn.close()
+        logger.debug(f"State fields updated for message ID {message_id}.")
+
     #
     # Per-character message visibility
     #
@@ -777,6 +1016,48 @@ class DBManager:
             f"Hidden messages {message_ids} for character '{character_name}' in session '{session_id}'."
         )
 
+    MESSAGE_COLUMNS = '''
+        id, sender, message, visible, message_type,
+        affect, purpose, created_at,
+        why_purpose, why_affect, why_action, why_dialogue,
+        why_new_location, why_new_appearance,
+        new_location,
+        hair, clothing, accessories_and_held_items, posture_and_body_language, other_relevant_details
+    '''
+
+    @staticmethod
+    def _message_from_row(row) -> Dict[str, Any]:
+        return {
+            'id': row[0],
+            'sender': row[1],
+            'message': row[2],
+            'visible': bool(row[3]),
+            'message_type': row[4],
+            'affect': row[5],
+            'purpose': row[6],
+            'created_at': row[7],
+            'why_purpose': row[8],
+            'why_affect': row[9],
+            'why_action': row[10],
+            'why_dialogue': row[11],
+            'why_new_location': row[12],
+            'why_new_appearance': row[13],
+            'new_location': row[14],
+            'hair': row[15],
+            'clothing': row[16],
+            'accessories_and_held_items': row[17],
+            'posture_and_body_language': row[18],
+            'other_relevant_details': row[19],
+        }
+
+    def get_message(self, message_id: int) -> Optional[Dict[str, Any]]:
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        c.execute(f'SELECT {self.MESSAGE_COLUMNS} FROM messages WHERE id = ?', (message_id,))
+        row = c.fetchone()
+        conn.close()
+        return self._message_from_row(row) if row else None
+
     def get_messages(self, session_id: str) -> List[Dict[str, Any]]:
         """
         This returns *all* messages in ascending order from the messages table.
@@ -785,47 +1066,56 @@ class DBManager:
         """
         conn = self._ensure_connection()
         c = conn.cursor()
-        c.execute('''
-            SELECT 
-                id, sender, message, visible, message_type,
-                affect, purpose, created_at,
-                why_purpose, why_affect, why_action, why_dialogue,
-                why_new_location, why_new_appearance,
-                new_location,
-                hair, clothing, accessories_and_held_items, posture_and_body_language, other_relevant_details
+        c.execute(f'''
+            SELECT {self.MESSAGE_COLUMNS}
             FROM messages
             WHERE session_id = ?
             ORDER BY id ASC
         ''', (session_id,))
         rows = c.fetchall()
-        messages = []
-        for row in rows:
-            messages.append({
-                'id': row[0],
-                'sender': row[1],
-                'message': row[2],
-                'visible': bool(row[3]),
-                'message_type': row[4],
-                'affect': row[5],
-                'purpose': row[6],
-                'created_at': row[7],
-                'why_purpose': row[8],
-                'why_affect': row[9],
-                'why_action': row[10],
-                'why_dialogue': row[11],
-                'why_new_location': row[12],
-                'why_new_appearance': row[13],
-                'new_location': row[14],
-                'hair': row[15],
-                'clothing': row[16],
-                'accessories_and_held_items': row[17],
-                'posture_and_body_language': row[18],
-                'other_relevant_details': row[19],
-            })
+        messages = [self._message_from_row(row) for row in rows]
         conn.close()
         logger.debug(f"Retrieved {len(messages)} messages for session '{session_id}'.")
         return messages
 
+    def get_messages_page(
+        self,
+        session_id: str,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """
+        Keyset pagination over the messages of a session, in ascending order:
+        - with `after_id`: the `limit` oldest messages with an id above it,
+        - otherwise: the `limit` newest messages with an id below `before_id` (or the newest overall).
+        Pass the id of the oldest (newest) returned message to get the page before (after) it.
+        """
+        conn = self._ensure_connection()
+        c = conn.cursor()
+        if after_id is not None:
+            c.execute(f'''
+                SELECT {self.MESSAGE_COLUMNS}
+                FROM messages
+                WHERE session_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?
+            ''', (session_id, after_id, limit))
+            rows = c.fetchall()
+        else:
+            c.execute(f'''
+                SELECT {self.MESSAGE_COLUMNS}
+                FROM messages
+                WHERE session_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (session_id, before_id if before_id is not None else MAX_MESSAGE_ID, limit))
+            rows = list(reversed(c.fetchall()))
+        conn.close()
+        messages = [self._message_from_row(row) for row in rows]
+        logger.debug(f"Retrieved a page of {len(messages)} messages for session '{session_id}'.")
+        return messages
+
     # Summaries
     def save_new_summary(self, session_id: str, character_name: str, summary: str, covered_up_to_message_id: int):
         conn = self._ensure_connection()
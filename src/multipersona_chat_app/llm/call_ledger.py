@@ -0,0 +1,166 @@
+"""
+Ledger of LLM and embedding calls.
+
+Every OllamaClient call is recorded in the `llm_calls` table with the timing
+stats of Ollama's final `done` frame (token counts, load/prompt/eval durations),
+the time to first token, retries, cache hits and the outcome. Calls are
+attributed to a session and character through a context variable set by the
+ChatManager (`llm_call_context`); it follows the call through the scheduler
+into the worker thread.
+
+Recording never waits on the database: records are put on a bounded queue and a
+writer thread inserts them in batches (one transaction per batch). When the
+queue is full, records are dropped and counted. The database is attached once,
+where the application (or a benchmark) sets up its DBManager; `flush` waits
+until everything queued so far is written.
+
+See DBManager.get_llm_call_stats for aggregates per session and call type.
+"""
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from telemetry.metrics import observe_llm_call
+
+logger = logging.getLogger(__name__)
+
+_call_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("llm_call_context", default={})
+
+
+@contextmanager
+def llm_call_context(**attributes):
+    """Attribute the LLM calls made inside the block, e.g. llm_call_context(session_id=..., character=...)."""
+    token = _call_context.set({**_call_context.get(), **attributes})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+
+def ns_to_ms(value: Optional[int]) -> Optional[float]:
+    return round(value / 1e6, 3) if value is not None else None
+
+
+def done_frame_stats(data: Dict[str, Any]) -> Dict[str, Any]:
+    """The timing stats of an Ollama `done` frame, durations in milliseconds."""
+    eval_count = data.get('eval_count')
+    eval_duration = data.get('eval_duration')
+    return {
+        'prompt_tokens': data.get('prompt_eval_count'),
+        'response_tokens': eval_count,
+        'ollama_total_ms': ns_to_ms(data.get('total_duration')),
+        'load_ms': ns_to_ms(data.get('load_duration')),
+        'prompt_eval_ms': ns_to_ms(data.get('prompt_eval_duration')),
+        'eval_ms': ns_to_ms(eval_duration),
+        'tokens_per_second': round(eval_count / eval_duration * 1e9, 2) if eval_count and eval_duration else None,
+    }
+
+
+class CallLedger:
+    def __init__(self, queue_size: int = 10000, batch_size: int = 200):
+        self.db = None
+        self.enabled = True
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._reported = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+    def attach(self, db):
+        """Write the ledger to `db` (a DBManager), from now on."""
+        if self.db is not None and self.db is not db:
+            # Records made so far belong to the previous database
+            self.flush()
+        with self._lock:
+            self.db = db
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="llm-call-ledger", daemon=True)
+                self._writer.start()
+
+    def record(
+        self,
+        kind: str,
+        call_type: Optional[str],
+        model: str,
+        outcome: str,
+        total_ms: float,
+        stats: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Record one call. `kind` is 'generate' or 'embedding', `call_type` the profile;
+        `stats` holds the optional columns (endpoint, retries, ttft_ms, done-frame stats)
+        and `cache_lookup`, whether the response cache was consulted (metrics only).
+        Failing to write the ledger never fails the call. The call is counted in the
+        metrics even when no database is attached.
+        """
+        context = _call_context.get()
+        record = {
+            'created_at': datetime.now().isoformat(),
+            'session_id': context.get('session_id'),
+            'character_name': context.get('character'),
+            'kind': kind,
+            'call_type': call_type or 'default',
+            'model': model,
+            'outcome': outcome,
+            'cache_hit': outcome == 'cache_hit',
+            'total_ms': round(total_ms, 3),
+            **(stats or {}),
+        }
+        observe_llm_call(record)
+        if self.db is None or not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            batch: List[Dict[str, Any]] = [self._queue.get()]
+            # Whatever piled up while the previous batch was written goes into this one
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self.db.add_llm_calls(records)
+            except Exception as e:
+                logger.warning(f"Could not record {len(records)} LLM call(s) in the ledger: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if self.dropped > self._reported:
+                logger.warning(f"LLM call ledger queue full: dropped {self.dropped - self._reported} record(s).")
+                self._reported = self.dropped
+            if len(records) < len(batch):
+                return
+
+    def flush(self):
+        """Wait until every record queued so far is written."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Write out the queued records and stop the writer thread."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join()
+
+
+_ledger = CallLedger()
+atexit.register(_ledger.close)
+
+
+def get_call_ledger() -> CallLedger:
+    return _ledger
@@ -0,0 +1,104 @@
+"""
+Cancellation tokens for LLM requests.
+
+A token is checked by OllamaClient between streamed lines. Cancelling it also
+closes the HTTP response that is currently streaming, so a blocked read returns
+immediately and Ollama sees the client disconnect and stops generating.
+Tokens can have children: cancelling a parent cancels all of its children.
+"""
+import threading
+import logging
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    """Raised by OllamaClient when a request is cancelled through its token."""
+
+
+class CancellationToken:
+    def __init__(self, parent: Optional["CancellationToken"] = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self._children: List["CancellationToken"] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._released = False
+        self.reason = ""
+        if parent is not None:
+            parent._add_child(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = ""):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            response = self._response
+            children = list(self._children)
+            callbacks = list(self._callbacks)
+        if response is not None:
+            try:
+                response.close()
+            except Exception as e:
+                logger.debug(f"Error closing cancelled response: {e}")
+        for child in children:
+            child.cancel(reason)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Error in cancellation callback: {e}")
+
+    def child(self) -> "CancellationToken":
+        """A new token that is cancelled together with this one."""
+        return CancellationToken(parent=self)
+
+    def _add_child(self, child: "CancellationToken"):
+        with self._lock:
+            # Drop children that are done, so long-lived tokens do not grow without bound
+            self._children = [c for c in self._children if not c.cancelled and not c._released]
+            self._children.append(child)
+            cancelled = self._event.is_set()
+        if cancelled:
+            child.cancel(self.reason)
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Call `callback` (from the cancelling thread) when this token is cancelled."""
+        with self._lock:
+            cancelled = self._event.is_set()
+            if not cancelled:
+                self._callbacks.append(callback)
+        if cancelled:
+            callback()
+
+    def release(self):
+        """Mark this token as no longer in use, so its parent can forget it."""
+        self._released = True
+        with self._lock:
+            self._callbacks = []
+
+    def attach(self, response):
+        """Register the response that is currently streaming for this token."""
+        with self._lock:
+            self._response = response
+            cancelled = self._event.is_set()
+        if cancelled:
+            response.close()
+
+    def detach(self):
+        with self._lock:
+            self._response = None
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to `timeout` seconds, returning early (True) if the token is cancelled."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason or "Generation cancelled.")
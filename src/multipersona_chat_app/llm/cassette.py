@@ -0,0 +1,307 @@
+"""
+Record and replay of Ollama traffic.
+
+In record mode every /api/generate and /api/embeddings request sent by the
+OllamaClient is written to a cassette: the fingerprint of the request body and
+the response, as the chunks it arrived in with their time offsets. In replay
+mode no request reaches Ollama: responses are served from the cassette, at the
+original speed, faster, or instantly. The client still gets a real
+requests.Response, so streaming, JSON repair, caching, cancellation, the ledger
+and everything above it (ChatManager, scheduler, DB) run exactly as they do
+against Ollama. This makes benchmark runs reproducible: record a workload once,
+then replay it to compare DB or scheduling changes on identical LLM output.
+
+Requests are matched on their fingerprint (kind and full serialized body).
+Identical requests are served in the order they were recorded; once those run
+out, the last one is served again. A request that was never recorded fails
+with CassetteMiss, which the client treats as an error (no retries).
+
+The cassette is a gzip file of JSON lines. Health probes are answered from the
+cassette during replay. Configured with the `cassette` section of
+llm_config.yaml; record and replay should start from the same response cache
+state (e.g. both with an empty cache), as cache hits never reach the cassette.
+"""
+import atexit
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from llm.single_flight import request_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+RECORDED_PATHS = ('/api/generate', '/api/embeddings')
+
+# A chunk of the response body and its offset in seconds from the start of the request
+Chunk = Tuple[float, bytes]
+
+
+class CassetteMiss(Exception):
+    """Raised during replay for a request that is not on the cassette."""
+
+
+def _encode(data: bytes) -> str:
+    # Chunks can split multi-byte characters; surrogateescape keeps the exact bytes
+    return data.decode('utf-8', errors='surrogateescape')
+
+
+def _decode(text: str) -> bytes:
+    return text.encode('utf-8', errors='surrogateescape')
+
+
+def _stream_finished(chunks: List[Chunk]) -> bool:
+    """Whether a generate stream ended with Ollama's `done` frame."""
+    lines = b"".join(data for _, data in chunks).strip().splitlines()
+    if not lines:
+        return False
+    try:
+        return bool(json.loads(lines[-1]).get('done'))
+    except (ValueError, AttributeError):
+        return False
+
+
+class _RecordingRaw:
+    """Wraps the raw stream of a live response and keeps every chunk that is read."""
+
+    def __init__(self, raw, started: float, on_complete):
+        self._raw = raw
+        self._started = started
+        self._on_complete = on_complete
+        self._committed = False
+        self.chunks: List[Chunk] = []
+
+    def stream(self, amt=None, decode_content=None):
+        for data in self._raw.stream(amt, decode_content=decode_content):
+            self.chunks.append((time.perf_counter() - self._started, data))
+            yield data
+        self._commit()
+
+    def close(self):
+        # The client closes the response as soon as the done frame arrived; a stream
+        # closed before that (cancelled, broken) is not recorded
+        if _stream_finished(self.chunks):
+            self._commit()
+        self._raw.close()
+
+    def _commit(self):
+        if not self._committed:
+            self._committed = True
+            self._on_complete(self.chunks)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _ReplayRaw:
+    """A raw stream that yields recorded chunks at their recorded offsets (divided by `speed`)."""
+
+    def __init__(self, chunks: List[Chunk], started: float, speed: float):
+        self._chunks = chunks
+        self._started = started
+        self._speed = speed
+        self._closed = threading.Event()
+
+    def _wait_until(self, offset: float) -> bool:
+        """Sleep until `offset`; returns True if the response was closed meanwhile."""
+        if self._speed > 0:
+            delay = offset / self._speed - (time.perf_counter() - self._started)
+            if delay > 0:
+                return self._closed.wait(delay)
+        return self._closed.is_set()
+
+    def stream(self, amt=None, decode_content=None):
+        for offset, data in self._chunks:
+            if self._wait_until(offset):
+                return
+            yield data
+
+    def read(self, amt=None, **kwargs) -> bytes:
+        return b"".join(self.stream())
+
+    def close(self):
+        self._closed.set()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode '{mode}'; use 'record' or 'replay'.")
+        self.path = path
+        self.mode = mode
+        self.speed = max(0.0, float(speed))
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._models: set = set()
+        self._file = None
+        self.counts = {'recorded': 0, 'replayed': 0, 'reused': 0, 'misses': 0}
+
+        if mode == 'record':
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+            self._write({'cassette': CASSETTE_VERSION, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        else:
+            self._load()
+
+    def _load(self):
+        entries = 0
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'cassette' in entry:
+                    continue
+                entry['chunks'] = [(offset, _decode(text)) for offset, text in entry['chunks']]
+                self._entries[entry['fingerprint']].append(entry)
+                if entry.get('model'):
+                    self._models.add(entry['model'])
+                entries += 1
+        logger.info(f"Loaded {entries} recorded responses from cassette {self.path}.")
+
+    def _write(self, record: Dict[str, Any]):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    #
+    # Transport: the subset of the requests API used by OllamaClient and the endpoint pool
+    #
+    def post(self, url: str, data=None, stream: bool = False, **kwargs) -> requests.Response:
+        path = urlsplit(url).path
+        if path not in RECORDED_PATHS:
+            if self.mode == 'replay':
+                raise CassetteMiss(f"{path} is not served during replay.")
+            return requests.post(url, data=data, stream=stream, **kwargs)
+        fingerprint = request_fingerprint(path, data or b"")
+        if self.mode == 'replay':
+            return self._replay(url, fingerprint, stream)
+        return self._record(url, path, fingerprint, data, stream, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        if self.mode == 'record':
+            return requests.get(url, **kwargs)
+        # Health probes and /api/ps: every model on the cassette is available and loaded
+        models = [{'name': m, 'model': m} for m in sorted(self._models)]
+        return self._response(url, 200, [(0.0, json.dumps({'models': models}).encode('utf-8'))], time.perf_counter(), False)
+
+    def _record(self, url: str, path: str, fingerprint: str, data, stream: bool, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        response = requests.post(url, data=data, stream=stream, **kwargs)
+        headers_s = time.perf_counter() - started
+        body = data.decode('utf-8') if isinstance(data, bytes) else (data or "")
+        try:
+            model = json.loads(body).get('model')
+        except ValueError:
+            model = None
+
+        def commit(chunks: List[Chunk]):
+            self._write({
+                'path': path,
+                'fingerprint': fingerprint,
+                'model': model,
+                'status': response.status_code,
+                'headers_s': round(headers_s, 4),
+                'stream': stream,
+                'chunks': [[round(offset, 4), _encode(data)] for offset, data in chunks],
+            })
+            with self._lock:
+                self.counts['recorded'] += 1
+
+        if not stream:
+            commit([(headers_s, response.content)])
+            return response
+        response.raw = _RecordingRaw(response.raw, started, commit)
+        if response.status_code >= 400:
+            # The client raises without reading the body; read it now so the error is on the cassette
+            _ = response.content
+        return response
+
+    def _replay(self, url: str, fingerprint: str, stream: bool) -> requests.Response:
+        started = time.perf_counter()
+        with self._lock:
+            queue = self._entries.get(fingerprint)
+            if queue:
+                entry = queue.popleft()
+                self._last[fingerprint] = entry
+                self.counts['replayed'] += 1
+            elif fingerprint in self._last:
+                entry = self._last[fingerprint]
+                self.counts['reused'] += 1
+            else:
+                self.counts['misses'] += 1
+                entry = None
+        if entry is None:
+            logger.error(f"Request {fingerprint[:12]} to {url} is not on cassette {self.path}.")
+            raise CassetteMiss(f"Request {fingerprint[:12]} is not on the cassette.")
+        if self.speed > 0:
+            time.sleep(max(0.0, entry['headers_s'] / self.speed))
+        return self._response(url, entry['status'], entry['chunks'], started, stream)
+
+    def _response(self, url: str, status: int, chunks: List[Chunk], started: float, stream: bool) -> requests.Response:
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/x-ndjson' if stream else 'application/json'
+        response.raw = _ReplayRaw(chunks, started, self.speed)
+        if not stream:
+            # Non-streamed responses are complete when post() returns, as with requests
+            response._content = response.raw.read()
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'path': self.path, 'mode': self.mode, 'speed': self.speed, **self.counts}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_cassettes: Dict[Tuple[str, str], Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(config: dict) -> Optional[Cassette]:
+    """The cassette of the `cassette` section of an LLM configuration, or None if it is off."""
+    settings = config.get('cassette') or {}
+    mode = settings.get('mode') or 'off'
+    if mode == 'off':
+        return None
+    path = settings.get('path') or "output/llm_cassette.jsonl.gz"
+    key = (mode, path)
+    cassette = _cassettes.get(key)
+    if cassette is None:
+        with _cassettes_lock:
+            cassette = _cassettes.get(key)
+            if cassette is None:
+                cassette = Cassette(path, mode, settings.get('speed', 1.0))
+                _cassettes[key] = cassette
+                logger.info(f"LLM traffic cassette: {mode} {path}")
+    return cassette
+
+
+def get_transport(config: dict):
+    """What LLM requests are sent through: the active cassette, or the requests module."""
+    return get_cassette(config) or requests
+
+
+def close_cassettes():
+    with _cassettes_lock:
+        for cassette in _cassettes.values():
+            cassette.close()
+
+
+atexit.register(close_cassettes)
@@ -0,0 +1,59 @@
+"""
+Shared OllamaClient instances.
+
+The LLM configuration is read once per config file and one client is kept per
+output model, instead of re-reading the YAML and rebuilding a client for every
+plan, validation, introduction, repetition and summary call.
+"""
+import os
+import threading
+from typing import Dict, Optional, Tuple, Type
+from pydantic import BaseModel
+
+from llm.ollama_client import OllamaClient
+from llm.schema_registry import warm_up
+
+DEFAULT_LLM_CONFIG_PATH = os.path.join("src", "multipersona_chat_app", "config", "llm_config.yaml")
+
+_lock = threading.Lock()
+_configs: Dict[str, dict] = {}
+_clients: Dict[Tuple[str, Optional[Type[BaseModel]]], OllamaClient] = {}
+
+
+def get_llm_config(config_path: str = DEFAULT_LLM_CONFIG_PATH) -> dict:
+    config = _configs.get(config_path)
+    if config is None:
+        with _lock:
+            config = _configs.get(config_path)
+            if config is None:
+                config = OllamaClient.load_config(config_path)
+                _configs[config_path] = config
+    return config
+
+
+def get_llm_client(
+    output_model: Optional[Type[BaseModel]] = None,
+    config_path: str = DEFAULT_LLM_CONFIG_PATH
+) -> OllamaClient:
+    """
+    Return the shared client for `output_model` (None for unstructured text and embeddings).
+    """
+    key = (config_path, output_model)
+    client = _clients.get(key)
+    if client is None:
+        config = get_llm_config(config_path)
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                if output_model is not None:
+                    warm_up(output_model)
+                client = OllamaClient(config_path, output_model=output_model, config=config)
+                _clients[key] = client
+    return client
+
+
+def reset_llm_clients():
+    """Forget all cached configs and clients, e.g. after the configuration file changed."""
+    with _lock:
+        _configs.clear()
+        _clients.clear()
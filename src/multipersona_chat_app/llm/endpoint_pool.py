@@ -0,0 +1,291 @@
+"""
+Load balancing over several Ollama hosts.
+
+The EndpointPool picks a host for every request:
+- only hosts whose circuit breaker lets requests through are considered,
+- hosts that have the requested model (according to their /api/tags) are preferred,
+- among those, the host with the fewest outstanding requests wins.
+
+A background thread probes every host's /api/tags to keep the model lists and
+health up to date. After `failure_threshold` consecutive failures a host's
+breaker opens and the host is skipped for `reset_timeout` seconds; then a
+single trial request (or a successful probe) decides whether it closes again.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import requests
+
+from llm.cassette import get_transport
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _base_url(url: str) -> str:
+    """'http://host:11434/api/generate' -> 'http://host:11434'"""
+    url = url.rstrip('/')
+    index = url.find('/api/')
+    return url[:index] if index != -1 else url
+
+
+def is_host_failure(error: Exception) -> bool:
+    """
+    Whether a failed request says something about the host's health. Connection errors,
+    timeouts, broken streams and 5xx responses do; 4xx responses (e.g. an unknown
+    model) and undecodable bodies do not.
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError
+    ))
+
+
+def _model_matches(requested: str, available: str) -> bool:
+    # Ollama reports 'llama3:latest' for a model requested as 'llama3'
+    if requested == available:
+        return True
+    if ':' not in requested:
+        return available == f"{requested}:latest"
+    return False
+
+
+class Endpoint:
+    def __init__(self, base_url: str):
+        self.base_url = _base_url(base_url)
+        self.outstanding = 0
+        self.models: Set[str] = set()
+        self.models_known = False
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def has_model(self, model: str) -> bool:
+        return any(_model_matches(model, available) for available in self.models)
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.base_url}, state={self.state}, outstanding={self.outstanding})"
+
+
+class EndpointPool:
+    def __init__(
+        self,
+        urls: List[str],
+        api_key: str = "",
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        health_check_interval: float = 15.0,
+        probe_timeout: float = 2.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        transport=requests
+    ):
+        if not urls:
+            raise ValueError("An endpoint pool needs at least one URL.")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.api_key = api_key
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.health_check_interval = health_check_interval
+        self.probe_timeout = probe_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # The requests module, or a cassette that answers probes during replay (see llm/cassette.py)
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    #
+    # Selection
+    #
+    def _available(self, endpoint: Endpoint, now: float) -> bool:
+        if endpoint.state == CLOSED:
+            return True
+        if endpoint.state == OPEN and now - endpoint.opened_at >= self.reset_timeout:
+            endpoint.state = HALF_OPEN
+            endpoint.trial_in_flight = False
+        # A half-open host gets a single trial request at a time
+        return endpoint.state == HALF_OPEN and not endpoint.trial_in_flight
+
+    def acquire(self, model: Optional[str] = None, exclude: Iterable[str] = ()) -> Optional[Endpoint]:
+        """
+        Pick the least busy available host for `model` and count the request as outstanding.
+        Hosts in `exclude` (base URLs already tried) are only used if nothing else is left.
+        Returns None if every host's breaker is open.
+        """
+        excluded = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            available = [e for e in self.endpoints if self._available(e, now)]
+            if not available:
+                return None
+            fresh = [e for e in available if e.base_url not in excluded]
+            candidates = fresh or available
+            if model:
+                with_model = [e for e in candidates if e.has_model(model)]
+                # Hosts whose tags have not been fetched yet might have it, the others do not
+                unknown = [e for e in candidates if not e.models_known]
+                candidates = with_model or unknown or candidates
+            endpoint = min(candidates, key=lambda e: (e.outstanding, random.random()))
+            endpoint.outstanding += 1
+            if endpoint.state == HALF_OPEN:
+                endpoint.trial_in_flight = True
+            return endpoint
+
+    def release(self, endpoint: Endpoint, success: bool, model: Optional[str] = None):
+        """Record the outcome of a request sent to `endpoint`. Only host-level failures should pass success=False."""
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.trial_in_flight = False
+            if success:
+                self._mark_healthy(endpoint)
+                if model:
+                    endpoint.models.add(model)
+            else:
+                self._mark_failed(endpoint)
+
+    def _mark_healthy(self, endpoint: Endpoint):
+        if endpoint.state != CLOSED:
+            logger.info(f"Ollama host {endpoint.base_url} is healthy again. Closing its circuit breaker.")
+        endpoint.state = CLOSED
+        endpoint.consecutive_failures = 0
+
+    def _mark_failed(self, endpoint: Endpoint):
+        endpoint.consecutive_failures += 1
+        if endpoint.state == HALF_OPEN or endpoint.consecutive_failures >= self.failure_threshold:
+            if endpoint.state != OPEN:
+                logger.warning(
+                    f"Opening circuit breaker for Ollama host {endpoint.base_url} after "
+                    f"{endpoint.consecutive_failures} consecutive failure(s)."
+                )
+            endpoint.state = OPEN
+            endpoint.opened_at = time.monotonic()
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for retry number `attempt` (1-based)."""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    #
+    # Health checks
+    #
+    def probe(self, endpoint: Endpoint) -> bool:
+        headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+        try:
+            response = self.transport.get(endpoint.url('/api/tags'), headers=headers, timeout=self.probe_timeout)
+            response.raise_for_status()
+            models = {m.get('name') or m.get('model') for m in response.json().get('models', [])}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug(f"Health probe of {endpoint.base_url} failed: {e}")
+            with self._lock:
+                self._mark_failed(endpoint)
+            return False
+
+        with self._lock:
+            endpoint.models = {m for m in models if m}
+            endpoint.models_known = True
+            self._mark_healthy(endpoint)
+        return True
+
+    def probe_all(self):
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+
+    def start_health_checks(self):
+        if self.health_check_interval <= 0 or self._health_thread is not None:
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.health_check_interval)
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    'url': e.base_url,
+                    'state': e.state,
+                    'outstanding': e.outstanding,
+                    'consecutive_failures': e.consecutive_failures,
+                    'models': sorted(e.models),
+                }
+                for e in self.endpoints
+            ]
+
+
+_pools: Dict[Tuple[str, ...], EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def endpoint_urls(config: dict) -> List[str]:
+    """The Ollama hosts of a configuration: the 'endpoints' list, or the host of 'api_url'."""
+    urls = config.get('endpoints') or []
+    if not urls:
+        urls = [config.get('api_url') or "http://localhost:11434"]
+    return [_base_url(url) for url in urls]
+
+
+def embedding_endpoint_urls(config: dict) -> List[str]:
+    """
+    The Ollama hosts for embeddings: the host of 'api_url_embeddings' when it differs
+    from the host of 'api_url' (embeddings served elsewhere), otherwise the generation hosts.
+    """
+    embeddings_url = config.get('api_url_embeddings')
+    generate_url = config.get('api_url') or "http://localhost:11434"
+    if embeddings_url and _base_url(embeddings_url) != _base_url(generate_url):
+        return [_base_url(embeddings_url)]
+    return endpoint_urls(config)
+
+
+def get_endpoint_pool(config: dict) -> EndpointPool:
+    """Return the shared pool for the hosts of `config`, starting its health checks on first use."""
+    return _pool_for(endpoint_urls(config), config)
+
+
+def get_embedding_pool(config: dict) -> EndpointPool:
+    """Return the shared pool for the embedding hosts of `config` (see embedding_endpoint_urls)."""
+    return _pool_for(embedding_endpoint_urls(config), config)
+
+
+def _pool_for(urls: List[str], config: dict) -> EndpointPool:
+    key = tuple(urls)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                settings = config.get('endpoint_pool') or {}
+                pool = EndpointPool(
+                    urls,
+                    api_key=config.get('api_key') or "",
+                    failure_threshold=settings.get('failure_threshold', 3),
+                    reset_timeout=settings.get('reset_timeout', 30),
+                    health_check_interval=settings.get('health_check_interval', 15),
+                    probe_timeout=settings.get('probe_timeout', 2),
+                    backoff_base=settings.get('backoff_base', 0.5),
+                    backoff_max=settings.get('backoff_max', 8),
+                    transport=get_transport(config)
+                )
+                pool.start_health_checks()
+                _pools[key] = pool
+    return pool
@@ -0,0 +1,280 @@
+"""
+Tolerant repair of truncated or malformed structured LLM output.
+
+IncrementalJSONRepairer is fed the streamed output chunk by chunk. At any point
+it can produce the best valid JSON document for what has been received so far:
+text before the first '{' and after the top-level object is dropped, an open
+value string is closed, incomplete keys/numbers/literals are cut back to the
+last complete member, and open arrays and objects are closed.
+
+A closed object that is not valid JSON (e.g. '{not json}' in text around the
+real answer) is skipped and the search restarts at the next '{'; repair_from
+does the same for an object that does not validate against the model.
+
+A repair that recovered no field of the model with a value (e.g. '{"go' from a
+truncated stream) is rejected, even though the defaults of every field would
+validate: an empty plan must not replace the stored one.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, ValidationError
+
+from llm.schema_registry import get_type_adapter
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONRepairer:
+    def __init__(self):
+        self._received: List[str] = []  # Everything fed so far
+        self._position = 0              # Next character of _received to consume
+        self._start = 0                 # Position of the '{' that opened the current candidate
+        self.discarded = 0              # Closed objects skipped (not valid JSON, or not matching the model)
+        self._reset()
+
+    def _reset(self):
+        self._chars: List[str] = [] # Characters of the top-level object received so far
+        self.skipped_prefix = 0     # Characters dropped before the first '{'
+        self.skipped_suffix = 0     # Characters dropped after the top-level object closed
+        self.complete = False       # True once the top-level object has been closed
+
+        self._started = False
+        self._stack: List[str] = []          # Open containers, '{' or '['
+        self._expect_key: List[bool] = []    # Per open container: next string is an object key
+        self._in_string = False
+        self._string_is_key = False
+        self._escape_start: Optional[int] = None
+        self._unicode_digits = 0
+        # Last position where the document could be closed validly, with the open containers at that point
+        self._safe_length = 0
+        self._safe_stack = ""
+
+    def feed(self, chunk: str):
+        self._received.extend(chunk)
+        while self._position < len(self._received):
+            ch = self._received[self._position]
+            self._position += 1
+            if self.complete:
+                self.skipped_suffix += 1
+                continue
+            if not self._started:
+                if ch == '{':
+                    self._started = True
+                    self._start = self._position - 1
+                else:
+                    self.skipped_prefix += 1
+                    continue
+            self._consume(ch)
+            if self.complete and not self._parses():
+                self._restart_after(self._start)
+
+    def _parses(self) -> bool:
+        try:
+            json.loads(self.text)
+            return True
+        except json.JSONDecodeError:
+            return False
+
+    def _restart_after(self, start: int):
+        """Drop the current candidate and look for the next '{' after position `start`."""
+        self.discarded += 1
+        self._reset()
+        self.skipped_prefix = start + 1
+        self._position = start + 1
+
+    def next_candidate(self) -> Optional["IncrementalJSONRepairer"]:
+        """
+        A repairer for the text after the opening '{' of this (closed) object, to try the
+        next object in the output. None if this object is not closed or nothing follows.
+        """
+        if not self.complete or self._start + 1 >= len(self._received):
+            return None
+        following = IncrementalJSONRepairer()
+        following.feed("".join(self._received[self._start + 1:]))
+        following.skipped_prefix += self._start + 1
+        following.discarded += self.discarded + 1
+        return following if following._started else None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chars)
+
+    def _mark_safe(self):
+        self._safe_length = len(self._chars)
+        self._safe_stack = "".join(self._stack)
+
+    def _consume(self, ch: str):
+        self._chars.append(ch)
+
+        if self._in_string:
+            if self._escape_start is not None:
+                if self._unicode_digits:
+                    self._unicode_digits -= 1
+                    if not self._unicode_digits:
+                        self._escape_start = None
+                elif ch == 'u':
+                    self._unicode_digits = 4
+                else:
+                    self._escape_start = None
+            elif ch == '\\':
+                self._escape_start = len(self._chars) - 1
+            elif ch == '"':
+                self._in_string = False
+                if not self._string_is_key:
+                    self._mark_safe()
+            return
+
+        if ch == '"':
+            self._in_string = True
+            self._string_is_key = bool(self._stack) and self._stack[-1] == '{' and self._expect_key[-1]
+        elif ch in '{[':
+            self._stack.append(ch)
+            self._expect_key.append(ch == '{')
+            self._mark_safe()
+        elif ch in '}]':
+            if self._stack:
+                self._stack.pop()
+                self._expect_key.pop()
+            self._mark_safe()
+            if not self._stack:
+                self.complete = True
+        elif ch == ',':
+            # Everything before the comma is a complete member
+            self._safe_length = len(self._chars) - 1
+            self._safe_stack = "".join(self._stack)
+            if self._stack and self._stack[-1] == '{':
+                self._expect_key[-1] = True
+        elif ch == ':':
+            if self._stack and self._stack[-1] == '{':
+                self._expect_key[-1] = False
+
+    def completion(self) -> Tuple[str, List[str]]:
+        """
+        Return a closed JSON document for the output so far, and a description of every repair made.
+        """
+        repairs: List[str] = []
+        if self.discarded:
+            repairs.append(f"Skipped {self.discarded} earlier object(s) that could not be used.")
+        if self.skipped_prefix:
+            repairs.append(f"Skipped {self.skipped_prefix} characters before the JSON object.")
+        if self.skipped_suffix:
+            repairs.append(f"Ignored {self.skipped_suffix} characters after the JSON object.")
+        if not self._started:
+            repairs.append("No JSON object found.")
+            return "", repairs
+        full_text = self.text
+        if self.complete:
+            return full_text, repairs
+
+        if self._in_string and not self._string_is_key:
+            text = full_text
+            if self._escape_start is not None:
+                text = text[:self._escape_start]
+            text += '"'
+            stack = "".join(self._stack)
+            repairs.append("Closed an unterminated string.")
+        else:
+            text = full_text[:self._safe_length]
+            stack = self._safe_stack
+            dropped = len(full_text) - self._safe_length
+            if dropped:
+                repairs.append(f"Dropped {dropped} characters of an incomplete member.")
+
+        closing = "".join('}' if opener == '{' else ']' for opener in reversed(stack))
+        if closing:
+            repairs.append(f"Closed {len(closing)} open container(s).")
+        return text + closing, repairs
+
+
+def _fill_missing_defaults(data: Dict[str, Any], model: Type[BaseModel], repairs: List[str], path: str = ""):
+    """
+    Report optional fields that pydantic fills with their defaults, and create nested
+    objects whose fields all have defaults (e.g. an empty new_appearance).
+    """
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        nested = annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+        if name not in data:
+            if not field.is_required():
+                repairs.append(f"Filled default for missing field '{path}{name}'.")
+            elif nested and all(not f.is_required() for f in nested.model_fields.values()):
+                data[name] = {}
+                repairs.append(f"Filled defaults for missing object '{path}{name}'.")
+        elif nested and isinstance(data[name], dict):
+            _fill_missing_defaults(data[name], nested, repairs, f"{path}{name}.")
+
+
+def _has_value(value: Any) -> bool:
+    return value not in (None, "", [], {})
+
+
+def recovered_fields(data: Dict[str, Any], model: Type[BaseModel]) -> List[str]:
+    """The fields of `model` that `data` has a non-empty value for."""
+    return [name for name in model.model_fields if name in data and _has_value(data[name])]
+
+
+def repair_structured_output(text: str, model: Type[BaseModel]) -> Tuple[Optional[BaseModel], List[str]]:
+    """
+    Try to turn `text` into an instance of `model`. Returns the instance (or None if
+    it cannot be repaired) and a list of the repairs that were made.
+    """
+    repairer = IncrementalJSONRepairer()
+    repairer.feed(text)
+    return repair_from(repairer, model)
+
+
+def repair_from(repairer: IncrementalJSONRepairer, model: Type[BaseModel]) -> Tuple[Optional[BaseModel], List[str]]:
+    """
+    Repair the output of `repairer` into an instance of `model`. If a closed object does
+    not validate, the next object in the output is tried, so the first valid one is returned.
+    """
+    result, repairs = _repair_candidate(repairer, model)
+    candidate = repairer
+    while result is None:
+        candidate = candidate.next_candidate()
+        if candidate is None:
+            break
+        result, candidate_repairs = _repair_candidate(candidate, model)
+        if result is not None:
+            repairs = candidate_repairs
+    return result, repairs
+
+
+def _repair_candidate(repairer: IncrementalJSONRepairer, model: Type[BaseModel]) -> Tuple[Optional[BaseModel], List[str]]:
+    document, repairs = repairer.completion()
+    if not document:
+        return None, repairs
+    try:
+        data = json.loads(document)
+    except json.JSONDecodeError as e:
+        repairs.append(f"Repaired text is still not valid JSON: {e}")
+        return None, repairs
+    if not isinstance(data, dict):
+        repairs.append("Repaired JSON is not an object.")
+        return None, repairs
+    if not recovered_fields(data, model):
+        repairs.append(f"No field of {model.__name__} was recovered; it would consist of defaults only.")
+        return None, repairs
+
+    _fill_missing_defaults(data, model, repairs)
+    try:
+        return get_type_adapter(model).validate_python(data), repairs
+    except ValidationError as e:
+        repairs.append(f"Repaired JSON does not match {model.__name__}: {e.error_count()} error(s).")
+        return None, repairs
+
+
+def partial_fields(repairer: IncrementalJSONRepairer) -> Dict[str, Any]:
+    """
+    The top-level fields received so far, as a dict (empty if nothing usable yet).
+    Meant for showing structured output while it is still streaming.
+    """
+    document, _ = repairer.completion()
+    if not document:
+        return {}
+    try:
+        data = json.loads(document)
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
@@ -0,0 +1,265 @@
+"""
+Keeps the configured Ollama models loaded.
+
+Loading a large model takes tens of seconds, which the first turn after startup
+(or after Ollama unloaded the model because it sat idle) would otherwise pay.
+The ModelWarmupManager runs in a background thread and:
+- preloads every model used by the generation profiles on every Ollama host
+  (the embedding model on the embedding hosts),
+- refreshes their keep_alive while the application is in use,
+- unloads them once the application has been idle for `idle_unload_after` seconds,
+- keeps a per-model load state that the UI shows in its status label.
+Its requests go through the same transport as the OllamaClient, so they are
+recorded on a cassette; during replay there is no Ollama to warm up and the
+manager is not started.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from llm.cassette import CassetteMiss, get_cassette, get_transport
+from llm.client_factory import DEFAULT_LLM_CONFIG_PATH, get_llm_client, get_llm_config
+from llm.endpoint_pool import get_endpoint_pool, get_embedding_pool
+
+logger = logging.getLogger(__name__)
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+LOADED = "loaded"
+FAILED = "failed"
+
+
+class ModelWarmupManager:
+    def __init__(
+        self,
+        config: dict,
+        keep_alive: str = "30m",
+        refresh_interval: float = 600,
+        idle_unload_after: float = 3600,
+        load_timeout: float = 600
+    ):
+        self.config = config
+        self.keep_alive = keep_alive
+        self.refresh_interval = refresh_interval
+        self.idle_unload_after = idle_unload_after
+        self.load_timeout = load_timeout
+        self.pool = get_endpoint_pool(config)
+        self.embedding_pool = get_embedding_pool(config)
+        self.models = self.configured_models()
+        self.states: Dict[str, str] = {model: UNLOADED for model, _ in self.models}
+        self.last_activity = time.monotonic()
+        self.idle_unloaded = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configured_models(self) -> List[Tuple[str, bool]]:
+        """(model name, is embedding model) for every distinct model used by the profiles."""
+        client = get_llm_client()
+        profiles = list((self.config.get('profiles') or {}).keys())
+        models: Dict[str, bool] = {}
+        for profile in [None, 'embedding'] + profiles:
+            model = client.get_profile(profile)['model']
+            if model:
+                models.setdefault(model, profile == 'embedding')
+        return list(models.items())
+
+    #
+    # Activity tracking
+    #
+    def mark_activity(self):
+        """Called for every LLM request. Wakes the manager to reload models after an idle unload."""
+        self.last_activity = time.monotonic()
+        if self.idle_unloaded:
+            self.idle_unloaded = False
+            self._wake.set()
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
+
+    #
+    # Status
+    #
+    def _set_state(self, model: str, state: str):
+        with self._lock:
+            self.states[model] = state
+
+    def status_text(self) -> str:
+        """A one-line summary for the UI. Empty when all models are loaded."""
+        with self._lock:
+            states = dict(self.states)
+        loading = [m for m, s in states.items() if s == LOADING]
+        failed = [m for m, s in states.items() if s == FAILED]
+        unloaded = [m for m, s in states.items() if s == UNLOADED]
+        if loading:
+            return f"Loading model(s): {', '.join(loading)}..."
+        if failed:
+            return f"Could not load model(s): {', '.join(failed)}"
+        if unloaded:
+            if self.idle_unloaded:
+                return "Models unloaded after inactivity. The next turn will reload them."
+            return f"Model(s) not loaded: {', '.join(unloaded)}"
+        return ""
+
+    #
+    # Ollama calls
+    #
+    def _headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        api_key = self.config.get('api_key')
+        if api_key:
+            headers['Authorization'] = f'Bearer {api_key}'
+        return headers
+
+    def _load_on(self, base_url: str, model: str, is_embedding: bool, keep_alive) -> bool:
+        # An empty request loads the model (or, with keep_alive 0, unloads it) without generating anything
+        if is_embedding:
+            url = f"{base_url}/api/embeddings"
+            payload = {'model': model, 'prompt': "", 'keep_alive': keep_alive}
+        else:
+            url = f"{base_url}/api/generate"
+            payload = {'model': model, 'keep_alive': keep_alive}
+        try:
+            response = get_transport(self.config).post(
+                url, headers=self._headers(), data=json.dumps(payload), timeout=self.load_timeout
+            )
+            response.raise_for_status()
+            return True
+        except (requests.exceptions.RequestException, CassetteMiss) as e:
+            logger.warning(f"Could not {'unload' if keep_alive == 0 else 'load'} model '{model}' on {base_url}: {e}")
+            return False
+
+    def pool_for(self, is_embedding: bool):
+        return self.embedding_pool if is_embedding else self.pool
+
+    def loaded_models(self) -> Dict[str, set]:
+        """Per host, the models Ollama reports as loaded (/api/ps)."""
+        loaded = {}
+        hosts = {e.base_url: e for e in self.pool.endpoints + self.embedding_pool.endpoints}
+        for endpoint in hosts.values():
+            try:
+                response = get_transport(self.config).get(
+                    endpoint.url('/api/ps'), headers=self._headers(), timeout=self.pool.probe_timeout
+                )
+                response.raise_for_status()
+                loaded[endpoint.base_url] = {
+                    m.get('name') or m.get('model') for m in response.json().get('models', [])
+                }
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.debug(f"Could not list loaded models on {endpoint.base_url}: {e}")
+        return loaded
+
+    def preload(self):
+        """Load (or refresh the keep_alive of) every configured model on every host."""
+        for model, is_embedding in self.models:
+            with self._lock:
+                first_load = self.states.get(model) != LOADED
+            if first_load:
+                self._set_state(model, LOADING)
+                logger.info(f"Preloading model '{model}'.")
+            results = [
+                self._load_on(endpoint.base_url, model, is_embedding, self.keep_alive)
+                for endpoint in self.pool_for(is_embedding).endpoints
+            ]
+            self._set_state(model, LOADED if any(results) else FAILED)
+
+    def unload(self):
+        logger.info(f"No activity for {self.idle_seconds:.0f}s. Unloading models.")
+        for model, is_embedding in self.models:
+            for endpoint in self.pool_for(is_embedding).endpoints:
+                self._load_on(endpoint.base_url, model, is_embedding, 0)
+            self._set_state(model, UNLOADED)
+        self.idle_unloaded = True
+
+    def sync_states(self):
+        """Mark models that Ollama unloaded on its own (e.g. after a restart) as unloaded."""
+        loaded = self.loaded_models()
+        if not loaded:
+            return
+        names = set().union(*loaded.values())
+        for model, _ in self.models:
+            present = model in names or f"{model}:latest" in names
+            with self._lock:
+                if self.states.get(model) == LOADED and not present:
+                    self.states[model] = UNLOADED
+
+    #
+    # Background loop
+    #
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        self.preload()
+        while not self._stop.is_set():
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if self.idle_unloaded:
+                    continue
+                if self.idle_unload_after and self.idle_seconds >= self.idle_unload_after:
+                    self.unload()
+                    continue
+                self.sync_states()
+                self.preload()
+            except Exception as e:
+                logger.error(f"Error in model warm-up loop: {e}", exc_info=True)
+
+
+_manager: Optional[ModelWarmupManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_model_warmup(config_path: str = DEFAULT_LLM_CONFIG_PATH) -> ModelWarmupManager:
+    """Return the process-wide warm-up manager, configured from the 'warmup' section of the LLM config."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                config = get_llm_config(config_path)
+                settings = config.get('warmup') or {}
+                _manager = ModelWarmupManager(
+                    config,
+                    keep_alive=settings.get('keep_alive', "30m"),
+                    refresh_interval=settings.get('refresh_interval', 600),
+                    idle_unload_after=settings.get('idle_unload_after', 3600),
+                    load_timeout=settings.get('load_timeout', 600)
+                )
+    return _manager
+
+
+def mark_activity():
+    """Record LLM activity, if the warm-up manager is running."""
+    if _manager is not None:
+        _manager.mark_activity()
+
+
+def start_model_warmup(config_path: str = DEFAULT_LLM_CONFIG_PATH) -> Optional[ModelWarmupManager]:
+    """Start the warm-up manager unless 'warmup.enabled' is false in the LLM config or a cassette is replayed."""
+    config = get_llm_config(config_path)
+    settings = config.get('warmup') or {}
+    if not settings.get('enabled', True):
+        logger.info("Model warm-up disabled in configuration.")
+        return None
+    cassette = get_cassette(config)
+    if cassette is not None and cassette.mode == 'replay':
+        logger.info("Replaying LLM traffic from a cassette. Model warm-up skipped.")
+        return None
+    manager = get_model_warmup(config_path)
+    manager.start()
+    return manager
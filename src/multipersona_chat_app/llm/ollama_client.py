@@ -2,23 +2,37 @@
 
 import requests
 import logging
-from typing import Optional, Type, List
-from pydantic import BaseModel
+from typing import Optional, Type, List, Dict, Any, Callable, Tuple
+from pydantic import BaseModel, ValidationError
 import yaml
 import json
 import os
+import time
 import numpy as np
 
 from db.cache_manager import CacheManager
+from llm.schema_registry import get_json_schema_text, parse_output
+from llm.json_repair import IncrementalJSONRepairer, repair_from
+from llm.cancellation import CancellationToken, GenerationCancelled
+from llm.endpoint_pool import get_endpoint_pool, get_embedding_pool, is_host_failure
+from llm.single_flight import SingleFlight, request_fingerprint
+from llm.call_ledger import get_call_ledger, done_frame_stats
+from llm.cassette import get_transport
+from telemetry.tracing import span
+from telemetry.log_pipeline import payload_digest, capture_payload
 
 logger = logging.getLogger(__name__)
 
+# Identical concurrent requests (from any client instance) share one call to Ollama
+_in_flight = SingleFlight()
+
 class OllamaClient:
-    def __init__(self, config_path: str, output_model: Optional[Type[BaseModel]] = None):
-        self.config = self.load_config(config_path)
+    def __init__(self, config_path: str, output_model: Optional[Type[BaseModel]] = None, config: Optional[dict] = None):
+        # A preloaded config (see llm.client_factory) avoids re-reading the YAML for every client
+        self.config = config if config is not None else self.load_config(config_path)
         self.output_model = output_model
         # Initialize cache
-        cache_file = os.path.join("output", "llm_cache")
+        cache_file = self.config.get('cache_file') or os.path.join("output", "llm_cache")
         self.cache_manager = CacheManager(cache_file)
 
     @staticmethod
@@ -38,30 +52,44 @@ class OllamaClient:
             logger.error(f"Unexpected error loading configuration: {e}")
             raise
 
-    def generate(
+    def get_profile(self, profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Resolve the generation settings for a named profile (interaction, introduction,
+        plan, state, summary, validation, embedding). Keys missing from the profile fall
+        back to the top-level defaults of the configuration.
+        """
+        profiles = self.config.get('profiles') or {}
+        overrides = (profiles.get(profile) or {}) if profile else {}
+        if profile and profile not in profiles:
+            logger.warning(f"Generation profile '{profile}' not found in configuration. Using defaults.")
+
+        if profile == 'embedding':
+            default_model = self.config.get('embedding_model_name') or "snowflake-arctic-embed2"
+        else:
+            default_model = self.config.get('model_name')
+
+        return {
+            'model': overrides.get('model') or default_model,
+            'temperature': overrides.get('temperature', self.config.get('temperature', 0.7)),
+            'num_predict': overrides.get('num_predict', self.config.get('num_predict')),
+            'num_ctx': overrides.get('num_ctx', self.config.get('num_ctx')),
+            'keep_alive': overrides.get('keep_alive', self.config.get('keep_alive')),
+            'timeout': overrides.get('timeout', self.config.get('timeout', 300)),
+        }
+
+    def build_request(
         self,
         prompt: str,
+        settings: Dict[str, Any],
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
-        system: Optional[str] = None,
-        use_cache: bool = True
-    ) -> Optional[BaseModel or str]:
-        model_name = self.config.get('model_name')
-
-        # Allow skipping cache if needed
-        if use_cache:
-            cached_response = self.cache_manager.get_cached_response(prompt, model_name)
-            if cached_response is not None:
-                logger.info("Returning cached LLM response.")
-                if self.output_model:
-                    try:
-                        return self.output_model.parse_raw(cached_response)
-                    except:
-                        logger.error("Error parsing cached response. Treating as invalid and returning None.")
-                        return None
-                else:
-                    return cached_response
-
+        system: Optional[str] = None
+    ) -> Tuple[Dict[str, str], Dict[str, Any], bytes]:
+        """
+        Build headers, payload and the serialized request body. The JSON schema of the
+        output model comes pre-serialized from the schema registry and is spliced into
+        the body as-is, so it is neither rebuilt nor re-encoded per request.
+        """
         headers = {
             'Content-Type': 'application/json',
         }
@@ -69,50 +97,177 @@ class OllamaClient:
         if api_key:
             headers['Authorization'] = f'Bearer {api_key}'
 
+        options = {
+            'temperature': temperature if temperature is not None else settings['temperature']
+        }
+        num_predict = max_tokens if max_tokens is not None else settings['num_predict']
+        if num_predict is not None:
+            options['num_predict'] = num_predict
+        if settings['num_ctx'] is not None:
+            options['num_ctx'] = settings['num_ctx']
+
         payload = {
-            'model': model_name,
+            'model': settings['model'],
             'prompt': prompt,
             "stream": True,
-            'options': {
-                'temperature': temperature if temperature is not None else self.config.get('temperature', 0.7)
-            }
+            'options': options
         }
 
+        if settings['keep_alive'] is not None:
+            payload['keep_alive'] = settings['keep_alive']
+
         if system:
             payload['system'] = system
 
+        body = json.dumps(payload)
         if self.output_model:
-            payload['format'] = self.output_model.model_json_schema()
+            body = body[:-1] + ', "format": ' + get_json_schema_text(self.output_model) + '}'
 
-        max_retries = self.config.get('max_retries', 3)
+        return headers, payload, body.encode('utf-8')
 
-        log_headers = headers.copy()
-        if 'Authorization' in log_headers:
-            log_headers['Authorization'] = 'Bearer ***'
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        system: Optional[str] = None,
+        use_cache: bool = True,
+        profile: Optional[str] = None,
+        on_partial: Optional[Callable[[str], None]] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Optional[BaseModel or str]:
+        """
+        Generate a completion. If `on_partial` is given, it is called with the raw
+        output accumulated so far every time a new chunk arrives from the stream.
+        Cancelling `cancel_token` closes the stream and raises GenerationCancelled.
+        """
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        settings = self.get_profile(profile)
+        model_name = settings['model']
+        started = time.perf_counter()
 
-        logger.info("Sending request to Ollama API")
-        logger.info(f"Request URL: {self.config.get('api_url')}")
-        logger.info(f"Request Headers: {log_headers}")
-        logger.info(f"Request Payload: {payload}")
+        # Allow skipping cache if needed
+        if use_cache:
+            cached_response = self.cache_manager.get_cached_response(prompt, model_name)
+            if cached_response is not None:
+                logger.info("Returning cached LLM response.")
+                get_call_ledger().record(
+                    'generate', profile, model_name, 'cache_hit', (time.perf_counter() - started) * 1000,
+                    {'cache_lookup': True}
+                )
+                if on_partial:
+                    on_partial(cached_response)
+                if self.output_model:
+                    parsed_cached = self.parse_structured_output(cached_response)
+                    if parsed_cached is None:
+                        logger.error("Error parsing cached response. Treating as invalid and returning None.")
+                    return parsed_cached
+                else:
+                    return cached_response
+
+        headers, payload, body = self.build_request(prompt, settings, max_tokens, temperature, system)
 
+        # Filled in by send_generate_request for the ledger; only the cache lookup is known for a shared result
+        call_stats: Dict[str, Any] = {'cache_lookup': use_cache}
+        outcome = 'error'
+        try:
+            result, shared = _in_flight.do(
+                request_fingerprint('generate', body),
+                lambda forward: self.send_generate_request(
+                    prompt, settings, headers, payload, body, use_cache, profile, forward, cancel_token, call_stats
+                ),
+                on_partial=on_partial,
+                cancel_token=cancel_token
+            )
+            if shared:
+                outcome = 'shared'
+            else:
+                outcome = 'ok' if result is not None else call_stats.pop('failure', 'failed')
+        except GenerationCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            call_stats.pop('failure', None)
+            get_call_ledger().record(
+                'generate', profile, model_name, outcome, (time.perf_counter() - started) * 1000, call_stats
+            )
+        if shared:
+            logger.info("Result taken from an identical request that was already in flight.")
+            if isinstance(result, BaseModel):
+                # Callers modify the returned interaction, so each gets its own copy
+                result = result.model_copy(deep=True)
+        return result
+
+    def send_generate_request(
+        self,
+        prompt: str,
+        settings: Dict[str, Any],
+        headers: Dict[str, str],
+        payload: Dict[str, Any],
+        body: bytes,
+        use_cache: bool,
+        profile: Optional[str],
+        on_partial: Optional[Callable[[str], None]],
+        cancel_token: Optional[CancellationToken],
+        call_stats: Optional[Dict[str, Any]] = None
+    ) -> Optional[BaseModel or str]:
+        """
+        Send a generate request, retrying with backoff on other hosts, and parse the streamed output.
+        The endpoint, retries, time to first token, done-frame stats and the reason of a failure
+        are put in `call_stats`.
+        """
+        if call_stats is None:
+            call_stats = {}
+        model_name = settings['model']
+        max_retries = self.config.get('max_retries', 3)
+
+        # Prompts are only logged as a digest; the full payload goes to the capture file if enabled
+        logger.info(
+            "Sending request to Ollama API (profile: %s, model: %s, options: %s); prompt %s; system %s",
+            profile or 'default', model_name, payload['options'],
+            payload_digest(prompt), payload_digest(payload.get('system'))
+        )
+
+        pool = get_endpoint_pool(self.config)
+        tried = []
         for attempt in range(1, max_retries + 1):
+            if attempt > 1 and self.wait_before_retry(pool, attempt - 1, cancel_token):
+                raise GenerationCancelled(cancel_token.reason or "Generation cancelled.")
+            endpoint = pool.acquire(model_name, exclude=tried)
+            if endpoint is None:
+                logger.warning(f"Attempt {attempt}: no healthy Ollama host available.")
+                continue
+            tried.append(endpoint.base_url)
+            host_failed = False
+            call_stats.update(endpoint=endpoint.base_url, retries=attempt - 1)
+            attempt_started = time.perf_counter()
+            logger.debug("Request URL: %s", endpoint.url('/api/generate'))
+            request_span = span(
+                "ollama.generate", endpoint=endpoint.base_url, attempt=attempt,
+                profile=profile or 'default', model=model_name, prompt_bytes=len(body)
+            )
+            error = None
             try:
-                with requests.post(
-                    self.config.get('api_url'),
+                with get_transport(self.config).post(
+                    endpoint.url('/api/generate'),
                     headers=headers,
-                    json=payload,
+                    data=body,
                     stream=True,
-                    timeout=self.config.get('timeout', 300)
+                    timeout=settings['timeout']
                 ) as response:
-                    logger.info(f"Received response with status code: {response.status_code}")
-                    logger.info(f"Response Headers: {response.headers}")
+                    if cancel_token:
+                        cancel_token.attach(response)
+                    logger.info("Received response with status code: %d", response.status_code)
                     response.raise_for_status()
 
                     output = ""
-                    for line in response.iter_lines(decode_unicode=True):
+                    repairer = IncrementalJSONRepairer() if self.output_model else None
+                    for line in response.iter_lines():
+                        if cancel_token and cancel_token.cancelled:
+                            break
                         if not line:
                             continue
-                        logger.debug(f"Raw response line: {line}")
 
                         try:
                             data = json.loads(line)
@@ -125,51 +280,144 @@ class OllamaClient:
                             raise Exception(data["error"])
 
                         content = data.get("response", "")
-                        output += content
+                        if content:
+                            if not output:
+                                call_stats['ttft_ms'] = round((time.perf_counter() - attempt_started) * 1000, 3)
+                                request_span.set(ttft_ms=call_stats['ttft_ms'])
+                            # A running string, so each chunk costs its own length rather than the whole output's
+                            output += content
+                            if repairer:
+                                repairer.feed(content)
+                            if on_partial:
+                                on_partial(output)
 
                         if data.get("done", False):
+                            call_stats.update(done_frame_stats(data))
+                            request_span.set(eval_count=data.get("eval_count"), prompt_eval_count=data.get("prompt_eval_count"))
+                            capture_payload(
+                                'generate', payload, output, profile=profile, endpoint=endpoint.base_url,
+                                stats={k: v for k, v in data.items() if k not in ('response', 'context')}
+                            )
                             # If we have an output model, parse it as structured data
                             if self.output_model:
-                                try:
-                                    parsed_output = self.output_model.parse_raw(output)
-                                    # Log the structured output so we can see it in the logs:
-                                    logger.info("Final parsed output (structured) stored in cache.")
-                                    logger.info(f"Structured Output: {parsed_output.dict()}")
-                                    # Store in cache if use_cache is True
-                                    if use_cache:
-                                        self.cache_manager.store_response(prompt, model_name, output)
-                                    return parsed_output
-                                except Exception as e:
-                                    logger.error(f"Error parsing model output: {e}")
+                                parsed_output, repaired = self.parse_or_repair(output, repairer)
+                                if parsed_output is None:
+                                    call_stats['failure'] = 'parse_error'
                                     return None
+                                logger.info("Final parsed output (structured): %s", payload_digest(output))
+                                # A repaired result is used once but never cached, so a later call asks the model again
+                                if use_cache and not repaired:
+                                    self.cache_manager.store_response(prompt, model_name, parsed_output.model_dump_json())
+                                return parsed_output
                             else:
                                 if use_cache:
                                     self.cache_manager.store_response(prompt, model_name, output)
-                                logger.info("Final unstructured output stored in cache.")
+                                logger.info("Final unstructured output: %s", payload_digest(output))
                                 return output
 
+                    if cancel_token:
+                        cancel_token.raise_if_cancelled()
                     logger.error("No 'done' signal received before the stream ended.")
+                    call_stats['failure'] = 'incomplete'
+                    if self.output_model and output:
+                        # Salvage what was generated rather than throwing it away
+                        return self.parse_structured_output(output, repairer)
                     return None
+            except GenerationCancelled:
+                logger.info(f"Request cancelled (profile: {profile or 'default'}).")
+                request_span.set(cancelled=True)
+                raise
             except requests.exceptions.RequestException as e:
-                logger.warning(f"Attempt {attempt} failed: {e}")
-                if attempt == max_retries:
-                    logger.error(f"All {max_retries} attempts failed. Giving up.")
-                    return None
-                else:
+                error = e
+                if cancel_token and cancel_token.cancelled:
+                    logger.info(f"Request cancelled (profile: {profile or 'default'}).")
+                    raise GenerationCancelled(cancel_token.reason or "Generation cancelled.")
+                host_failed = is_host_failure(e)
+                logger.warning(f"Attempt {attempt} on {endpoint.base_url} failed: {e}")
+                if attempt < max_retries:
                     logger.info(f"Retrying... (Attempt {attempt + 1} of {max_retries})")
             except Exception as e:
+                error = e
+                if cancel_token and cancel_token.cancelled:
+                    # Closing the response from another thread surfaces as an arbitrary read error
+                    logger.info(f"Request cancelled (profile: {profile or 'default'}).")
+                    raise GenerationCancelled(cancel_token.reason or "Generation cancelled.")
                 logger.error(f"An error occurred: {e}")
+                call_stats['failure'] = 'error'
                 return None
+            finally:
+                if cancel_token:
+                    cancel_token.detach()
+                pool.release(endpoint, success=not host_failed, model=model_name)
+                request_span.finish(error)
+
+        logger.error(f"All {max_retries} attempts failed. Giving up.")
+        call_stats['failure'] = 'failed'
+        return None
+
+    @staticmethod
+    def wait_before_retry(pool, retry: int, cancel_token: Optional[CancellationToken]) -> bool:
+        """Sleep the pool's backoff delay before a retry. Returns True if cancelled meanwhile."""
+        delay = pool.backoff_delay(retry)
+        logger.debug(f"Backing off {delay:.2f}s before retry {retry}.")
+        if cancel_token:
+            return cancel_token.wait(delay)
+        time.sleep(delay)
+        return False
+
+    def parse_structured_output(
+        self,
+        output: str,
+        repairer: Optional[IncrementalJSONRepairer] = None
+    ) -> Optional[BaseModel]:
+        """
+        Parse `output` into the output model. If it does not parse (truncated output,
+        text around the JSON, missing optional fields), try to repair it first.
+        Returns None if the output cannot be repaired.
+        """
+        return self.parse_or_repair(output, repairer)[0]
+
+    def parse_or_repair(
+        self,
+        output: str,
+        repairer: Optional[IncrementalJSONRepairer] = None
+    ) -> Tuple[Optional[BaseModel], bool]:
+        """parse_structured_output, also returning whether the result had to be repaired."""
+        try:
+            return parse_output(self.output_model, output), False
+        except ValidationError as e:
+            logger.warning(
+                f"Model output does not parse as {self.output_model.__name__} "
+                f"({e.error_count()} error(s)). Attempting repair."
+            )
+
+        if repairer is None:
+            repairer = IncrementalJSONRepairer()
+            repairer.feed(output)
+        repaired, repairs = repair_from(repairer, self.output_model)
+        if repaired is None:
+            logger.error(f"Error parsing model output, repair failed: {'; '.join(repairs)}")
+            return None, False
+        logger.warning(f"Repaired model output: {'; '.join(repairs)}")
+        return repaired, True
 
     #
     # NEW: Embedding and similarity helpers
     #
-    def get_embedding(self, sentence: str) -> List[float]:
+    def get_embedding(
+        self,
+        sentence: str,
+        profile: str = 'embedding',
+        cancel_token: Optional[CancellationToken] = None
+    ) -> List[float]:
         """
-        Generate an embedding for 'sentence' using the Ollama /api/embeddings endpoint.
+        Generate an embedding for 'sentence' using the Ollama /api/embeddings endpoint
+        of the embedding hosts (see endpoint_pool.embedding_endpoint_urls).
         """
-        url = self.config.get('api_url_embeddings') or "http://localhost:11434/api/embeddings"
-        model_name = self.config.get('embedding_model_name') or "snowflake-arctic-embed2"
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        settings = self.get_profile(profile)
+        model_name = settings['model']
 
         headers = {'Content-Type': 'application/json'}
         api_key = self.config.get('api_key')
@@ -180,30 +428,83 @@ class OllamaClient:
             'model': model_name,
             'prompt': sentence
         }
+        if settings['keep_alive'] is not None:
+            data['keep_alive'] = settings['keep_alive']
 
-        log_headers = headers.copy()
-        if 'Authorization' in log_headers:
-            log_headers['Authorization'] = 'Bearer ***'
-
-        logger.info("Sending request to Ollama Embeddings API")
-        logger.info(f"Request URL: {url}")
-        logger.info(f"Request Headers: {log_headers}")
-        logger.info(f"Request Payload: {data}")
+        logger.info("Sending request to Ollama Embeddings API (model: %s); text %s", model_name, payload_digest(sentence))
 
+        body = json.dumps(data)
+        started = time.perf_counter()
+        call_stats: Dict[str, Any] = {}
+        outcome = 'error'
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
-            logger.info(f"Received response with status code: {response.status_code}")
-            logger.info(f"Response Headers: {response.headers}")
-            response.raise_for_status()
-            emb_data = response.json().get('embedding', [])
-            logger.debug(f"Embedding data received: {emb_data}")
-            return emb_data
-        except requests.exceptions.RequestException as e:
-            logger.error(f"RequestException while fetching embedding: {e}")
-            return []
-        except Exception as e:
-            logger.error(f"Error fetching embedding: {e}")
-            return []
+            result, shared = _in_flight.do(
+                request_fingerprint('embedding', body),
+                lambda _: self.send_embedding_request(headers, body, settings, cancel_token, call_stats),
+                cancel_token=cancel_token
+            )
+            outcome = 'shared' if shared else ('ok' if result else 'failed')
+        except GenerationCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            get_call_ledger().record(
+                'embedding', profile, model_name, outcome, (time.perf_counter() - started) * 1000, call_stats
+            )
+        return list(result) if shared else result
+
+    def send_embedding_request(
+        self,
+        headers: Dict[str, str],
+        body: str,
+        settings: Dict[str, Any],
+        cancel_token: Optional[CancellationToken],
+        call_stats: Optional[Dict[str, Any]] = None
+    ) -> List[float]:
+        if call_stats is None:
+            call_stats = {}
+        model_name = settings['model']
+        pool = get_embedding_pool(self.config)
+        max_retries = self.config.get('max_retries', 3)
+        tried = []
+        for attempt in range(1, max_retries + 1):
+            if attempt > 1 and self.wait_before_retry(pool, attempt - 1, cancel_token):
+                raise GenerationCancelled(cancel_token.reason or "Generation cancelled.")
+            endpoint = pool.acquire(model_name, exclude=tried)
+            if endpoint is None:
+                logger.warning(f"Attempt {attempt}: no healthy Ollama host available for embeddings.")
+                continue
+            tried.append(endpoint.base_url)
+            host_failed = False
+            url = endpoint.url('/api/embeddings')
+            call_stats.update(endpoint=endpoint.base_url, retries=attempt - 1)
+            logger.debug("Request URL: %s", url)
+            request_span = span("ollama.embeddings", endpoint=endpoint.base_url, attempt=attempt, model=model_name)
+            error = None
+            try:
+                response = get_transport(self.config).post(url, headers=headers, data=body, timeout=settings['timeout'])
+                logger.debug("Received response with status code: %d", response.status_code)
+                response.raise_for_status()
+                response_data = response.json()
+                # Only newer Ollama versions report timings for embeddings
+                call_stats.update({k: v for k, v in done_frame_stats(response_data).items() if v is not None})
+                emb_data = response_data.get('embedding', [])
+                logger.debug("Embedding received (%d dimensions).", len(emb_data))
+                return emb_data
+            except requests.exceptions.RequestException as e:
+                error = e
+                host_failed = is_host_failure(e)
+                logger.warning(f"RequestException while fetching embedding from {endpoint.base_url}: {e}")
+            except Exception as e:
+                error = e
+                logger.error(f"Error fetching embedding: {e}")
+                return []
+            finally:
+                pool.release(endpoint, success=not host_failed, model=model_name)
+                request_span.finish(error)
+
+        logger.error(f"All {max_retries} embedding attempts failed.")
+        return []
 
     def compute_cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """
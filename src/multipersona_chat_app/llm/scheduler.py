@@ -0,0 +1,234 @@
+"""
+Priority-aware scheduling of LLM requests.
+
+Every call to Ollama goes through the LLMScheduler instead of being sent as soon
+as a coroutine issues it. Requests are queued per priority class and started
+when a slot is free, with a limit per class and a total that should match the
+number of parallel slots of the Ollama server (OLLAMA_NUM_PARALLEL).
+
+When a user-visible turn is waiting and all slots are busy, the lowest-priority
+running background request (plan, summary or backfill) is cancelled through its
+CancellationToken and put back in the queue, so interactive latency does not
+depend on how much background work is pending.
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Callable, Dict, List, Optional
+
+from llm.cancellation import CancellationToken, GenerationCancelled
+from llm.client_factory import DEFAULT_LLM_CONFIG_PATH, get_llm_config
+from llm.model_warmup import mark_activity
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    TURN = 0          # Dialogue and introductions the user is waiting for
+    VALIDATION = 1    # Validation of a turn, and embeddings for the repetition check
+    PLAN = 2          # Plan refreshes and two-stage state updates
+    SUMMARY = 3       # History and location summaries
+    BACKFILL = 4      # Deferred reasoning backfill
+
+
+PREEMPTIBLE = {Priority.PLAN, Priority.SUMMARY, Priority.BACKFILL}
+
+DEFAULT_LIMITS = {
+    Priority.TURN: 2,
+    Priority.VALIDATION: 1,
+    Priority.PLAN: 1,
+    Priority.SUMMARY: 1,
+    Priority.BACKFILL: 1,
+}
+
+
+class _Job:
+    def __init__(self, priority: Priority, seq: int, fn: Callable, args: tuple, kwargs: dict,
+                 cancel_token: Optional[CancellationToken], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancel_token = cancel_token  # The caller's token, if any
+        self.run_token: Optional[CancellationToken] = None
+        self.future = future
+        self.preempted = False
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        # The caller's context (ledger attribution, trace span); the request runs in it
+        # even when it is started from another job's completion
+        self.context = contextvars.copy_context()
+
+    @property
+    def abandoned(self) -> bool:
+        return self.future.done() or (self.cancel_token is not None and self.cancel_token.cancelled)
+
+    def name(self) -> str:
+        return f"{self.priority.name.lower()}#{self.seq}"
+
+
+class LLMScheduler:
+    def __init__(self, total_slots: int = 2, limits: Optional[Dict[Priority, int]] = None, preempt: bool = True):
+        self.total_slots = max(1, total_slots)
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.preempt = preempt
+        self._queue: List[_Job] = []
+        self._running: Dict[Priority, List[_Job]] = {p: [] for p in Priority}
+        self._seq = itertools.count()
+        self._tasks = set()
+
+    @property
+    def running_count(self) -> int:
+        return sum(len(jobs) for jobs in self._running.values())
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        return sum(1 for job in self._queue if priority is None or job.priority == priority)
+
+    async def submit(
+        self,
+        priority: Priority,
+        fn: Callable,
+        *args,
+        cancel_token: Optional[CancellationToken] = None,
+        **kwargs
+    ) -> Any:
+        """
+        Run `fn(*args, cancel_token=..., **kwargs)` in a worker thread once a slot is free
+        and return its result. `fn` must accept a `cancel_token` keyword argument
+        (OllamaClient.generate and get_embedding do). Raises GenerationCancelled if
+        `cancel_token` is cancelled before the request completes.
+        """
+        loop = asyncio.get_running_loop()
+        mark_activity()
+        job = _Job(Priority(priority), next(self._seq), fn, args, kwargs, cancel_token, loop.create_future())
+        watch = None
+        if cancel_token is not None:
+            # Wake the dispatcher when the caller cancels, so a queued request is dropped right away
+            watch = cancel_token.child()
+            watch.on_cancel(lambda: self._wake(loop))
+        self._queue.append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            if job.run_token:
+                job.run_token.cancel("Caller was cancelled.")
+            if job in self._queue:
+                self._queue.remove(job)
+            raise
+        finally:
+            if watch is not None:
+                watch.release()
+
+    def _wake(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._dispatch)
+        except RuntimeError:
+            pass  # The loop is already closed
+
+    def _can_start(self, job: _Job) -> bool:
+        return (
+            self.running_count < self.total_slots
+            and len(self._running[job.priority]) < self.limits.get(job.priority, 1)
+        )
+
+    def _dispatch(self):
+        # Drop requests whose callers have given up
+        for job in [j for j in self._queue if j.abandoned]:
+            self._queue.remove(job)
+            if not job.future.done():
+                job.future.set_exception(GenerationCancelled(job.cancel_token.reason or "Generation cancelled."))
+
+        self._queue.sort(key=lambda j: (j.priority, j.seq))
+        for job in list(self._queue):
+            if self.running_count >= self.total_slots:
+                break
+            if self._can_start(job):
+                self._queue.remove(job)
+                self._start(job)
+
+        if self.preempt:
+            self._preempt_for_turns()
+
+    def _preempt_for_turns(self):
+        waiting_turns = [
+            job for job in self._queue
+            if job.priority == Priority.TURN and len(self._running[Priority.TURN]) < self.limits[Priority.TURN]
+        ]
+        if not waiting_turns:
+            return
+        running = [job for p in PREEMPTIBLE for job in self._running[p]]
+        already_preempting = sum(1 for job in running if job.preempted)
+        needed = len(waiting_turns) - already_preempting
+        # Preempt the lowest priority first, and within a class the most recently started
+        candidates = sorted((job for job in running if not job.preempted), key=lambda j: (-j.priority, -j.seq))
+        for job in candidates[:max(0, needed)]:
+            logger.info(f"Preempting {job.name()} for a waiting turn.")
+            job.preempted = True
+            job.run_token.cancel("Preempted by a higher-priority request.")
+
+    def _start(self, job: _Job):
+        job.attempts += 1
+        job.preempted = False
+        job.run_token = job.cancel_token.child() if job.cancel_token else CancellationToken()
+        self._running[job.priority].append(job)
+        waited = time.monotonic() - job.queued_at
+        logger.debug(f"Starting {job.name()} (attempt {job.attempts}) after {waited:.3f}s in queue; "
+                     f"running={self.running_count}, queued={len(self._queue)}")
+        task = asyncio.create_task(self._run(job), context=job.context.copy())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job):
+        requeue = False
+        try:
+            result = await asyncio.to_thread(job.fn, *job.args, cancel_token=job.run_token, **job.kwargs)
+            if not job.future.done():
+                job.future.set_result(result)
+        except GenerationCancelled as e:
+            if job.preempted and not job.abandoned:
+                requeue = True
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running[job.priority].remove(job)
+            job.run_token.release()
+            if requeue:
+                logger.info(f"Requeueing preempted {job.name()}.")
+                job.queued_at = time.monotonic()
+                self._queue.append(job)
+            self._dispatch()
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(config_path: str = DEFAULT_LLM_CONFIG_PATH) -> LLMScheduler:
+    """Return the process-wide scheduler, configured from the 'scheduler' section of the LLM config."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                settings = get_llm_config(config_path).get('scheduler') or {}
+                limits = {
+                    priority: int(settings['limits'][priority.name.lower()])
+                    for priority in Priority
+                    if priority.name.lower() in (settings.get('limits') or {})
+                }
+                _scheduler = LLMScheduler(
+                    total_slots=int(settings.get('total_slots', 2)),
+                    limits=limits,
+                    preempt=bool(settings.get('preempt', True))
+                )
+    return _scheduler
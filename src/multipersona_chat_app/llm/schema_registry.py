@@ -0,0 +1,66 @@
+"""
+Process-wide registry of compiled validators and pre-serialized JSON schemas
+for the structured output models sent to Ollama.
+
+Building a JSON schema or a validator for a pydantic model is relatively
+expensive, and the set of output models is small and fixed, so both are
+computed once per model and reused for every request.
+"""
+import json
+import threading
+from typing import Dict, Type, Union
+from pydantic import BaseModel, TypeAdapter
+
+_lock = threading.Lock()
+_adapters: Dict[Type[BaseModel], TypeAdapter] = {}
+_schemas: Dict[Type[BaseModel], dict] = {}
+_schema_json: Dict[Type[BaseModel], str] = {}
+
+
+def get_type_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    adapter = _adapters.get(model)
+    if adapter is None:
+        with _lock:
+            adapter = _adapters.get(model)
+            if adapter is None:
+                adapter = TypeAdapter(model)
+                _adapters[model] = adapter
+    return adapter
+
+
+def get_json_schema(model: Type[BaseModel]) -> dict:
+    schema = _schemas.get(model)
+    if schema is None:
+        with _lock:
+            schema = _schemas.get(model)
+            if schema is None:
+                schema = model.model_json_schema()
+                _schemas[model] = schema
+    return schema
+
+
+def get_json_schema_text(model: Type[BaseModel]) -> str:
+    """
+    The JSON schema of `model`, already serialized, ready to be spliced into a request body.
+    """
+    text = _schema_json.get(model)
+    if text is None:
+        text = json.dumps(get_json_schema(model))
+        with _lock:
+            _schema_json.setdefault(model, text)
+    return text
+
+
+def parse_output(model: Type[BaseModel], data: Union[str, bytes]) -> BaseModel:
+    """
+    Parse raw JSON output into `model` using the cached validator.
+    Raises pydantic.ValidationError if it does not match.
+    """
+    return get_type_adapter(model).validate_json(data)
+
+
+def warm_up(*models: Type[BaseModel]):
+    """Compile validators and schemas ahead of the first request."""
+    for model in models:
+        get_type_adapter(model)
+        get_json_schema_text(model)
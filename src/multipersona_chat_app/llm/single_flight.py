@@ -0,0 +1,133 @@
+"""
+Single-flight deduplication of identical in-flight requests.
+
+When a request with the same fingerprint is already running, a new caller does
+not send its own request but attaches to the running one: it receives the
+partial output streamed so far, every later chunk, and the final result.
+
+If the caller that owns the request is cancelled, the followers that are not
+cancelled themselves retry, so one caller's Stop does not fail the others.
+"""
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from llm.cancellation import CancellationToken, GenerationCancelled
+
+logger = logging.getLogger(__name__)
+
+
+def request_fingerprint(kind: str, body: Union[str, bytes]) -> str:
+    """A key for the full request: its kind (generate, embedding) and serialized body."""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(kind.encode('utf-8') + b"\0" + body).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.partial: Optional[str] = None
+        self.listeners: List[Callable[[str], None]] = []
+        self.followers = 0
+
+    def broadcast(self, text: str):
+        with self.lock:
+            self.partial = text
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(text)
+            except Exception as e:
+                logger.debug(f"Error in partial output listener: {e}")
+
+
+class SingleFlight:
+    def __init__(self, poll_interval: float = 0.1):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[Callable[[str], None]], Any],
+        on_partial: Optional[Callable[[str], None]] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Run `fn(on_partial)` unless a call with the same `key` is already running, in which
+        case wait for that one. Returns the result and whether it was shared with another
+        caller (shared results must not be mutated).
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+
+            if leader:
+                return self._lead(key, flight, fn, on_partial), False
+
+            try:
+                return self._follow(flight, on_partial, cancel_token), True
+            except GenerationCancelled:
+                if cancel_token and cancel_token.cancelled:
+                    raise
+                # The caller that owned the request was cancelled; try again ourselves
+                logger.info("Shared request was cancelled by its owner. Retrying.")
+
+    def _lead(self, key: str, flight: _Flight, fn: Callable, on_partial: Optional[Callable[[str], None]]) -> Any:
+        if on_partial:
+            flight.listeners.append(on_partial)
+        try:
+            flight.result = fn(flight.broadcast)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+            if flight.followers:
+                logger.info(f"Shared one request with {flight.followers} identical concurrent request(s).")
+
+    def _follow(
+        self,
+        flight: _Flight,
+        on_partial: Optional[Callable[[str], None]],
+        cancel_token: Optional[CancellationToken]
+    ) -> Any:
+        with flight.lock:
+            flight.followers += 1
+            partial = flight.partial
+            if on_partial:
+                flight.listeners.append(on_partial)
+        try:
+            if on_partial and partial:
+                on_partial(partial)
+            while not flight.done.wait(self.poll_interval):
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+        finally:
+            if on_partial:
+                with flight.lock:
+                    if on_partial in flight.listeners:
+                        flight.listeners.remove(on_partial)
+
+        if flight.error is not None:
+            if isinstance(flight.error, GenerationCancelled):
+                raise GenerationCancelled(str(flight.error))
+            raise flight.error
+        return flight.result
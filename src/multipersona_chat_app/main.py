@@ -1,19 +1,14 @@
 import os
-import logging
-from ui.app import start_ui
+from telemetry.log_pipeline import setup_logging
 
 # Ensure output directory
 OUTPUT_DIR = "output"
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 
-# Configure logging to a file in the output directory
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename=os.path.join(OUTPUT_DIR, 'app.log'),
-    filemode='a'
-)
+# Log to a rotating file in the output directory through a background thread
+# (see config/logging_config.yaml)
+setup_logging(OUTPUT_DIR)
 
 from ui.app import start_ui
 
@@ -1,5 +1,7 @@
+import re
+from functools import lru_cache
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 
 
 class AppearanceSegments(BaseModel):
@@ -44,3 +46,104 @@ class Interaction(BaseModel):
             f"New Appearance: {self.new_appearance.model_dump() if self.new_appearance else 'None'}\n"
             f"Why New Appearance: {self.why_new_appearance if self.why_new_appearance else 'None'}\n"
         )
+
+
+# Names of the Interaction fields that only explain the character's reasoning.
+# They are stored with each message but only consumed by summarization.
+REASONING_FIELDS = [
+    "why_purpose",
+    "why_affect",
+    "why_action",
+    "why_dialogue",
+    "why_new_location",
+    "why_new_appearance",
+]
+
+
+_REASONING_KEY_LINE = re.compile(r'^[ \t]*"why_\w+"[ \t]*:.*\n?', re.MULTILINE)
+_TRAILING_COMMA = re.compile(r',(\s*\}+)')
+_FIELD_LIST = re.compile(r'\(([^()]*\bwhy_\w+[^()]*)\)')
+
+
+@lru_cache(maxsize=256)
+def strip_reasoning_fields(prompt: str) -> str:
+    """
+    Remove the why_* fields from the JSON format instructions of a character prompt:
+    the "why_...": "..." lines of the example structure and the why_* names in
+    field lists such as "(purpose, why_purpose, affect, ...)". Used in lean mode,
+    so the model is not asked for fields LeanInteraction drops.
+    """
+    prompt = _REASONING_KEY_LINE.sub('', prompt)
+    prompt = _TRAILING_COMMA.sub(r'\1', prompt)
+    return _FIELD_LIST.sub(
+        lambda m: '(' + ', '.join(f.strip() for f in m.group(1).split(',') if not f.strip().startswith('why_')) + ')',
+        prompt
+    )
+
+
+class LeanInteraction(BaseModel):
+    """
+    Interaction variant without the why_* reasoning fields.
+    Roughly halves the number of output tokens per turn.
+    """
+    purpose: str
+    affect: str
+    action: str
+    dialogue: str
+    new_location: str
+    new_appearance: AppearanceSegments
+
+    def to_interaction(self) -> Interaction:
+        """Convert into a full Interaction with empty reasoning fields."""
+        return Interaction(
+            **self.model_dump(),
+            **{field: "" for field in REASONING_FIELDS}
+        )
+
+
+class InteractionReasoning(BaseModel):
+    """
+    The why_* fields of one stored message, generated in a follow-up pass
+    when the interaction itself was produced without them.
+    """
+    message_id: int
+    why_purpose: str = ""
+    why_affect: str = ""
+    why_action: str = ""
+    why_dialogue: str = ""
+    why_new_location: str = ""
+    why_new_appearance: str = ""
+
+
+class InteractionReasoningBatch(BaseModel):
+    reasoning: List[InteractionReasoning] = []
+
+
+class DialogueTurn(BaseModel):
+    """
+    First stage of a two-stage turn: only the visible part of the interaction.
+    """
+    action: str
+    dialogue: str
+
+
+class StateUpdate(BaseModel):
+    """
+    Second stage of a two-stage turn: the state derived from an already shown action/dialogue.
+    """
+    purpose: str
+    affect: str
+    new_location: str
+    new_appearance: AppearanceSegments
+
+
+class ReasonedStateUpdate(StateUpdate):
+    """
+    StateUpdate including the why_* reasoning fields, used with the full interaction schema.
+    """
+    why_purpose: str
+    why_affect: str
+    why_action: str
+    why_dialogue: str
+    why_new_location: str
+    why_new_appearance: str
@@ -0,0 +1,337 @@
+"""
+Profile character turns without the UI.
+
+Loads a session from a copy of output/conversations.db (or creates a fixture
+session), runs turns against the fake Ollama server (benchmarks/fake_ollama.py,
+started as a separate process so it does not show up in the profiles) or
+--backend-url, and writes to --output-dir:
+- turns.prof            cProfile stats (pstats format, e.g. for snakeviz)
+- turns_cprofile.txt    the top functions by cumulative and by own time
+- turns.collapsed       wall-clock stack samples of all threads in the collapsed
+                        format of flamegraph.pl / speedscope / inferno
+- allocations.txt       tracemalloc: top allocation sites and what grew during the turns
+
+Each tool gets its own pass of --turns turns, so cProfile, the sampler and
+tracemalloc do not distort each other's results. The database given with --db
+is never modified; turns are run on a copy.
+
+Run from the repository root:
+    python src/multipersona_chat_app/profile_turn.py --turns 5
+    python src/multipersona_chat_app/profile_turn.py --fixture --characters 3 --turns 10
+"""
+import argparse
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from benchmarks.fake_ollama import FakeOllamaProcess, FakeOllamaSettings
+from benchmarks.turn_latency import CHARACTERS_DIR, configure_backend
+from chats.chat_manager import ChatManager
+from chats.session_registry import SessionRegistry
+from db.db_manager import DBManager
+from llm.call_ledger import get_call_ledger
+from llm.ollama_client import OllamaClient
+from utils import load_settings, get_available_characters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join("output", "conversations.db")
+
+
+class StackSampler:
+    """Samples the stacks of all threads at a fixed interval and counts them in the collapsed format."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)).replace(';', ':'))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class WorkerProfiles:
+    """
+    Before Python 3.12 a cProfile profiler only sees the thread that enabled it. LLM
+    calls run in scheduler worker threads, so there every call gets its own profiler
+    and the results are merged into the main stats.
+    """
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def wrap(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.profiles.append(profile)
+        return wrapper
+
+    def install(self):
+        for name in ('generate', 'get_embedding'):
+            self._originals[name] = getattr(OllamaClient, name)
+            setattr(OllamaClient, name, self.wrap(self._originals[name]))
+
+    def uninstall(self):
+        for name, fn in self._originals.items():
+            setattr(OllamaClient, name, fn)
+
+    def add_to(self, stats: pstats.Stats):
+        for profile in self.profiles:
+            stats.add(profile)
+
+
+def copy_database(source: str, target: str):
+    """Copy a SQLite database consistently, even while the app has it open."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def load_manager(args, workdir: str, settings, characters) -> ChatManager:
+    if args.fixture:
+        db = DBManager(os.path.join(workdir, "profile.db"))
+        get_call_ledger().attach(db)
+        manager = ChatManager(you_name="You", session_id=f"profile-{uuid.uuid4()}", settings=settings, db=db)
+        names = sorted(characters)[:args.characters]
+        if not names:
+            raise RuntimeError(f"No characters found in {CHARACTERS_DIR}.")
+        for name in names:
+            manager.add_character(name, characters[name])
+        return manager
+
+    if not os.path.exists(args.db):
+        raise RuntimeError(f"{args.db} does not exist; pass --fixture to profile a new session.")
+    db_copy = os.path.join(workdir, "profile.db")
+    copy_database(args.db, db_copy)
+    db = DBManager(db_copy)
+    sessions = db.get_all_sessions()
+    if not sessions:
+        raise RuntimeError(f"{args.db} has no sessions; pass --fixture to profile a new session.")
+    session_id = args.session or sessions[-1]['session_id']
+    if session_id not in {s['session_id'] for s in sessions}:
+        raise RuntimeError(f"Session '{session_id}' not found in {args.db}.")
+    manager = SessionRegistry(settings, characters, db=db).create_manager(session_id)
+    if not manager.get_character_names():
+        raise RuntimeError(f"Session '{session_id}' has no characters.")
+    return manager
+
+
+def format_stats(stats: pstats.Stats, top: int) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    out.write("Top functions by cumulative time\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    out.write("\nTop functions by own time\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return out.getvalue()
+
+
+def format_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int) -> str:
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ]
+    before, after = before.filter_traces(filters), after.filter_traces(filters)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced memory: {current / 1024:.1f} KiB now, {peak / 1024:.1f} KiB peak", ""]
+    lines.append(f"Top {top} allocation sites after the turns")
+    lines.extend(str(stat) for stat in after.statistics('lineno')[:top])
+    lines.append("")
+    lines.append(f"Top {top} allocation sites that grew during the turns")
+    lines.extend(str(stat) for stat in after.compare_to(before, 'lineno')[:top])
+    lines.append("")
+    lines.append("Largest allocation by traceback")
+    by_traceback = after.statistics('traceback')
+    if by_traceback:
+        lines.append(str(by_traceback[0]))
+        lines.extend(f"    {line}" for line in by_traceback[0].traceback.format())
+    return "\n".join(lines) + "\n"
+
+
+async def run_turns(manager: ChatManager, turns: int):
+    for _ in range(turns):
+        await manager.generate_next_turn()
+    # Wait for work the turns left running in the background (e.g. two-stage state updates)
+    if manager.background_tasks:
+        await asyncio.gather(*manager.background_tasks, return_exceptions=True)
+
+
+async def cprofile_pass(manager: ChatManager, args, output_dir: str) -> str:
+    workers = WorkerProfiles() if sys.version_info < (3, 12) else None
+    if workers:
+        workers.install()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await run_turns(manager, args.turns)
+    finally:
+        profile.disable()
+        if workers:
+            workers.uninstall()
+    stats = pstats.Stats(profile)
+    if workers:
+        workers.add_to(stats)
+    stats.dump_stats(os.path.join(output_dir, "turns.prof"))
+    report = format_stats(stats, args.top)
+    with open(os.path.join(output_dir, "turns_cprofile.txt"), 'w') as f:
+        f.write(report)
+    return report
+
+
+async def sampling_pass(manager: ChatManager, args, output_dir: str):
+    sampler = StackSampler(args.sample_interval)
+    sampler.start()
+    try:
+        await run_turns(manager, args.turns)
+    finally:
+        sampler.stop()
+    sampler.write(os.path.join(output_dir, "turns.collapsed"))
+
+
+async def memory_pass(manager: ChatManager, args, output_dir: str):
+    tracemalloc.start(args.traceback_depth)
+    try:
+        before = tracemalloc.take_snapshot()
+        await run_turns(manager, args.turns)
+        after = tracemalloc.take_snapshot()
+        report = format_allocations(before, after, args.top)
+    finally:
+        tracemalloc.stop()
+    with open(os.path.join(output_dir, "allocations.txt"), 'w') as f:
+        f.write(report)
+
+
+async def profile_turns(args, output_dir: str):
+    workdir = tempfile.mkdtemp(prefix="profile-turn-")
+    backend = None
+    try:
+        if args.backend_url:
+            base_url = args.backend_url.rstrip('/')
+        else:
+            backend = FakeOllamaProcess(FakeOllamaSettings(
+                time_to_first_token=args.ttft,
+                tokens_per_second=args.tps,
+                seed=args.seed
+            )).start()
+            base_url = backend.base_url
+        configure_backend(base_url, os.path.join(workdir, "llm_cache"))
+
+        settings = load_settings()
+        characters = get_available_characters(CHARACTERS_DIR)
+        manager = load_manager(args, workdir, settings, characters)
+        print(f"Session {manager.session_id}: {', '.join(manager.get_character_names())}, "
+              f"{len(manager.db.get_messages(manager.session_id))} messages.")
+
+        # Turns before profiling: introductions of fixture characters, warm caches
+        await run_turns(manager, args.warmup)
+
+        os.makedirs(output_dir, exist_ok=True)
+        report = None
+        if not args.no_cprofile:
+            started = time.perf_counter()
+            report = await cprofile_pass(manager, args, output_dir)
+            print(f"cProfile: {args.turns} turns in {time.perf_counter() - started:.2f}s")
+        if not args.no_sampling:
+            await sampling_pass(manager, args, output_dir)
+            print("Stack samples written.")
+        if not args.no_memory:
+            await memory_pass(manager, args, output_dir)
+            print("Allocations written.")
+
+        print(f"Results in {output_dir}")
+        if report:
+            print(report[:report.index("\nTop functions by own time")])
+    finally:
+        if backend is not None:
+            backend.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile character turns under cProfile, a stack sampler and tracemalloc.")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="database to copy the session from")
+    parser.add_argument('--session', default=None, help="session id (default: the most recently created session)")
+    parser.add_argument('--fixture', action='store_true', help="profile a new session instead of one from --db")
+    parser.add_argument('--characters', type=int, default=2, help="fixture: number of characters")
+    parser.add_argument('--turns', type=int, default=3, help="turns to run under each tool")
+    parser.add_argument('--warmup', type=int, default=None, help="turns before profiling (default: 0, or one per character with --fixture)")
+    parser.add_argument('--backend-url', default=None, help="use this server instead of an in-process fake Ollama")
+    parser.add_argument('--ttft', type=float, default=0.05, help="fake backend: time to first token in seconds")
+    parser.add_argument('--tps', type=float, default=200.0, help="fake backend: tokens per second")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default=None, help="default: output/profile-<timestamp>")
+    parser.add_argument('--top', type=int, default=30, help="functions and allocation sites to list")
+    parser.add_argument('--sample-interval', type=float, default=0.005, help="seconds between stack samples")
+    parser.add_argument('--traceback-depth', type=int, default=10, help="frames kept per allocation by tracemalloc")
+    parser.add_argument('--no-cprofile', action='store_true', help="skip cProfile")
+    parser.add_argument('--no-sampling', action='store_true', help="skip the stack sampler")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc")
+    args = parser.parse_args()
+    if args.warmup is None:
+        args.warmup = args.characters if args.fixture else 0
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output_dir = args.output_dir or os.path.join("output", f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+    asyncio.run(profile_turns(args, output_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Non-blocking, bounded logging.
+
+Log records are put on a bounded queue by a QueueHandler on the root logger and
+written by a QueueListener thread, so threads streaming from Ollama never wait
+on file I/O:
+- app.log is rotated by size (RotatingFileHandler),
+- when the queue is full, records are dropped (and counted) instead of blocking,
+- records whose arguments are plain values are formatted in the listener thread
+  (lazy %-style formatting, e.g. logger.info("Sent %d bytes", n)),
+- full LLM payloads are never logged to app.log; `payload_digest` gives a short,
+  hashed summary instead. With `capture_payloads` enabled, `capture_payload`
+  writes the full request and response as JSON lines to a separate gzip file.
+
+Configured from config/logging_config.yaml by main.py (setup_logging).
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Any, Dict, Optional
+
+import yaml
+
+LOGGING_CONFIG_PATH = "src/multipersona_chat_app/config/logging_config.yaml"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+PAYLOAD_LOGGER_NAME = 'llm.payloads'
+payload_logger = logging.getLogger(PAYLOAD_LOGGER_NAME)
+payload_logger.setLevel(logging.CRITICAL + 1)  # Disabled unless capture_payloads is set
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def payload_digest(text: str, preview_chars: int = 120) -> str:
+    """'<N chars, sha256 abcdef012345> preview...' - identifies a payload without logging it."""
+    if text is None:
+        return '<none>'
+    digest = hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()[:12]
+    preview = text[:preview_chars].replace('\n', ' ')
+    ellipsis = '...' if len(text) > preview_chars else ''
+    return f"<{len(text)} chars, sha256 {digest}> {preview}{ellipsis}"
+
+
+def capture_payload(kind: str, request: Dict[str, Any], response: Any = None, **details):
+    """Write a full request/response to the payload capture file, if enabled."""
+    if not payload_logger.isEnabledFor(logging.INFO):
+        return
+    payload_logger.info(json.dumps(
+        {'kind': kind, 'request': request, 'response': response, **details},
+        ensure_ascii=False, default=str
+    ))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments that are plain values cannot change before the listener formats them,
+        # so leave the formatting to the listener thread; anything else is formatted now.
+        if record.args and not (
+            isinstance(record.args, tuple) and all(isinstance(a, _PLAIN_TYPES) for a in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.dropped > self._reported:
+            dropped = self.dropped - self._reported
+            warning = logging.LogRecord(
+                'telemetry.log_pipeline', logging.WARNING, __file__, 0,
+                "Log queue full: dropped %d records.", (dropped,), None
+            )
+            try:
+                self.queue.put_nowait(warning)
+                self._reported += dropped
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class GzipLinesHandler(logging.Handler):
+    """Append the message of every record as one line to a gzip file."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._file.write(record.getMessage() + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class _ExcludeLogger(logging.Filter):
+    def __init__(self, name: str):
+        super().__init__()
+        self.excluded = name
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.name != self.excluded
+
+
+def load_logging_config(config_path: str = LOGGING_CONFIG_PATH) -> Dict[str, Any]:
+    try:
+        with open(config_path, 'r') as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def setup_logging(output_dir: str = "output", config_path: str = LOGGING_CONFIG_PATH) -> logging.handlers.QueueListener:
+    """Route all logging through a bounded queue to a rotating app.log (and the payload capture file)."""
+    global _listener
+    config = load_logging_config(config_path)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(output_dir, config.get('file', 'app.log')),
+        maxBytes=int(config.get('max_bytes', 20 * 1024 * 1024)),
+        backupCount=int(config.get('backup_count', 5)),
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler.addFilter(_ExcludeLogger(PAYLOAD_LOGGER_NAME))
+    handlers = [file_handler]
+
+    if config.get('capture_payloads', False):
+        capture_handler = GzipLinesHandler(os.path.join(output_dir, config.get('payload_file', 'llm_payloads.jsonl.gz')))
+        capture_handler.addFilter(logging.Filter(PAYLOAD_LOGGER_NAME))
+        handlers.append(capture_handler)
+        payload_logger.setLevel(logging.INFO)
+
+    log_queue = queue.Queue(maxsize=int(config.get('queue_size', 10000)))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Write out the queued records and close the files."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -0,0 +1,265 @@
+"""
+In-process metrics in the Prometheus text format (served at /metrics, see ui/metrics_endpoint.py).
+
+Counters and histograms are aggregated without locks on the hot path: every
+thread updates its own shard (a plain dict only that thread writes to) and a
+scrape sums the shards. Gauges are computed by callbacks at scrape time.
+
+The metrics are fed by:
+- finished spans (telemetry/tracing.py): `chat.*` stages and `db.*` calls,
+- the LLM call ledger (llm/call_ledger.py): LLM and embedding requests,
+- gauge callbacks registered by the UI: sessions, auto-chat, scheduler queue
+  and summarization backlog.
+"""
+import bisect
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from DB calls up to long generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _ShardedMetric:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            # Once per thread
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _shard_items(self) -> Iterable[Tuple[LabelValues, object]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # Copying a dict is atomic under the GIL, even while its thread updates it
+            yield from list(shard.items())
+
+
+class Counter(_ShardedMetric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._label_values(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for key, value in self._shard_items():
+            totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram(_ShardedMetric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._label_values(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket (not cumulative) counts, the +Inf bucket last, then sum and count
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def values(self) -> Dict[LabelValues, list]:
+        totals: Dict[LabelValues, list] = {}
+        for key, state in self._shard_items():
+            state = list(state)
+            if key in totals:
+                totals[key] = [a + b for a, b in zip(totals[key], state)]
+            else:
+                totals[key] = state
+        return totals
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+class Gauge:
+    """A value computed at scrape time: `callback()` returns a number, or {label values: number}."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], GaugeValue], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Could not compute gauge {self.name}: {e}")
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in sorted(value.items())
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = 'multipersona_'):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], GaugeValue], labelnames: Sequence[str] = ()) -> Gauge:
+        """Register (or replace) a gauge computed by `callback` at scrape time."""
+        return self._register(Gauge(self.prefix + name, documentation, callback, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+#
+# Application metrics
+#
+STAGE_SECONDS = _registry.histogram(
+    'chat_stage_duration_seconds', "Duration of the stages of turns and summarizations.", ['stage']
+)
+DB_CALL_SECONDS = _registry.histogram(
+    'db_call_duration_seconds', "Duration of DBManager calls.", ['method'], buckets=DB_BUCKETS
+)
+LLM_REQUESTS = _registry.counter(
+    'llm_requests_total', "LLM and embedding calls by outcome (ok, cache_hit, shared, failed, ...).",
+    ['kind', 'call_type', 'model', 'outcome']
+)
+LLM_REQUEST_SECONDS = _registry.histogram(
+    'llm_request_duration_seconds', "Client-side duration of LLM and embedding calls, retries included.",
+    ['kind', 'call_type', 'model']
+)
+LLM_TTFT_SECONDS = _registry.histogram(
+    'llm_time_to_first_token_seconds', "Time to the first streamed token of generate calls.", ['call_type', 'model']
+)
+LLM_TOKENS = _registry.counter(
+    'llm_tokens_total', "Prompt and response tokens reported by Ollama.", ['direction', 'call_type', 'model']
+)
+LLM_GPU_SECONDS = _registry.counter(
+    'llm_server_seconds_total', "Ollama total_duration of the calls, i.e. time spent on the server.", ['call_type', 'model']
+)
+LLM_CACHE_LOOKUPS = _registry.counter(
+    'llm_cache_lookups_total', "Response cache lookups of generate calls by result (hit, miss).", ['result']
+)
+
+
+def observe_span(span):
+    """Tracer observer: record stage and DB call durations."""
+    category, _, stage = span.name.partition('.')
+    seconds = (span.end_ns - span.start_ns) / 1e9
+    if category == 'chat':
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    elif category == 'db':
+        DB_CALL_SECONDS.observe(seconds, method=stage)
+
+
+def observe_llm_call(record: Dict):
+    """Record a ledger entry (see CallLedger.record)."""
+    kind, call_type, model = record['kind'], record['call_type'], record.get('model') or ''
+    outcome = record['outcome']
+    LLM_REQUESTS.inc(kind=kind, call_type=call_type, model=model, outcome=outcome)
+    if record.get('cache_lookup'):
+        # Calls made with use_cache=False never consulted the cache
+        LLM_CACHE_LOOKUPS.inc(result='hit' if outcome == 'cache_hit' else 'miss')
+    if outcome == 'cache_hit':
+        return
+    LLM_REQUEST_SECONDS.observe(record['total_ms'] / 1000, kind=kind, call_type=call_type, model=model)
+    if record.get('ttft_ms') is not None:
+        LLM_TTFT_SECONDS.observe(record['ttft_ms'] / 1000, call_type=call_type, model=model)
+    if record.get('prompt_tokens'):
+        LLM_TOKENS.inc(record['prompt_tokens'], direction='prompt', call_type=call_type, model=model)
+    if record.get('response_tokens'):
+        LLM_TOKENS.inc(record['response_tokens'], direction='response', call_type=call_type, model=model)
+    if record.get('ollama_total_ms'):
+        LLM_GPU_SECONDS.inc(record['ollama_total_ms'] / 1000, call_type=call_type, model=model)
@@ -0,0 +1,301 @@
+"""
+Lightweight span tracing of turns.
+
+A span records the name, start and duration of one stage (a turn, a plan update,
+an Ollama request, a DB call, ...) and its parent span. The current span is kept
+in a context variable, so it follows asyncio tasks and asyncio.to_thread calls:
+an Ollama request sent from a scheduler thread is a child of the stage that
+submitted it.
+
+Spans are grouped in traces. A trace starts with a root span (e.g. one turn,
+see `span(..., root=True)`); spans started outside any trace, such as DB calls
+made by the UI, are not recorded. The last `max_traces` traces are kept in
+memory and can be exported as Chrome trace-event JSON (chrome://tracing,
+https://ui.perfetto.dev) or viewed at /debug/traces.
+
+Observers (see Tracer.add_observer) are called with every finished span, in a
+trace or not, e.g. to feed the metrics in telemetry/metrics.py.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = (
+        'tracer', 'name', 'span_id', 'parent_id', 'trace_id', 'attributes',
+        'start_ns', 'end_ns', 'wall_start', 'thread_id', 'error', '_token'
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: Optional[int], parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent_id
+        self.trace_id = trace_id
+        self.attributes = attributes
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.wall_start = time.time()
+        self.thread_id = threading.get_ident()
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.perf_counter_ns()
+        if error is not None and self.error is None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._finish(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.finish(exc)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'trace_id': self.trace_id,
+            'start_ns': self.start_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'wall_start': self.wall_start,
+            'thread_id': self.thread_id,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned when a span is not recorded; supports the same calls as Span."""
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, root: Span):
+        self.trace_id = root.trace_id
+        self.root = root
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.root.name,
+            'attributes': self.root.attributes,
+            'wall_start': self.root.wall_start,
+            'duration_ms': round(self.root.duration_ms, 3),
+            'finished': self.root.end_ns is not None,
+            'dropped_spans': self.dropped,
+            'spans': [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start_ns)],
+        }
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, max_traces: int = 50, max_spans_per_trace: int = 5000):
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self._lock = threading.Lock()
+        self._traces: "OrderedDict[int, Trace]" = OrderedDict()
+        self._observers: List[Callable[[Span], None]] = []
+
+    def add_observer(self, observer: Callable[[Span], None]):
+        """Call `observer(span)` with every finished span, recorded in a trace or not."""
+        if observer not in self._observers:
+            self._observers = self._observers + [observer]
+
+    def start_span(self, name: str, root: bool = False, **attributes):
+        """
+        Start a span as a child of the current span. Without a current span a new trace
+        is started if `root` is true; otherwise the span is only measured for the observers,
+        or not at all without observers. The span only becomes the current span when used
+        as a context manager.
+        """
+        parent = _current_span.get()
+        if parent is not None and parent.tracer is self:
+            return Span(self, name, parent.trace_id, parent.span_id, attributes)
+        if not root or not self.enabled:
+            # Not part of a trace (trace_id None)
+            return Span(self, name, None, None, attributes) if self._observers else NOOP_SPAN
+        span = Span(self, name, next(_ids), None, attributes)
+        with self._lock:
+            self._traces[span.trace_id] = Trace(span)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return span
+
+    def _finish(self, span: Span):
+        for observer in self._observers:
+            observer(span)
+        if span.trace_id is None:
+            return
+        with self._lock:
+            trace = self._traces.get(span.trace_id)
+            if trace is None:
+                return
+            if len(trace.spans) < self.max_spans_per_trace:
+                trace.spans.append(span)
+            else:
+                trace.dropped += 1
+
+    #
+    # Reading
+    #
+    def traces(self) -> List[Dict[str, Any]]:
+        """Summaries of the kept traces, newest first."""
+        with self._lock:
+            traces = list(self._traces.values())
+        return [
+            {
+                'trace_id': t.trace_id,
+                'name': t.root.name,
+                'attributes': t.root.attributes,
+                'wall_start': t.root.wall_start,
+                'duration_ms': round(t.root.duration_ms, 3),
+                'finished': t.root.end_ns is not None,
+                'span_count': len(t.spans),
+            }
+            for t in reversed(traces)
+        ]
+
+    def get_trace(self, trace_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            return trace.to_dict() if trace else None
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def to_chrome_trace(self, trace_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Chrome trace-event JSON of the given (default: all kept) traces. Every trace gets
+        its own row (tid), so concurrent turns do not overlap; the thread a span ran on
+        is in its args.
+        """
+        with self._lock:
+            traces = [t for t in self._traces.values() if trace_ids is None or t.trace_id in trace_ids]
+            spans_by_trace = [(t, list(t.spans)) for t in traces]
+        events = []
+        for trace, spans in spans_by_trace:
+            events.append({
+                'ph': 'M', 'name': 'thread_name', 'pid': 1, 'tid': trace.trace_id,
+                'args': {'name': f"{trace.root.name} #{trace.trace_id}"},
+            })
+            for span in spans:
+                args = {str(k): v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                        for k, v in span.attributes.items()}
+                args.update({'span_id': span.span_id, 'parent_id': span.parent_id, 'thread_id': span.thread_id})
+                if span.error:
+                    args['error'] = span.error
+                events.append({
+                    'name': span.name,
+                    'cat': span.name.split('.')[0],
+                    'ph': 'X',
+                    'ts': span.start_ns / 1000,
+                    'dur': (span.end_ns - span.start_ns) / 1000,
+                    'pid': 1,
+                    'tid': trace.trace_id,
+                    'args': args,
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer."""
+    return _tracer
+
+
+def configure_tracing(enabled: bool = True, max_traces: int = 50, max_spans_per_trace: int = 5000):
+    _tracer.enabled = enabled
+    _tracer.max_traces = max_traces
+    _tracer.max_spans_per_trace = max_spans_per_trace
+    logger.info(f"Tracing {'enabled' if enabled else 'disabled'} (keeping the last {max_traces} traces).")
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def span(name: str, root: bool = False, **attributes):
+    """Context manager: `with span("chat.plan_update", character=name): ...`"""
+    return _tracer.start_span(name, root=root, **attributes)
+
+
+def traced(name: str, root: bool = False, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Decorator recording every call of a function (sync or async) as a span.
+    `attributes`, if given, is called with the function's arguments and returns span attributes.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, root=root, **(attributes(*args, **kwargs) if attributes else {})):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, root=root, **(attributes(*args, **kwargs) if attributes else {})):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(prefix: str):
+    """
+    Class decorator recording every public method call as a child span named
+    '<prefix>.<method>'. Calls made outside a trace cost one context variable lookup.
+    """
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or not inspect.isfunction(value):
+                continue
+            setattr(cls, attr, traced(f"{prefix}.{attr}")(value))
+        return cls
+    return decorator
@@ -1,569 +1,658 @@
-import os
-import uuid
 import asyncio
-import yaml
-from datetime import datetime
-from nicegui import ui, app, run
+import threading
+from nicegui import ui, app
 import logging
-from typing import List, Dict
-from llm.ollama_client import OllamaClient
-from models.interaction import Interaction, AppearanceSegments
+from typing import List, Dict, Optional
+from llm.model_warmup import start_model_warmup
 from models.character import Character
 from chats.chat_manager import ChatManager
-from utils import load_settings, get_available_characters
-from templates import (
-    CharacterIntroductionOutput,
-    INTRODUCTION_TEMPLATE,
-    CHARACTER_INTRODUCTION_SYSTEM_PROMPT_TEMPLATE
+from chats.session_registry import SessionRegistry, create_session_registry, CHAT_MANAGER_CONFIG_PATH
+from chats.events import (
+    get_event_bus,
+    SessionEvent,
+    MESSAGE_ADDED,
+    LOCATION_CHANGED,
+    APPEARANCE_CHANGED,
+    PLAN_CHANGED,
+    CHARACTER_ADDED,
+    CHARACTER_REMOVED,
+    SESSION_DELETED
 )
+from ui.chat_history_view import ChatHistoryView
+from ui import trace_viewer  # noqa: F401 - registers /debug/traces
+from ui.metrics_endpoint import setup_metrics
+from api.router import router as api_router, setup_api
+from telemetry.tracing import configure_tracing
+from utils import load_settings, get_available_characters
 
 logger = logging.getLogger(__name__)
 
-llm_client = None
-introduction_llm_client = None
-chat_manager = None
-
-user_input = None
-you_name_input = None
-character_dropdown = None
-added_characters_container = None
-next_speaker_label = None
-next_button = None
-settings_dropdown = None
-setting_description_label = None
-session_dropdown = None
-chat_display = None
-auto_timer = None
-current_location_label = None
-llm_status_label = None
-
-notification_queue = asyncio.Queue()
-
-def consume_notifications():
+# Shared by all clients
+ALL_CHARACTERS: Dict[str, Character] = {}
+ALL_SETTINGS: List[Dict] = []
+session_registry: Optional[SessionRegistry] = None
+model_warmup = None
+chat_view_settings: Dict = {}
+
+
+class ChatPage:
     """
-    Synchronous function called by ui.timer.
-    It checks the queue and displays notifications in the current UI context.
+    The UI of one browser client. Every client gets its own ChatPage with its own
+    elements and its own current session; the ChatManager of that session comes
+    from the shared session registry.
+
+    After the initial render the page only applies the session's events (see
+    chats.events): a new message appends one element, a changed location,
+    appearance or plan updates one label of one character card.
     """
-    while not notification_queue.empty():
-        message, msg_type = notification_queue.get_nowait()
-        ui.notify(message, type=msg_type)
-
-def init_chat_manager(session_id: str, settings: List[Dict]):
-    global chat_manager, llm_client, introduction_llm_client
-    logger.debug(f"Initializing ChatManager with session_id: {session_id}")
-    chat_manager = ChatManager(you_name="You", session_id=session_id, settings=settings)
-    try:
-        llm_client = OllamaClient('src/multipersona_chat_app/config/llm_config.yaml', output_model=Interaction)
-        logger.info("LLM Client initialized successfully (structured).")
-    except Exception as e:
-        logger.error(f"Error initializing LLM Client: {e}")
-
-    try:
-        introduction_llm_client = OllamaClient(
-            'src/multipersona_chat_app/config/llm_config.yaml',
-            output_model=CharacterIntroductionOutput
-        )
-        logger.info("Introduction LLM Client initialized successfully (structured).")
-    except Exception as e:
-        logger.error(f"Error initializing Introduction LLM Client: {e}")
-
-def refresh_added_characters():
-    logger.debug("Refreshing added characters in UI.")
-    if added_characters_container is not None:
-        added_characters_container.clear()
-        for char_name in chat_manager.get_character_names():
-            with added_characters_container:
-                with ui.card().classes('p-2 flex items-center'):
-                    ui.label(char_name).classes('flex-grow')
-                    ui.button(
-                        'Remove',
-                        on_click=lambda _, name=char_name: asyncio.create_task(remove_character_async(name)),
-                    ).classes('ml-2 bg-red-500 text-white')
-        logger.info("Added characters refreshed in UI.")
-    else:
-        logger.error("added_characters_container is not initialized.")
-
-@ui.refreshable
-def show_character_details():
-    global character_details_display
-    if character_details_display is not None:
-        character_details_display.clear()
-        char_names = chat_manager.get_character_names()
-        if not char_names:
-            with character_details_display:
-                ui.label("No characters added yet.")
+
+    def __init__(self):
+        self.chat_manager: Optional[ChatManager] = None
+        # The session that was released when the client disconnected, reopened if it reconnects
+        self.disconnected_session_id: Optional[str] = None
+
+        self.user_input = None
+        self.you_name_input = None
+        self.character_dropdown = None
+        self.added_characters_container = None
+        self.auto_switch = None
+        self.character_details_display = None
+        self.next_speaker_label = None
+        self.next_button = None
+        self.settings_dropdown = None
+        self.setting_description_label = None
+        self.session_dropdown = None
+        self.chat_view: Optional[ChatHistoryView] = None
+        self.current_location_label = None
+        self.llm_status_label = None
+        self.client = None
+        # The page is only changed on the event loop (see on_session_event)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+
+        # Per character: the elements of its card in the character details
+        self.character_cards: Dict[str, Dict[str, ui.element]] = {}
+
+    def notify(self, message: str, msg_type: str = 'info'):
+        """Show a notification on this client (also from background tasks)."""
+        with self.client:
+            ui.notify(message, type=msg_type)
+
+    def refresh_added_characters(self):
+        logger.debug("Refreshing added characters in UI.")
+        if self.chat_manager is None:
+            return
+        if self.added_characters_container is not None:
+            self.added_characters_container.clear()
+            for char_name in self.chat_manager.get_character_names():
+                with self.added_characters_container:
+                    with ui.card().classes('p-2 flex items-center'):
+                        ui.label(char_name).classes('flex-grow')
+                        ui.button(
+                            'Remove',
+                            on_click=lambda _, name=char_name: asyncio.create_task(self.remove_character_async(name)),
+                        ).classes('ml-2 bg-red-500 text-white')
+            logger.info("Added characters refreshed in UI.")
         else:
-            with character_details_display:
-                for c_name in char_names:
-                    with ui.card().classes('w-full mb-4 p-4 bg-gray-50'):
-                        ui.label(c_name).classes('text-lg font-bold mb-2 text-blue-600')
-                        
-                        loc = chat_manager.db.get_character_location(chat_manager.session_id, c_name)
-                        with ui.row().classes('mb-2'):
-                            ui.icon('location_on').classes('text-gray-600 mr-2')
-                            ui.label(f"Location: {loc if loc.strip() else '(Unknown location)'}"
-                                   ).classes('text-sm text-gray-700')
-                        
-                        appearance = chat_manager.db.get_character_appearance(chat_manager.session_id, c_name)
-                        with ui.row().classes('mb-2'):
-                            ui.icon('checkroom').classes('text-gray-600 mr-2')
-                            ui.label(f"Appearance: {appearance if appearance.strip() else '(Unknown appearance)'}"
-                                   ).classes('text-sm text-gray-700')
-
-                        # Show plan info
-                        plan_data = chat_manager.db.get_character_plan(chat_manager.session_id, c_name)
-                        if plan_data:
-                            with ui.row().classes('mt-2'):
-                                ui.icon('flag').classes('text-gray-600 mr-2')
-                                ui.label(f"Goal: {plan_data['goal']}")
-                            with ui.row().classes('mb-2'):
-                                ui.icon('list').classes('text-gray-600 mr-2')
-                                ui.label(f"Steps: {plan_data['steps']}")
-                        else:
-                            with ui.row().classes('mb-2'):
-                                ui.label("No plan found (it may be generated soon).")
-    else:
-        logger.error("character_details_display is not initialized.")
-
-def update_next_speaker_label():
-    ns = chat_manager.next_speaker()
-    if ns:
-        if next_speaker_label is not None:
-            next_speaker_label.text = f"Next speaker: {ns}"
-            next_speaker_label.update()
+            logger.error("added_characters_container is not initialized.")
+
+    @ui.refreshable
+    def show_character_details(self):
+        chat_manager = self.chat_manager
+        if self.character_details_display is not None:
+            self.character_details_display.clear()
+            self.character_cards = {}
+            if chat_manager is None:
+                return
+            char_names = chat_manager.get_character_names()
+            if not char_names:
+                with self.character_details_display:
+                    ui.label("No characters added yet.")
+            else:
+                with self.character_details_display:
+                    for c_name in char_names:
+                        self.render_character_card(c_name)
         else:
+            logger.error("character_details_display is not initialized.")
+
+    def render_character_card(self, c_name: str):
+        chat_manager = self.chat_manager
+        labels = {}
+        with ui.card().classes('w-full mb-4 p-4 bg-gray-50'):
+            ui.label(c_name).classes('text-lg font-bold mb-2 text-blue-600')
+
+            with ui.row().classes('mb-2'):
+                ui.icon('location_on').classes('text-gray-600 mr-2')
+                labels['location'] = ui.label().classes('text-sm text-gray-700')
+
+            with ui.row().classes('mb-2'):
+                ui.icon('checkroom').classes('text-gray-600 mr-2')
+                labels['appearance'] = ui.label().classes('text-sm text-gray-700')
+
+            # Show plan info
+            with ui.row().classes('mt-2') as goal_row:
+                ui.icon('flag').classes('text-gray-600 mr-2')
+                labels['goal'] = ui.label()
+            with ui.row().classes('mb-2') as steps_row:
+                ui.icon('list').classes('text-gray-600 mr-2')
+                labels['steps'] = ui.label()
+            with ui.row().classes('mb-2') as no_plan_row:
+                ui.label("No plan found (it may be generated soon).")
+        labels['goal_row'] = goal_row
+        labels['steps_row'] = steps_row
+        labels['no_plan_row'] = no_plan_row
+        self.character_cards[c_name] = labels
+
+        plan_data = chat_manager.db.get_character_plan(chat_manager.session_id, c_name)
+        self.update_character_card(
+            c_name,
+            location=chat_manager.db.get_character_location(chat_manager.session_id, c_name),
+            appearance=chat_manager.db.get_character_appearance(chat_manager.session_id, c_name),
+            plan=plan_data
+        )
+
+    def update_character_card(
+        self,
+        c_name: str,
+        location: Optional[str] = None,
+        appearance: Optional[str] = None,
+        plan: Optional[Dict] = None
+    ):
+        """Update the given parts of one character's card. Parts passed as None are left as they are."""
+        card = self.character_cards.get(c_name)
+        if card is None:
+            return
+        if location is not None:
+            card['location'].text = f"Location: {location if location.strip() else '(Unknown location)'}"
+        if appearance is not None:
+            card['appearance'].text = f"Appearance: {appearance if appearance.strip() else '(Unknown appearance)'}"
+        if plan is not None:
+            card['goal'].text = f"Goal: {plan['goal']}"
+            card['steps'].text = f"Steps: {plan['steps']}"
+        has_plan = bool(card['goal'].text)
+        card['goal_row'].visible = has_plan
+        card['steps_row'].visible = has_plan
+        card['no_plan_row'].visible = not has_plan
+
+    def update_next_speaker_label(self):
+        if self.chat_manager is None:
+            return
+        if self.next_speaker_label is None:
             logger.error("next_speaker_label is not initialized.")
-    else:
-        if next_speaker_label is not None:
-            next_speaker_label.text = "No characters available."
-            next_speaker_label.update()
+            return
+        ns = self.chat_manager.next_speaker()
+        if ns:
+            self.next_speaker_label.text = f"Next speaker: {ns}"
         else:
-            logger.error("next_speaker_label is not initialized.")
+            self.next_speaker_label.text = "No characters available."
+        self.next_speaker_label.update()
 
-def populate_session_dropdown():
-    logger.debug("Populating session dropdown.")
-    sessions = chat_manager.db.get_all_sessions()
-    session_names = [s['name'] for s in sessions]
-    session_dropdown.options = session_names
-    current = [s for s in sessions if s['session_id'] == chat_manager.session_id]
-    if current:
-        session_dropdown.value = current[0]['name']
-        logger.info(f"Session dropdown set to current session: {current[0]['name']}")
-    else:
-        session_dropdown.value = None
-
-def on_session_select(event):
-    selected_name = event.value
-    logger.info(f"Session selected: {selected_name}")
-    sessions = chat_manager.db.get_all_sessions()
-    for s in sessions:
-        if s['name'] == selected_name:
-            load_session(s['session_id'])
+    def populate_session_dropdown(self):
+        logger.debug("Populating session dropdown.")
+        if self.chat_manager is None:
             return
-    logger.warning(f"Selected session name '{selected_name}' not found.")
-
-def create_new_session(_):
-    new_id = str(uuid.uuid4())
-    session_name = f"Session {new_id}"
-    logger.info(f"Creating new session: {session_name} with ID: {new_id}")
-    chat_manager.db.create_session(new_id, session_name)
-
-    # Default to the first setting in ALL_SETTINGS if available
-    if ALL_SETTINGS:
-        default_setting = ALL_SETTINGS[0]
-        chat_manager.set_current_setting(
-            default_setting['name'],
-            default_setting['description'],
-            default_setting['start_location']
-        )
-        settings_dropdown.value = default_setting['name']
-        settings_dropdown.update()
-    else:
-        logger.error("No settings found. No default setting applied.")
-
-    load_session(new_id)
-
-def delete_session(_):
-    logger.info("Attempting to delete selected session.")
-    sessions = chat_manager.db.get_all_sessions()
-    if session_dropdown.value:
-        to_delete = [s for s in sessions if s['name'] == session_dropdown.value]
-        if to_delete:
-            sid = to_delete[0]['session_id']
-            logger.info(f"Deleting session: {to_delete[0]['name']} with ID: {sid}")
-            chat_manager.db.delete_session(sid)
-            if sid == chat_manager.session_id:
-                # If we're deleting the session currently in use, pick another or create new
-                remaining_sessions = chat_manager.db.get_all_sessions()
-                if remaining_sessions:
-                    new_session = remaining_sessions[0]
-                    logger.info(f"Loading remaining session: {new_session['name']} with ID: {new_session['session_id']}")
-                    load_session(new_session['session_id'])
-                else:
-                    new_id = str(uuid.uuid4())
-                    new_session_name = f"Session {new_id}"
-                    chat_manager.db.create_session(new_id, new_session_name)
-                    if ALL_SETTINGS:
-                        default_setting = ALL_SETTINGS[0]
-                        chat_manager.set_current_setting(
-                            default_setting['name'],
-                            default_setting['description'],
-                            default_setting['start_location']
-                        )
-                        settings_dropdown.value = default_setting['name']
-                        settings_dropdown.update()
-                    else:
-                        logger.error("No settings found. No default setting applied.")
-
-                    logger.info(f"No remaining sessions. Created and loading new session: {new_session_name}")
-                    load_session(new_id)
-            else:
-                populate_session_dropdown()
+        sessions = session_registry.db.get_all_sessions()
+        session_names = [s['name'] for s in sessions]
+        self.session_dropdown.options = session_names
+        current = [s for s in sessions if s['session_id'] == self.chat_manager.session_id]
+        if current:
+            self.session_dropdown.value = current[0]['name']
+            logger.info(f"Session dropdown set to current session: {current[0]['name']}")
         else:
-            logger.warning(f"Session to delete '{session_dropdown.value}' not found.")
-    else:
-        logger.warning("No session selected to delete.")
-
-def load_session(session_id: str):
-    logger.debug(f"Loading session with ID: {session_id}")
-    chat_manager.session_id = session_id
-    chat_manager.characters = {}
-
-    current_setting_name = chat_manager.db.get_current_setting(session_id)
-    setting = next((s for s in ALL_SETTINGS if s['name'] == current_setting_name), None)
-    if setting:
-        chat_manager.set_current_setting(
-            setting['name'],
-            setting['description'],
-            setting['start_location']
-        )
-        settings_dropdown.value = setting['name']
-        settings_dropdown.update()
-    else:
-        # If we don't find a matching setting, default to the first if any
-        if ALL_SETTINGS:
-            default_setting = ALL_SETTINGS[0]
-            chat_manager.set_current_setting(
-                default_setting['name'],
-                default_setting['description'],
-                default_setting['start_location']
-            )
-            settings_dropdown.value = default_setting['name']
-            settings_dropdown.update()
+            self.session_dropdown.value = None
+
+    def on_session_select(self, event):
+        selected_name = event.value
+        if self.chat_manager is None:
+            return
+        logger.info(f"Session selected: {selected_name}")
+        sessions = session_registry.db.get_all_sessions()
+        for s in sessions:
+            if s['name'] == selected_name:
+                if s['session_id'] != self.chat_manager.session_id:
+                    self.load_session(s['session_id'])
+                return
+        logger.warning(f"Selected session name '{selected_name}' not found.")
+
+    def create_new_session(self, _=None):
+        # Its ChatManager applies the default setting
+        new_id = session_registry.new_session()
+        logger.info(f"Created new session with ID: {new_id}")
+        self.load_session(new_id)
+
+    def delete_session(self, _=None):
+        logger.info("Attempting to delete selected session.")
+        if self.chat_manager is None:
+            return
+        sessions = session_registry.db.get_all_sessions()
+        if not self.session_dropdown.value:
+            logger.warning("No session selected to delete.")
+            return
+        to_delete = [s for s in sessions if s['name'] == self.session_dropdown.value]
+        if not to_delete:
+            logger.warning(f"Session to delete '{self.session_dropdown.value}' not found.")
+            return
+
+        sid = to_delete[0]['session_id']
+        logger.info(f"Deleting session: {to_delete[0]['name']} with ID: {sid}")
+        # Every page viewing the session, this one included, moves to another one on its session_deleted event
+        session_registry.discard(sid)
+        session_registry.db.delete_session(sid)
+        self.populate_session_dropdown()
+
+    def leave_deleted_session(self):
+        """The current session was deleted (on this page or elsewhere): switch to another one."""
+        session_id = self.chat_manager.session_id
+        self.chat_manager.auto_chat.remove_listener(self.show_partial_message, self.on_turn_done)
+        get_event_bus().unsubscribe(session_id, self.on_session_event)
+        session_registry.release(session_id)
+        self.chat_manager = None
+        self.open_initial_session()
+
+    def load_session(self, session_id: str):
+        logger.debug(f"Loading session with ID: {session_id}")
+        previous = self.chat_manager
+        self.chat_manager = session_registry.acquire(session_id)
+        self.chat_manager.auto_chat.add_listener(self.show_partial_message, self.on_turn_done)
+        get_event_bus().subscribe(session_id, self.on_session_event)
+        if previous is not None:
+            previous.auto_chat.remove_listener(self.show_partial_message, self.on_turn_done)
+            get_event_bus().unsubscribe(previous.session_id, self.on_session_event)
+            # Work still running for the previous session is cancelled once no client views it
+            session_registry.release(previous.session_id)
+
+        if self.chat_manager.current_setting:
+            setting = next((s for s in ALL_SETTINGS if s['name'] == self.chat_manager.current_setting), None)
+            self.settings_dropdown.value = self.chat_manager.current_setting
+            self.settings_dropdown.update()
+            if setting:
+                self.setting_description_label.text = setting['description']
+                self.setting_description_label.update()
+        else:
+            logger.error("No setting found for the session.")
+
+        self.you_name_input.value = self.chat_manager.you_name
+        self.auto_switch.value = self.chat_manager.automatic_running
+        self.next_button.enabled = not self.chat_manager.automatic_running
+        self.next_button.update()
+
+        self.refresh_added_characters()
+        self.show_chat_display()
+        self.show_character_details.refresh()
+        self.update_next_speaker_label()
+        self.populate_session_dropdown()
+        self.display_current_location()
+        logger.info(f"Session loaded: {session_id}")
+
+    def open_initial_session(self):
+        sessions = session_registry.list_sessions()
+        if not sessions:
+            logger.info("No existing sessions found. Creating default session.")
+            self.create_new_session()
         else:
-            logger.error("No setting found to fall back to.")
+            first_session = sessions[0]
+            logger.info(f"Loading existing session: {first_session['name']} with ID: {first_session['session_id']}")
+            self.load_session(first_session['session_id'])
+
+    def close(self):
+        """
+        The client disconnected: release its session. If the same client reconnects,
+        reopen() acquires the session again.
+        """
+        if self.chat_manager is not None:
+            self.disconnected_session_id = self.chat_manager.session_id
+            self.chat_manager.auto_chat.remove_listener(self.show_partial_message, self.on_turn_done)
+            get_event_bus().unsubscribe(self.chat_manager.session_id, self.on_session_event)
+            session_registry.release(self.chat_manager.session_id)
+            self.chat_manager = None
+
+    def reopen(self):
+        """The client (re)connected: acquire the session released by close(), if any."""
+        session_id, self.disconnected_session_id = self.disconnected_session_id, None
+        if self.chat_manager is not None or session_id is None:
+            return
+        logger.info(f"Client reconnected; reopening session {session_id}.")
+        with self.client:
+            if any(s['session_id'] == session_id for s in session_registry.list_sessions()):
+                self.load_session(session_id)
+            else:
+                # Deleted by another client meanwhile
+                self.open_initial_session()
 
-    session_chars = chat_manager.db.get_session_characters(session_id)
-    for c_name in session_chars:
-        if c_name in ALL_CHARACTERS:
-            chat_manager.add_character(c_name, ALL_CHARACTERS[c_name])
+    async def select_setting(self, event):
+        chosen_name = event.value
+        if self.chat_manager is None or chosen_name == self.chat_manager.current_setting:
+            return
+        logger.info(f"Setting selected: {chosen_name}")
+        setting = next((s for s in ALL_SETTINGS if s['name'] == chosen_name), None)
+        if setting:
+            try:
+                self.chat_manager.set_current_setting(
+                    setting['name'],
+                    setting['description'],
+                    setting['start_location']
+                )
+                self.settings_dropdown.value = setting['name']
+                self.settings_dropdown.update()
+                self.setting_description_label.text = setting['description']
+                self.setting_description_label.update()
+            except Exception as pe:
+                logger.error(f"Error while setting current setting: {pe}")
+                self.notify(str(pe), 'error')
         else:
-            logger.warning(f"Character '{c_name}' found in DB but not in ALL_CHARACTERS.")
-
-    refresh_added_characters()
-    show_chat_display.refresh()
-    show_character_details.refresh()
-    update_next_speaker_label()
-    populate_session_dropdown()
-    display_current_location()
-    logger.info(f"Session loaded: {session_id}")
-
-async def select_setting(event):
-    chosen_name = event.value
-    logger.info(f"Setting selected: {chosen_name}")
-    setting = next((s for s in ALL_SETTINGS if s['name'] == chosen_name), None)
-    if setting:
-        try:
-            chat_manager.set_current_setting(
-                setting['name'],
-                setting['description'],
-                setting['start_location']
-            )
-            settings_dropdown.value = setting['name']
-            settings_dropdown.update()
-            setting_description_label.text = setting['description']
-            setting_description_label.update()
-            display_current_location()
-            show_character_details.refresh()
-        except Exception as pe:
-            logger.error(f"Error while setting current setting: {pe}")
-            await notification_queue.put((str(pe), 'error'))
-    else:
-        logger.warning(f"Selected setting '{chosen_name}' not found.")
-
-async def toggle_automatic_chat(e):
-    state = "enabled" if e.value else "disabled"
-    logger.info(f"Automatic chat toggled {state}.")
-    if e.value:
-        if not chat_manager.get_character_names():
-            logger.warning("No characters added. Cannot start automatic chat.")
-            await notification_queue.put(("No characters added. Cannot start automatic chat.", 'warning'))
-            e.value = False
+            logger.warning(f"Selected setting '{chosen_name}' not found.")
+
+    async def toggle_automatic_chat(self, e):
+        if self.chat_manager is None or e.value == self.chat_manager.automatic_running:
+            # Switch synced to the state of a newly loaded session
             return
-        chat_manager.start_automatic_chat()
-        if auto_timer:
-            auto_timer.active = True
+        state = "enabled" if e.value else "disabled"
+        logger.info(f"Automatic chat toggled {state}.")
+        if e.value:
+            if not self.chat_manager.get_character_names():
+                logger.warning("No characters added. Cannot start automatic chat.")
+                self.notify("No characters added. Cannot start automatic chat.", 'warning')
+                e.value = False
+                return
+            self.chat_manager.start_automatic_chat()
             logger.info("Automatic chat started.")
-    else:
-        chat_manager.stop_automatic_chat()
-        if auto_timer:
-            auto_timer.active = False
+        else:
+            self.chat_manager.stop_automatic_chat()
             logger.info("Automatic chat stopped.")
-    next_button.enabled = not chat_manager.automatic_running
-    next_button.update()
-
-def set_you_name(_=None):
-    name = you_name_input.value.strip()
-    if name:
-        logger.info(f"Setting user name to: {name}")
-        chat_manager.set_you_name(name)
-        show_chat_display.refresh()
-    else:
-        logger.warning("Attempted to set empty user name.")
-
-@ui.refreshable
-def show_chat_display():
-    logger.debug("Refreshing chat display.")
-    chat_display.clear()
-    msgs = chat_manager.db.get_messages(chat_manager.session_id)
-    with chat_display:
-        for entry in msgs:
-            name = entry["sender"]
-            message = entry["message"]
-            timestamp = entry["created_at"]
-            dt = datetime.fromisoformat(timestamp)
-            human_timestamp = dt.strftime('%Y-%m-%d %H:%M:%S')
-            formatted_message = f"**{name}** [{human_timestamp}]:\n\n{message}"
-            ui.markdown(formatted_message)
-    logger.debug("Chat display refreshed.")
-
-@ui.refreshable
-def display_current_location():
-    if chat_manager.current_location:
-        current_location_label.text = f"Current Location: {chat_manager.current_location}"
-    else:
-        current_location_label.text = "Current Location: Not set."
-    current_location_label.update()
-
-async def automatic_conversation():
-    if chat_manager.automatic_running:
-        logger.debug("Automatic conversation active. Generating next message.")
-        next_char = chat_manager.next_speaker()
-        if next_char:
-            # Generate next character message, which also triggers plan updates
-            await chat_manager.generate_character_message(next_char)
-            chat_manager.advance_turn()
-            update_next_speaker_label()
-            show_character_details.refresh()
-            # ADD this line so new messages appear:
-            show_chat_display.refresh()
-
-async def next_character_response():
-    if chat_manager.automatic_running:
-        logger.debug("Automatic conversation is running. Manual next response ignored.")
-        return
-    next_char = chat_manager.next_speaker()
-    if next_char:
-        logger.info(f"Generating response for character: {next_char}")
+        self.next_button.enabled = not self.chat_manager.automatic_running
+        self.next_button.update()
+
+    def stop_generation(self):
+        """
+        Stop automatic chat and cancel the turn that is being generated. Its requests
+        are closed right away, so Ollama stops generating and nothing is stored.
+        """
+        logger.info("Stop requested.")
+        if self.chat_manager is None:
+            return
+        self.chat_manager.stop_automatic_chat()
+        self.auto_switch.value = False
+        self.next_button.enabled = True
+        self.next_button.update()
+        self.chat_view.clear_partial()
+
+    def update_llm_status(self):
+        """Show the model load state from the warm-up manager, hidden while all models are loaded."""
+        if self.llm_status_label is None:
+            return
+        text = model_warmup.status_text() if model_warmup is not None else ""
+        self.llm_status_label.text = text
+        self.llm_status_label.visible = bool(text)
+
+    def set_you_name(self, _=None):
+        name = self.you_name_input.value.strip()
+        if self.chat_manager is None:
+            return
+        if name:
+            logger.info(f"Setting user name to: {name}")
+            self.chat_manager.set_you_name(name)
+        else:
+            logger.warning("Attempted to set empty user name.")
+
+    def show_partial_message(self, character_name: str, text: str):
+        """
+        Show the action/dialogue of the message that is still being generated.
+        Replaced by the stored message when it is added.
+        """
+        if self.chat_view is None:
+            return
+        self.chat_view.show_partial(f"**{character_name}** [typing...]:\n\n{text}")
+
+    def show_chat_display(self):
+        """Show the newest messages of the session; older ones are loaded while scrolling up."""
+        if self.chat_manager is None:
+            self.chat_view.clear()
+            return
+        self.chat_view.load(self.chat_manager.db, self.chat_manager.session_id)
+
+    def display_current_location(self, location: Optional[str] = None):
+        if self.chat_manager is None:
+            return
+        if location is None:
+            location = self.chat_manager.current_location
+        if location:
+            self.current_location_label.text = f"Current Location: {location}"
+        else:
+            self.current_location_label.text = "Current Location: Not set."
+        self.current_location_label.update()
+
+    def on_turn_done(self, speaker: Optional[str]):
+        """
+        Called (for every client viewing the session) after a turn, automatic or manual.
+        `speaker` is None if the turn was cancelled or produced nothing.
+        """
+        if self.chat_manager is None:
+            return
+        if speaker is None:
+            # Nothing was stored; drop what was shown of the message
+            self.chat_view.clear_partial()
+        self.update_next_speaker_label()
+
+    def on_session_event(self, event: SessionEvent):
+        """
+        Listener of the current session's events. They can be published from worker threads,
+        so they are applied on the event loop.
+        """
+        if threading.get_ident() == self.loop_thread:
+            self.apply_session_event(event)
+        else:
+            self.loop.call_soon_threadsafe(self.apply_session_event, event)
+
+    def apply_session_event(self, event: SessionEvent):
+        """Apply a change of the current session (published by its ChatManager) to this page."""
+        if self.chat_manager is None or event.session_id != self.chat_manager.session_id:
+            return
+        with self.client:
+            self.apply_session_change(event.type, event.data)
+
+    def apply_session_change(self, event_type: str, data: Dict):
+        if event_type == MESSAGE_ADDED:
+            self.chat_view.append(data)
+        elif event_type == LOCATION_CHANGED:
+            if data['character'] is None:
+                self.display_current_location(data['location'])
+            else:
+                self.update_character_card(data['character'], location=data['location'])
+        elif event_type == APPEARANCE_CHANGED:
+            self.update_character_card(data['character'], appearance=data['appearance'])
+        elif event_type == PLAN_CHANGED:
+            self.update_character_card(data['character'], plan=data)
+        elif event_type in (CHARACTER_ADDED, CHARACTER_REMOVED):
+            self.refresh_added_characters()
+            self.show_character_details.refresh()
+            self.update_next_speaker_label()
+        elif event_type == SESSION_DELETED:
+            self.leave_deleted_session()
+
+    async def next_character_response(self):
+        chat_manager = self.chat_manager
+        if chat_manager is None:
+            return
+        if chat_manager.automatic_running:
+            logger.debug("Automatic conversation is running. Manual next response ignored.")
+            return
+        if chat_manager.turn_in_progress:
+            self.notify("A message is already being generated.", 'info')
+            return
+        logger.info(f"Generating response for character: {chat_manager.next_speaker()}")
         # Generate next character message, which also triggers plan updates
-        await chat_manager.generate_character_message(next_char)
-        chat_manager.advance_turn()
-        update_next_speaker_label()
-        show_character_details.refresh()
-        # ADD this line so new messages appear:
-        show_chat_display.refresh()
-
-async def send_user_message():
-    message = user_input.value.strip()
-    if not message:
-        logger.warning("Attempted to send empty user message. Not allowed.")
-        return
-
-    logger.info(f"User sent message: {message}")
-    await chat_manager.add_message(
-        chat_manager.you_name,
-        message,
-        visible=True,
-        message_type="user"
-    )
-    show_chat_display.refresh()
-    show_character_details.refresh()
-    user_input.value = ''
-    user_input.update()
-
-    if not chat_manager.automatic_running:
-        update_next_speaker_label()
-
-async def add_character_from_dropdown(event):
-    if not event.value:
-        return
-    char_name = event.value
-    logger.info(f"Adding character from dropdown: {char_name}")
-    char = ALL_CHARACTERS.get(char_name, None)
-    if char:
-        if char_name not in chat_manager.get_character_names():
-            chat_manager.add_character(char_name, char)
-            chat_manager.db.add_character_to_session(chat_manager.session_id, char_name)
-            refresh_added_characters()
-            logger.info(f"Character '{char_name}' added to chat.")
-            show_chat_display.refresh()
-            show_character_details.refresh()
+        speaker = await chat_manager.generate_next_turn(
+            on_partial=chat_manager.auto_chat.broadcast_partial, wait=False
+        )
+        chat_manager.auto_chat.broadcast_turn_done(speaker)
+
+    async def send_user_message(self):
+        message = self.user_input.value.strip()
+        if self.chat_manager is None:
+            return
+        if not message:
+            logger.warning("Attempted to send empty user message. Not allowed.")
+            return
+
+        logger.info(f"User sent message: {message}")
+        chat_manager = self.chat_manager
+        await chat_manager.add_message(
+            chat_manager.you_name,
+            message,
+            visible=True,
+            message_type="user"
+        )
+        self.user_input.value = ''
+        self.user_input.update()
+
+        if not chat_manager.automatic_running:
+            self.update_next_speaker_label()
+
+    async def add_character_from_dropdown(self, event):
+        if not event.value or self.chat_manager is None:
+            return
+        char_name = event.value
+        logger.info(f"Adding character from dropdown: {char_name}")
+        char = ALL_CHARACTERS.get(char_name, None)
+        if char:
+            if char_name not in self.chat_manager.get_character_names():
+                # Every page viewing the session (this one included) refreshes on the character_added event
+                self.chat_manager.add_character(char_name, char)
+                logger.info(f"Character '{char_name}' added to chat.")
+            else:
+                logger.warning(f"Character '{char_name}' is already added.")
         else:
-            logger.warning(f"Character '{char_name}' is already added.")
-    else:
-        logger.error(f"Character '{char_name}' not found in ALL_CHARACTERS.")
-
-    update_next_speaker_label()
-    character_dropdown.value = None
-    character_dropdown.update()
-
-async def remove_character_async(name: str):
-    logger.info(f"Removing character: {name}")
-    chat_manager.remove_character(name)
-    chat_manager.db.remove_character_from_session(chat_manager.session_id, name)
-    refresh_added_characters()
-    show_chat_display.refresh()
-    show_character_details.refresh()
-    update_next_speaker_label()
+            logger.error(f"Character '{char_name}' not found in ALL_CHARACTERS.")
+
+        self.character_dropdown.value = None
+        self.character_dropdown.update()
+
+    async def remove_character_async(self, name: str):
+        logger.info(f"Removing character: {name}")
+        if self.chat_manager is None:
+            return
+        # Pages viewing the session refresh on the character_removed event
+        self.chat_manager.remove_character(name)
+
+    def build(self):
+        logger.debug("Setting up main UI page.")
+        self.client = ui.context.client
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+
+        with ui.grid(columns=2).style('grid-template-columns: 1fr 2fr; height: 100vh;'):
+            with ui.card().style('height: 100vh; overflow-y: auto;'):
+                ui.label('Multipersona Chat Application').classes('text-2xl font-bold mb-4')
+
+                with ui.row().classes('w-full items-center mb-4'):
+                    ui.label("Session:").classes('w-1/4')
+                    self.session_dropdown = ui.select(
+                        options=[s['name'] for s in session_registry.db.get_all_sessions()],
+                        label="Choose a session",
+                    ).classes('flex-grow')
+                    ui.button("New Session", on_click=self.create_new_session).classes('ml-2')
+                    ui.button("Delete Session", on_click=self.delete_session).classes('ml-2 bg-red-500 text-white')
+
+                with ui.row().classes('w-full items-center mb-4'):
+                    ui.label("Your name:").classes('w-1/4')
+                    self.you_name_input = ui.input(value="You").classes('flex-grow')
+                    ui.button("Set", on_click=self.set_you_name).classes('ml-2')
+
+                with ui.row().classes('w-full items-center mb-4'):
+                    ui.label("Select Setting:").classes('w-1/4')
+                    self.settings_dropdown = ui.select(
+                        options=[s['name'] for s in ALL_SETTINGS],
+                        on_change=self.select_setting,
+                        label="Choose a setting"
+                    ).classes('flex-grow')
+
+                with ui.row().classes('w-full items-center mb-2'):
+                    ui.label("Setting Description:").classes('w-1/4')
+                    self.setting_description_label = ui.label("(Not set)").classes('flex-grow text-gray-700')
 
+                with ui.row().classes('w-full items-center mb-2'):
+                    ui.label("Session-Level Location:").classes('w-1/4')
+                    self.current_location_label = ui.label("Not set.").classes('flex-grow text-gray-700')
+
+                self.character_details_display = ui.column().classes('mb-4')
+                self.show_character_details()
+
+                with ui.row().classes('w-full items-center mb-4'):
+                    ui.label("Select Character:").classes('w-1/4')
+                    self.character_dropdown = ui.select(
+                        options=list(ALL_CHARACTERS.keys()),
+                        on_change=lambda e: asyncio.create_task(self.add_character_from_dropdown(e)),
+                        label="Choose a character"
+                    ).classes('flex-grow')
+
+                with ui.column().classes('w-full mb-4'):
+                    ui.label("Added Characters:").classes('font-semibold mb-2')
+                    self.added_characters_container = ui.row().classes('flex-wrap gap-2')
+
+                with ui.row().classes('w-full items-center mb-4'):
+                    self.auto_switch = ui.switch(
+                        'Automatic Chat', value=False, on_change=self.toggle_automatic_chat
+                    ).classes('mr-2')
+                    ui.button("Stop", on_click=self.stop_generation).classes('ml-auto')
+
+                self.next_speaker_label = ui.label("Next speaker:").classes('text-sm text-gray-700')
+
+                self.next_button = ui.button("Next", on_click=lambda: asyncio.create_task(self.next_character_response()))
+                self.next_button.props('outline')
+
+                self.llm_status_label = ui.label("").classes('text-orange-600')
+                self.llm_status_label.visible = False
+
+            with ui.card().style('height: 100vh; display: flex; flex-direction: column;'):
+                self.chat_view = ChatHistoryView(**chat_view_settings).build()
+
+                with ui.row().classes('w-full items-center p-4').style('flex-shrink: 0;'):
+                    self.user_input = ui.input(placeholder='Enter your message...').classes('flex-grow')
+                    ui.button('Send', on_click=lambda: asyncio.create_task(self.send_user_message())).classes('ml-2')
+
+        self.session_dropdown.on('change', self.on_session_select)
+
+        logger.debug("Main UI page setup complete.")
+
+        ui.timer(2.0, self.update_llm_status, active=True)
+
+
+@ui.page('/')
 def main_page():
-    global user_input, you_name_input, character_dropdown, added_characters_container
-    global next_speaker_label, next_button, settings_dropdown, setting_description_label
-    global session_dropdown, chat_display
-    global current_location_label, llm_status_label
-    global ALL_CHARACTERS, ALL_SETTINGS, character_details_display
+    page = ChatPage()
+    page.build()
+    page.open_initial_session()
+    ui.context.client.on_disconnect(page.close)
+    ui.context.client.on_connect(page.reopen)
 
-    logger.debug("Setting up main UI page.")
-    ALL_CHARACTERS = get_available_characters("src/multipersona_chat_app/characters")
-    ALL_SETTINGS = load_settings()
 
-    with ui.grid(columns=2).style('grid-template-columns: 1fr 2fr; height: 100vh;'):
-        with ui.card().style('height: 100vh; overflow-y: auto;'):
-            ui.label('Multipersona Chat Application').classes('text-2xl font-bold mb-4')
-
-            with ui.row().classes('w-full items-center mb-4'):
-                ui.label("Session:").classes('w-1/4')
-                session_dropdown = ui.select(
-                    options=[s['name'] for s in chat_manager.db.get_all_sessions()],
-                    label="Choose a session",
-                ).classes('flex-grow')
-                ui.button("New Session", on_click=create_new_session).classes('ml-2')
-                ui.button("Delete Session", on_click=delete_session).classes('ml-2 bg-red-500 text-white')
-
-            with ui.row().classes('w-full items-center mb-4'):
-                ui.label("Your name:").classes('w-1/4')
-                you_name_input = ui.input(value=chat_manager.you_name).classes('flex-grow')
-                ui.button("Set", on_click=set_you_name).classes('ml-2')
-
-            with ui.row().classes('w-full items-center mb-4'):
-                ui.label("Select Setting:").classes('w-1/4')
-                settings_dropdown = ui.select(
-                    options=[s['name'] for s in ALL_SETTINGS],
-                    on_change=select_setting,
-                    label="Choose a setting"
-                ).classes('flex-grow')
-
-            with ui.row().classes('w-full items-center mb-2'):
-                ui.label("Setting Description:").classes('w-1/4')
-                setting_description_label = ui.label("(Not set)").classes('flex-grow text-gray-700')
-
-            with ui.row().classes('w-full items-center mb-2'):
-                ui.label("Session-Level Location:").classes('w-1/4')
-                current_location_label = ui.label(
-                    chat_manager.current_location if chat_manager.current_location else "Not set."
-                ).classes('flex-grow text-gray-700')
-
-            character_details_display = ui.column().classes('mb-4')
-            show_character_details()
-
-            with ui.row().classes('w-full items-center mb-4'):
-                ui.label("Select Character:").classes('w-1/4')
-                character_dropdown = ui.select(
-                    options=list(ALL_CHARACTERS.keys()),
-                    on_change=lambda e: asyncio.create_task(add_character_from_dropdown(e)),
-                    label="Choose a character"
-                ).classes('flex-grow')
-
-            with ui.column().classes('w-full mb-4'):
-                ui.label("Added Characters:").classes('font-semibold mb-2')
-                global added_characters_container
-                added_characters_container = ui.row().classes('flex-wrap gap-2')
-                refresh_added_characters()
-
-            with ui.row().classes('w-full items-center mb-4'):
-                auto_switch = ui.switch('Automatic Chat', value=False, on_change=toggle_automatic_chat).classes('mr-2')
-                ui.button("Stop", on_click=lambda: chat_manager.stop_automatic_chat()).classes('ml-auto')
-
-            global next_speaker_label
-            next_speaker_label = ui.label("Next speaker:").classes('text-sm text-gray-700')
-            update_next_speaker_label()
-
-            global next_button
-            next_button = ui.button("Next", on_click=lambda: asyncio.create_task(next_character_response()))
-            next_button.props('outline')
-            next_button.enabled = not chat_manager.automatic_running
-            next_button.update()
-
-            global llm_status_label
-            llm_status_label = ui.label("").classes('text-orange-600')
-            llm_status_label.visible = False
-
-        with ui.card().style('height: 100vh; display: flex; flex-direction: column;'):
-            global chat_display
-            chat_display = ui.column().style('flex-grow: 1; overflow-y: auto;')
-            show_chat_display()
-
-            with ui.row().classes('w-full items-center p-4').style('flex-shrink: 0;'):
-                global user_input
-                user_input = ui.input(placeholder='Enter your message...').classes('flex-grow')
-                ui.button('Send', on_click=lambda: asyncio.create_task(send_user_message())).classes('ml-2')
-                
-    session_dropdown.on('change', on_session_select)
-    session_dropdown.value = chat_manager.get_session_name()
-    session_dropdown.update()
-
-    logger.debug("Main UI page setup complete.")
-
-    global auto_timer
-    auto_timer = ui.timer(interval=2.0, callback=lambda: asyncio.create_task(automatic_conversation()), active=False)
-    logger.info("UI timer for automatic conversation set up.")
-
-    ui.timer(1.0, consume_notifications, active=True)
+def start_background_tasks():
+    asyncio.create_task(session_registry.run_eviction_loop())
+
 
 def start_ui():
+    global ALL_CHARACTERS, ALL_SETTINGS, session_registry, model_warmup, chat_view_settings
     logger.info("Starting UI initialization.")
-    default_session = str(uuid.uuid4())
-    settings = load_settings()
-    init_chat_manager(default_session, settings)
-
-    main_page()
-
-    sessions = chat_manager.db.get_all_sessions()
-    if not sessions:
-        logger.info("No existing sessions found. Creating default session.")
-        chat_manager.db.create_session(default_session, f"Session {default_session}")
-        if ALL_SETTINGS:
-            default_setting = ALL_SETTINGS[0]
-            chat_manager.set_current_setting(
-                default_setting['name'],
-                default_setting['description'],
-                default_setting['start_location']
-            )
-            settings_dropdown.value = default_setting['name']
-            settings_dropdown.update()
-        else:
-            logger.error("No settings found. Cannot set a default setting.")
-        load_session(default_session)
-    else:
-        first_session = sessions[0]
-        logger.info(f"Loading existing session: {first_session['name']} with ID: {first_session['session_id']}")
-        load_session(first_session['session_id'])
-
-    global auto_timer
-    auto_timer = ui.timer(interval=2.0, callback=lambda: asyncio.create_task(automatic_conversation()), active=False)
-    logger.info("UI timer for automatic conversation set up.")
-
-    ui.timer(1.0, consume_notifications, active=True)
+    # Load the models in the background while the UI comes up
+    model_warmup = start_model_warmup()
+
+    ALL_CHARACTERS = get_available_characters("src/multipersona_chat_app/characters")
+    ALL_SETTINGS = load_settings()
+    session_registry = create_session_registry(ALL_SETTINGS, ALL_CHARACTERS)
+    config = ChatManager.load_config(CHAT_MANAGER_CONFIG_PATH)
+    chat_view_settings = {
+        'page_size': config.get('chat_view_page_size', 50),
+        'max_mounted': config.get('chat_view_max_mounted', 200),
+    }
+    configure_tracing(
+        enabled=config.get('tracing_enabled', True),
+        max_traces=config.get('tracing_max_traces', 50)
+    )
+    setup_metrics(session_registry)
+    # REST and WebSocket API at /api, sharing the sessions of the pages
+    setup_api(session_registry, ALL_CHARACTERS)
+    app.include_router(api_router)
+    app.on_startup(start_background_tasks)
 
     ui.run(reload=False)
     logger.info("UI is running.")
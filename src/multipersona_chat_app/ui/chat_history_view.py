@@ -0,0 +1,222 @@
+"""
+Windowed view of the messages of a session.
+
+Only a window of the conversation is kept in the page:
+- opening a session loads the newest `page_size` messages (keyset pagination,
+  DBManager.get_messages_page),
+- scrolling to the top loads the page before the oldest shown message, scrolling
+  back to the bottom loads the pages after the newest one,
+- at most `max_mounted` messages stay mounted; messages at the far end of the
+  window are removed again.
+
+The HTML of a stored message never changes, so it is rendered from Markdown once
+and cached by message id for all clients.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import markdown2
+from nicegui import ui
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTRAS = ['fenced-code-blocks', 'tables']
+
+# Scroll distance (in pixels) from the top or bottom at which the next page is loaded
+LOAD_THRESHOLD = 40
+
+
+def format_message(entry: Dict) -> str:
+    dt = datetime.fromisoformat(entry["created_at"])
+    human_timestamp = dt.strftime('%Y-%m-%d %H:%M:%S')
+    return f"**{entry['sender']}** [{human_timestamp}]:\n\n{entry['message']}"
+
+
+def render_markdown(content: str) -> str:
+    return markdown2.markdown(content, extras=MARKDOWN_EXTRAS)
+
+
+class RenderedMessageCache:
+    """LRU cache of the rendered HTML of stored messages, by message id."""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._html: "OrderedDict[int, str]" = OrderedDict()
+
+    def get(self, entry: Dict) -> str:
+        message_id = entry['id']
+        with self._lock:
+            html = self._html.get(message_id)
+            if html is not None:
+                self._html.move_to_end(message_id)
+                return html
+        html = render_markdown(format_message(entry))
+        with self._lock:
+            self._html[message_id] = html
+            while len(self._html) > self.max_entries:
+                self._html.popitem(last=False)
+        return html
+
+
+rendered_messages = RenderedMessageCache()
+
+
+class ChatHistoryView:
+    def __init__(self, page_size: int = 50, max_mounted: int = 200):
+        self.page_size = max(1, page_size)
+        self.max_mounted = max(self.page_size, max_mounted)
+
+        self.db = None
+        self.session_id: Optional[str] = None
+
+        self.scroll_area = None
+        self.older_label = None
+        self.messages_column = None
+        self.streaming_message = None
+
+        # (message id, element) of the mounted messages, oldest first
+        self.mounted: List[Tuple[int, ui.html]] = []
+        self.has_older = False
+        self.has_newer = False
+        self.at_bottom = True
+        self.loading = False
+
+    def build(self):
+        self.scroll_area = ui.scroll_area(on_scroll=self.on_scroll).classes('w-full').style('flex-grow: 1; min-height: 0;')
+        with self.scroll_area:
+            self.older_label = ui.label("Loading older messages...").classes('text-sm text-gray-500')
+            self.older_label.visible = False
+            self.messages_column = ui.column().classes('w-full')
+        return self
+
+    #
+    # Mounting
+    #
+    def _mount(self, entry: Dict, index: Optional[int] = None) -> ui.html:
+        with self.messages_column:
+            element = ui.html(rendered_messages.get(entry)).classes('nicegui-markdown')
+        if index is not None:
+            element.move(target_index=index)
+        return element
+
+    def _unmount_oldest(self, count: int):
+        for _, element in self.mounted[:count]:
+            element.delete()
+        del self.mounted[:count]
+        if count > 0:
+            self.has_older = True
+
+    def _unmount_newest(self, count: int):
+        if count <= 0:
+            return
+        for _, element in self.mounted[-count:]:
+            element.delete()
+        del self.mounted[-count:]
+        self.has_newer = True
+
+    def load(self, db, session_id: str):
+        """Show the newest page of a session."""
+        self.db = db
+        self.session_id = session_id
+        self.messages_column.clear()
+        self.mounted = []
+        self.streaming_message = None
+        self.has_newer = False
+        self.at_bottom = True
+
+        page = db.get_messages_page(session_id, limit=self.page_size)
+        for entry in page:
+            self.mounted.append((entry['id'], self._mount(entry)))
+        self.has_older = len(page) == self.page_size
+        self.scroll_to_bottom()
+        logger.debug(f"Chat view loaded {len(page)} messages of session '{session_id}'.")
+
+    def clear(self):
+        self.session_id = None
+        self.messages_column.clear()
+        self.mounted = []
+        self.streaming_message = None
+        self.has_older = self.has_newer = False
+
+    def append(self, entry: Dict):
+        """Add a newly stored message, in place of the partial message being shown."""
+        self.clear_partial()
+        if self.has_newer:
+            # The user is looking at older messages; the new one is loaded when they scroll down
+            return
+        self.mounted.append((entry['id'], self._mount(entry)))
+        self._unmount_oldest(len(self.mounted) - self.max_mounted)
+        if self.at_bottom:
+            self.scroll_to_bottom()
+
+    def scroll_to_bottom(self):
+        self.scroll_area.scroll_to(percent=1.0)
+
+    #
+    # Partial message
+    #
+    def show_partial(self, content: str):
+        if self.has_newer:
+            return
+        if self.streaming_message is None:
+            with self.messages_column:
+                self.streaming_message = ui.markdown(extras=MARKDOWN_EXTRAS)
+        self.streaming_message.content = content
+        if self.at_bottom:
+            self.scroll_to_bottom()
+
+    def clear_partial(self):
+        if self.streaming_message is not None:
+            self.streaming_message.delete()
+            self.streaming_message = None
+
+    #
+    # Paging
+    #
+    def on_scroll(self, e):
+        self.at_bottom = e.vertical_size - e.vertical_container_size - e.vertical_position <= LOAD_THRESHOLD
+        if self.loading or self.session_id is None:
+            return
+        if e.vertical_position <= LOAD_THRESHOLD and self.has_older:
+            self.load_older()
+        elif self.at_bottom and self.has_newer:
+            self.load_newer()
+
+    def load_older(self):
+        if not self.mounted:
+            return
+        self.loading = True
+        self.older_label.visible = True
+        try:
+            page = self.db.get_messages_page(self.session_id, before_id=self.mounted[0][0], limit=self.page_size)
+            self.has_older = len(page) == self.page_size
+            if not page:
+                return
+            # Move each message of the page in front of the ones already shown, keeping the page in order
+            new = [(entry['id'], self._mount(entry, index=i)) for i, entry in enumerate(page)]
+            self.mounted = new + self.mounted
+            if len(self.mounted) > self.max_mounted:
+                self.clear_partial()
+                self._unmount_newest(len(self.mounted) - self.max_mounted)
+            # Keep the message that was at the top in view
+            self.scroll_area.scroll_to(percent=len(page) / len(self.mounted))
+        finally:
+            self.older_label.visible = False
+            self.loading = False
+
+    def load_newer(self):
+        if not self.mounted:
+            return
+        self.loading = True
+        try:
+            page = self.db.get_messages_page(self.session_id, after_id=self.mounted[-1][0], limit=self.page_size)
+            self.has_newer = len(page) == self.page_size
+            for entry in page:
+                self.mounted.append((entry['id'], self._mount(entry)))
+            self._unmount_oldest(len(self.mounted) - self.max_mounted)
+        finally:
+            self.loading = False
@@ -0,0 +1,44 @@
+"""
+Prometheus metrics of the app at /metrics (see telemetry/metrics.py).
+"""
+from fastapi.responses import PlainTextResponse
+from nicegui import app
+
+from chats.session_registry import SessionRegistry
+from llm.scheduler import get_scheduler, Priority
+from telemetry.metrics import get_metrics_registry, observe_span
+from telemetry.tracing import get_tracer
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(get_metrics_registry().render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def setup_metrics(session_registry: SessionRegistry):
+    """Feed span durations into the metrics and register the gauges read from the live sessions."""
+    get_tracer().add_observer(observe_span)
+    registry = get_metrics_registry()
+
+    registry.gauge('sessions_live', "Sessions with a ChatManager in memory.", lambda: len(session_registry))
+    registry.gauge('sessions_viewed', "Sessions viewed by at least one client.", session_registry.viewed_count)
+    registry.gauge(
+        'auto_chat_loops_running', "Sessions whose automatic chat loop is running.",
+        lambda: sum(1 for m in session_registry.managers() if m.auto_chat.running)
+    )
+    registry.gauge(
+        'turns_pending', "Turns waiting for the turn lock of their session (auto-chat and manual).",
+        lambda: sum(m.pending_turns for m in session_registry.managers())
+    )
+    registry.gauge(
+        'summarization_backlog', "Characters whose history is waiting to be summarized.",
+        lambda: sum(m.summarization_backlog for m in session_registry.managers())
+    )
+    registry.gauge(
+        'llm_scheduler_queue_depth', "LLM requests waiting for a scheduler slot, by priority.",
+        lambda: {(p.name.lower(),): get_scheduler().queue_depth(p) for p in Priority},
+        ['priority']
+    )
+    registry.gauge('llm_scheduler_running', "LLM requests being sent.", lambda: get_scheduler().running_count)
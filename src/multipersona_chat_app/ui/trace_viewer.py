@@ -0,0 +1,133 @@
+"""
+Debug page showing the recorded traces (see telemetry/tracing.py) as per-turn waterfalls.
+
+/debug/traces             - pick a trace and see its spans as a waterfall
+/debug/traces.json        - all kept traces as Chrome trace-event JSON
+/debug/traces.json?trace_id=N - a single trace
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+from nicegui import ui, app
+
+from telemetry.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+SPAN_COLORS = {
+    'chat': '#2563eb',
+    'ollama': '#ea580c',
+    'db': '#16a34a',
+}
+DEFAULT_COLOR = '#6b7280'
+
+
+def trace_label(trace: Dict) -> str:
+    started = datetime.fromtimestamp(trace['wall_start']).strftime('%H:%M:%S')
+    character = trace['attributes'].get('character') or ''
+    state = f"{trace['duration_ms']:.0f} ms" if trace['finished'] else "running"
+    return f"#{trace['trace_id']} {started} {trace['name']} {character} ({state}, {trace['span_count']} spans)"
+
+
+def order_spans(spans: List[Dict]) -> List[Dict]:
+    """Spans in depth-first order (children after their parent, by start time), with a 'depth' key."""
+    children: Dict[Optional[int], List[Dict]] = {}
+    ids = {s['span_id'] for s in spans}
+    for s in spans:
+        # Spans whose parent was dropped or is still open are shown at the top level
+        parent = s['parent_id'] if s['parent_id'] in ids else None
+        children.setdefault(parent, []).append(s)
+
+    ordered = []
+    stack = [(s, 0) for s in reversed(children.get(None, []))]
+    while stack:
+        s, depth = stack.pop()
+        ordered.append({**s, 'depth': depth})
+        stack.extend((c, depth + 1) for c in reversed(children.get(s['span_id'], [])))
+    return ordered
+
+
+@app.get('/debug/traces.json')
+def traces_json(trace_id: Optional[int] = None):
+    trace_ids = [trace_id] if trace_id is not None else None
+    return JSONResponse(
+        get_tracer().to_chrome_trace(trace_ids),
+        headers={'Content-Disposition': 'attachment; filename="traces.json"'}
+    )
+
+
+@ui.page('/debug/traces')
+def trace_page():
+    tracer = get_tracer()
+    selected: Dict[str, Optional[int]] = {'trace_id': None}
+
+    ui.label("Traces").classes('text-2xl font-bold')
+    if not tracer.enabled:
+        ui.label("Tracing is disabled (tracing_enabled in chat_manager_config.yaml).").classes('text-orange-600')
+
+    with ui.row().classes('items-center w-full'):
+        trace_select = ui.select(options={}, label="Trace").classes('flex-grow')
+        ui.button("Refresh", on_click=lambda: refresh_list())
+        download = ui.link("Download (Chrome trace JSON)", '/debug/traces.json', new_tab=True)
+
+    waterfall = ui.column().classes('w-full gap-0')
+
+    def refresh_list():
+        traces = tracer.traces()
+        trace_select.options = {t['trace_id']: trace_label(t) for t in traces}
+        trace_select.update()
+        if traces and selected['trace_id'] not in trace_select.options:
+            trace_select.value = traces[0]['trace_id']
+        else:
+            show_trace(selected['trace_id'])
+
+    def show_trace(trace_id: Optional[int]):
+        selected['trace_id'] = trace_id
+        waterfall.clear()
+        trace = tracer.get_trace(trace_id) if trace_id is not None else None
+        if trace is None:
+            download.props('href=/debug/traces.json')
+            with waterfall:
+                ui.label("No trace recorded yet." if trace_id is None else "This trace is no longer kept.")
+            return
+        download.props(f'href=/debug/traces.json?trace_id={trace_id}')
+
+        spans = order_spans(trace['spans'])
+        if not spans:
+            with waterfall:
+                ui.label("The trace has no finished spans yet.")
+            return
+        start = min(s['start_ns'] for s in spans)
+        total_ms = max(max(s['start_ns'] / 1e6 - start / 1e6 + s['duration_ms'] for s in spans), 0.001)
+
+        with waterfall:
+            ui.label(
+                f"{trace['name']} - {trace['duration_ms']:.1f} ms, {len(spans)} spans"
+                + (f", {trace['dropped_spans']} dropped" if trace['dropped_spans'] else "")
+            ).classes('font-bold mt-2')
+            for s in spans:
+                offset = (s['start_ns'] - start) / 1e6
+                color = SPAN_COLORS.get(s['name'].split('.')[0], DEFAULT_COLOR)
+                if s['error']:
+                    color = '#dc2626'
+                details = ", ".join(f"{k}={v}" for k, v in s['attributes'].items() if v is not None)
+                if s['error']:
+                    details = f"{details}, error={s['error']}" if details else f"error={s['error']}"
+                with ui.row().classes('w-full items-center no-wrap gap-2 text-xs'):
+                    ui.label(s['name']).classes('font-mono truncate').style(
+                        f"width: 280px; flex-shrink: 0; padding-left: {s['depth'] * 12}px;"
+                    )
+                    with ui.element('div').classes('relative flex-grow').style('height: 14px;'):
+                        ui.element('div').classes('absolute rounded').style(
+                            f"left: {offset / total_ms * 100:.3f}%; "
+                            f"width: max({s['duration_ms'] / total_ms * 100:.3f}%, 1px); "
+                            f"height: 100%; background: {color};"
+                        ).tooltip(details or s['name'])
+                    ui.label(f"{s['duration_ms']:.1f} ms").classes('font-mono text-right').style(
+                        'width: 80px; flex-shrink: 0;'
+                    )
+
+    trace_select.on_value_change(lambda e: show_trace(e.value))
+    refresh_list()
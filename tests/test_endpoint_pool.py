@@ -0,0 +1,170 @@
+"""
+Tests of the endpoint pool (llm/endpoint_pool.py) against local fake Ollama servers.
+
+Run from the repository root:
+    python -m pytest tests/test_endpoint_pool.py   (or: python -m unittest tests.test_endpoint_pool)
+"""
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from benchmarks.fake_ollama import FakeOllamaServer, FakeOllamaSettings  # noqa: E402
+from llm.endpoint_pool import (  # noqa: E402
+    CLOSED, HALF_OPEN, OPEN, EndpointPool, embedding_endpoint_urls, endpoint_urls, get_endpoint_pool
+)
+from llm.ollama_client import OllamaClient  # noqa: E402
+from telemetry.metrics import LLM_CACHE_LOOKUPS  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def client_config(urls, cache_dir: str, **pool_settings) -> dict:
+    return {
+        'endpoints': urls,
+        'api_url': f"{urls[0]}/api/generate",
+        'model_name': "dolphin-mixtral:8x22b-v2.9-q3_K_S",
+        'embedding_model_name': "snowflake-arctic-embed2",
+        'max_retries': 3,
+        'timeout': 10,
+        'cache_file': os.path.join(cache_dir, "llm_cache"),
+        'endpoint_pool': {
+            'failure_threshold': 2,
+            'reset_timeout': 30,
+            'health_check_interval': 0,
+            'probe_timeout': 1,
+            'backoff_base': 0.01,
+            'backoff_max': 0.05,
+            **pool_settings,
+        },
+    }
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_circuit_opens_and_recovers_through_half_open(self):
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        pool = EndpointPool([url], failure_threshold=2, reset_timeout=0.3, health_check_interval=0, probe_timeout=1)
+        endpoint = pool.endpoints[0]
+
+        # Nothing listens on the port yet: probes fail until the breaker opens
+        self.assertFalse(pool.probe(endpoint))
+        self.assertEqual(endpoint.state, CLOSED)
+        self.assertFalse(pool.probe(endpoint))
+        self.assertEqual(endpoint.state, OPEN)
+        self.assertIsNone(pool.acquire())
+
+        server = FakeOllamaServer(FakeOllamaSettings(), port=port).start()
+        try:
+            time.sleep(0.35)
+            # After reset_timeout one trial request is let through, and only one
+            trial = pool.acquire()
+            self.assertIs(trial, endpoint)
+            self.assertEqual(endpoint.state, HALF_OPEN)
+            self.assertIsNone(pool.acquire())
+            pool.release(trial, success=True)
+            self.assertEqual(endpoint.state, CLOSED)
+            self.assertIs(pool.acquire(), endpoint)
+        finally:
+            server.stop()
+
+    def test_failed_trial_reopens_the_circuit(self):
+        pool = EndpointPool(["http://127.0.0.1:1"], failure_threshold=1, reset_timeout=0.05, health_check_interval=0)
+        endpoint = pool.endpoints[0]
+        pool.release(pool.acquire(), success=False)
+        self.assertEqual(endpoint.state, OPEN)
+        time.sleep(0.06)
+        trial = pool.acquire()
+        self.assertEqual(endpoint.state, HALF_OPEN)
+        pool.release(trial, success=False)
+        self.assertEqual(endpoint.state, OPEN)
+        self.assertIsNone(pool.acquire())
+
+
+class FailoverTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeOllamaServer(FakeOllamaSettings(time_to_first_token=0.0, tokens_per_second=0)).start()
+        self.dead_url = f"http://127.0.0.1:{free_port()}"
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_requests_fail_over_from_a_host_that_refuses_connections(self):
+        config = client_config([self.dead_url, self.server.base_url], self.cache_dir)
+        client = OllamaClient("", config=config)
+        pool = get_endpoint_pool(config)
+        # The dead host served both models before it went away, and wins every tie
+        dead = pool.endpoints[0]
+        dead.models = {config['model_name'], config['embedding_model_name']}
+        dead.models_known = True
+        with mock.patch('llm.endpoint_pool.random.random', return_value=0.0):
+            for i in range(6):
+                self.assertTrue(client.generate(f"Say something {i}", use_cache=False))
+                self.assertTrue(client.get_embedding(f"sentence {i}"))
+
+        stats = self.server.stats.snapshot()
+        self.assertEqual(stats['requests'].get('/api/generate'), 6)
+        self.assertEqual(stats['requests'].get('/api/embeddings'), 6)
+        # Connect errors failed over to the live host, and opened the dead host's breaker
+        self.assertEqual(dead.state, OPEN)
+        self.assertEqual(dead.consecutive_failures, config['endpoint_pool']['failure_threshold'])
+
+    def test_retries_back_off_between_attempts(self):
+        self.server.configure(error_rate=1.0, error_status=503)
+        config = client_config([self.server.base_url], self.cache_dir, failure_threshold=10, backoff_base=0.1, backoff_max=1)
+        client = OllamaClient("", config=config)
+        # Take the top of every jitter range, so the minimum total wait is known
+        with mock.patch('llm.endpoint_pool.random.uniform', side_effect=lambda low, high: high):
+            started = time.perf_counter()
+            self.assertIsNone(client.generate("Fails every time", use_cache=False))
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(self.server.stats.snapshot()['requests'].get('/api/generate'), 3)
+        # Retry 1 waits up to 0.1s, retry 2 up to 0.2s
+        self.assertGreaterEqual(elapsed, 0.3)
+
+    def test_only_calls_that_consult_the_cache_count_as_cache_lookups(self):
+        client = OllamaClient("", config=client_config([self.server.base_url], self.cache_dir))
+
+        def lookups():
+            values = LLM_CACHE_LOOKUPS.values()
+            return values.get(('hit',), 0), values.get(('miss',), 0)
+
+        before = lookups()
+        client.generate("Uncached", use_cache=False)
+        client.generate("Cached")
+        client.generate("Cached")
+        hits, misses = lookups()
+        self.assertEqual((hits - before[0], misses - before[1]), (1, 1))
+
+
+class BackoffTest(unittest.TestCase):
+    def test_backoff_is_exponential_with_full_jitter_and_capped(self):
+        pool = EndpointPool(["http://127.0.0.1:1"], backoff_base=0.5, backoff_max=4, health_check_interval=0)
+        for attempt, ceiling in [(1, 0.5), (2, 1.0), (3, 2.0), (4, 4.0), (8, 4.0)]:
+            delays = [pool.backoff_delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= d <= ceiling for d in delays))
+            self.assertGreater(max(delays), ceiling / 2)
+
+
+class EmbeddingHostsTest(unittest.TestCase):
+    def test_embeddings_use_their_own_host_only_when_configured(self):
+        shared = {'api_url': "http://a:11434/api/generate", 'api_url_embeddings': "http://a:11434/api/embeddings",
+                  'endpoints': ["http://a:11434", "http://b:11434"]}
+        self.assertEqual(embedding_endpoint_urls(shared), endpoint_urls(shared))
+        separate = {**shared, 'api_url_embeddings': "http://c:11434/api/embeddings"}
+        self.assertEqual(embedding_endpoint_urls(separate), ["http://c:11434"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests of the rule-based checks that run before LLM validation (chats/interaction_validator.py).
+
+Run from the repository root:
+    python -m pytest tests/test_interaction_validator.py   (or: python -m unittest tests.test_interaction_validator)
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from chats.interaction_validator import LocalInteractionValidator  # noqa: E402
+from models.interaction import AppearanceSegments, Interaction  # noqa: E402
+
+
+def make_interaction(**fields) -> Interaction:
+    values = {
+        'purpose': "", 'why_purpose': "", 'affect': "", 'why_affect': "",
+        'action': "Opens the door.", 'why_action': "", 'dialogue': "", 'why_dialogue': "",
+        'new_location': "", 'why_new_location': "",
+        'new_appearance': AppearanceSegments(), 'why_new_appearance': "",
+    }
+    values.update(fields)
+    return Interaction(**values)
+
+
+class LocalInteractionValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.validator = LocalInteractionValidator(max_action_length=40)
+
+    def test_a_clean_interaction_passes_unchanged(self):
+        interaction = make_interaction(dialogue="Hello.")
+        result = self.validator.validate("Ann", interaction)
+        self.assertTrue(result.passed)
+        self.assertEqual(result.fixes, [])
+        self.assertEqual(result.interaction, interaction)
+
+    def test_tags_markdown_and_a_leading_name_are_fixed(self):
+        interaction = make_interaction(
+            action="Ann: **Opens** the door. [Latest]",
+            dialogue="[latest] _Hello_ there."
+        )
+        result = self.validator.validate("Ann", interaction)
+        self.assertTrue(result.passed, result.issues)
+        self.assertEqual(result.interaction.action, "Opens the door.")
+        self.assertEqual(result.interaction.dialogue, "Hello there.")
+        self.assertEqual(len(result.fixes), 5, result.fixes)
+        # The input is left as it was
+        self.assertEqual(interaction.action, "Ann: **Opens** the door. [Latest]")
+
+    def test_the_name_inside_the_text_is_an_issue(self):
+        result = self.validator.validate("Ann", make_interaction(action="Waves as ann smiles."))
+        self.assertFalse(result.passed)
+        self.assertEqual(result.issues, ["The action mentions 'Ann' by name."])
+        self.assertTrue(self.validator.validate("Ann", make_interaction(action="Plans a trip to Annecy.")).passed)
+
+    def test_empty_required_fields_are_issues(self):
+        result = self.validator.validate("Ann", make_interaction(action="  "))
+        self.assertEqual(result.issues, ["Required field 'action' is empty."])
+        validator = LocalInteractionValidator(required_fields=["action", "dialogue"])
+        self.assertEqual(validator.validate("Ann", make_interaction()).issues, ["Required field 'dialogue' is empty."])
+
+    def test_long_text_is_cut_at_the_last_sentence_inside_the_limit(self):
+        action = "Opens the door. Looks around the room. Sits down slowly by the fire."
+        result = self.validator.validate("Ann", make_interaction(action=action))
+        self.assertTrue(result.passed)
+        self.assertEqual(result.interaction.action, "Opens the door. Looks around the room.")
+
+        result = self.validator.validate("Ann", make_interaction(action="x" * 50))
+        self.assertEqual(result.interaction.action, "x" * 40)
+
+    def test_unchanged_location_and_appearance_are_cleared(self):
+        current = AppearanceSegments(hair="Short and  RED", clothing="A coat")
+        interaction = make_interaction(
+            new_location="The  Tavern",
+            new_appearance=AppearanceSegments(hair="short and red", clothing="A scarf", accessories_and_held_items=" ")
+        )
+        result = self.validator.validate("Ann", interaction, current_location="the tavern", current_appearance=current)
+        self.assertTrue(result.passed)
+        self.assertEqual(result.interaction.new_location, "")
+        self.assertEqual(result.interaction.new_appearance.hair, "")
+        self.assertEqual(result.interaction.new_appearance.clothing, "A scarf")
+        self.assertEqual(result.interaction.new_appearance.accessories_and_held_items, "")
+
+        moved = self.validator.validate("Ann", make_interaction(new_location="The cellar"), current_location="The tavern")
+        self.assertEqual(moved.interaction.new_location, "The cellar")
+
+    def test_a_missing_appearance_is_added(self):
+        interaction = make_interaction().model_copy(update={'new_appearance': None})
+        result = self.validator.validate("Ann", interaction)
+        self.assertEqual(result.interaction.new_appearance, AppearanceSegments())
+        self.assertIn("Added missing new_appearance.", result.fixes)
+
+
+if __name__ == '__main__':
+    unittest.main()
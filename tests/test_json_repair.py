@@ -0,0 +1,108 @@
+"""
+Tests of the repair of truncated and malformed structured output (llm/json_repair.py).
+
+Run from the repository root:
+    python -m pytest tests/test_json_repair.py   (or: python -m unittest tests.test_json_repair)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from chats.chat_manager import CharacterPlan, ChatManager  # noqa: E402
+from db.db_manager import DBManager  # noqa: E402
+from llm.json_repair import IncrementalJSONRepairer, partial_fields, repair_structured_output  # noqa: E402
+from llm.ollama_client import OllamaClient  # noqa: E402
+from models.interaction import InteractionReasoningBatch  # noqa: E402
+from utils import load_settings  # noqa: E402
+
+
+class RejectEmptyRepairTest(unittest.TestCase):
+    def test_truncated_objects_without_a_value_are_rejected(self):
+        for text in ['{"go', '{"goal": 12', '{"goal": ', '{"goal"', '{', '{"steps": [']:
+            with self.subTest(text=text):
+                plan, repairs = repair_structured_output(text, CharacterPlan)
+                self.assertIsNone(plan)
+                self.assertTrue(any("No field of CharacterPlan" in r for r in repairs), repairs)
+
+    def test_empty_objects_are_rejected(self):
+        for text in ['{}', 'Sure! {} Done.', '{"goal": "", "steps": []}']:
+            with self.subTest(text=text):
+                self.assertIsNone(repair_structured_output(text, CharacterPlan)[0])
+        self.assertIsNone(repair_structured_output('{"reasoning": [', InteractionReasoningBatch)[0])
+        self.assertIsNone(repair_structured_output('{"reasoning": []}', InteractionReasoningBatch)[0])
+
+    def test_partially_filled_objects_are_repaired(self):
+        plan, _ = repair_structured_output('{"goal": "Find the key", "steps": ["Search the ha', CharacterPlan)
+        self.assertEqual(plan.goal, "Find the key")
+        self.assertEqual(plan.steps, ["Search the ha"])
+
+        plan, _ = repair_structured_output('{"goal": "Find the key", "steps": ["Search", 1', CharacterPlan)
+        self.assertEqual(plan.steps, ["Search"])
+
+        batch, _ = repair_structured_output(
+            '{"reasoning": [{"message_id": 3, "why_action": "Curious"}, {"message_id": 4, "why_act',
+            InteractionReasoningBatch
+        )
+        self.assertEqual([r.message_id for r in batch.reasoning], [3, 4])
+        self.assertEqual(batch.reasoning[0].why_action, "Curious")
+
+    def test_an_unusable_object_is_skipped_for_the_next_one(self):
+        plan, _ = repair_structured_output('Here is {not json} then {} and {"goal": "y"}', CharacterPlan)
+        self.assertEqual(plan.goal, "y")
+
+
+class IncrementalRepairTest(unittest.TestCase):
+    def test_feeding_in_chunks_matches_feeding_at_once(self):
+        text = 'Plan: {"goal": "Leave \\"now\\"", "steps": ["a", "b"]} trailing'
+        whole = IncrementalJSONRepairer()
+        whole.feed(text)
+        chunked = IncrementalJSONRepairer()
+        for i in range(0, len(text), 3):
+            chunked.feed(text[i:i + 3])
+        self.assertEqual(chunked.completion()[0], whole.completion()[0])
+        self.assertEqual(partial_fields(chunked), {"goal": 'Leave "now"', "steps": ["a", "b"]})
+
+
+class PartialOutputTest(unittest.TestCase):
+    def test_streamed_output_is_parsed_at_boundaries_not_per_chunk(self):
+        db = DBManager(os.path.join(tempfile.mkdtemp(), "conversations.db"))
+        manager = ChatManager(settings=load_settings(), db=db)
+        output = '{"action": "Walks slowly to the old oak door and knocks twice", "dialogue": "Anyone home?"}'
+        shown = []
+
+        async def stream():
+            forward = manager.make_partial_forwarder("Ann", lambda name, text: shown.append(text))
+            with mock.patch('chats.chat_manager.partial_fields', wraps=partial_fields) as parse:
+                for i in range(1, len(output) + 1):
+                    forward(output[:i])
+            await asyncio.sleep(0)
+            return parse.call_count
+
+        try:
+            parses = asyncio.run(stream())
+        finally:
+            manager.close()
+        self.assertLess(parses, 12)
+        self.assertEqual(shown[-1], "*Walks slowly to the old oak door and knocks twice*\nAnyone home?")
+        self.assertEqual(len(shown), len(set(shown)))
+
+
+class RepairedOutputIsNotCachedTest(unittest.TestCase):
+    def test_parse_or_repair_reports_repairs(self):
+        client = OllamaClient("", output_model=CharacterPlan, config={
+            'cache_file': os.path.join(tempfile.mkdtemp(), "llm_cache"),
+        })
+        plan, repaired = client.parse_or_repair('{"goal": "x", "steps": []}')
+        self.assertEqual((plan.goal, repaired), ("x", False))
+        plan, repaired = client.parse_or_repair('{"goal": "x", "steps": ["a"')
+        self.assertEqual((plan.steps, repaired), (["a"], True))
+        self.assertEqual(client.parse_or_repair('{"goal": 1'), (None, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
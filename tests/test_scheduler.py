@@ -0,0 +1,172 @@
+"""
+Tests of the priority-aware LLM scheduler (llm/scheduler.py).
+
+Run from the repository root:
+    python -m pytest tests/test_scheduler.py   (or: python -m unittest tests.test_scheduler)
+"""
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from llm.cancellation import CancellationToken, GenerationCancelled  # noqa: E402
+from llm.scheduler import LLMScheduler, Priority  # noqa: E402
+
+
+class FakeRequest:
+    """Stands in for OllamaClient.generate: records its calls and blocks until released or cancelled."""
+
+    def __init__(self, name: str, log: list):
+        self.name = name
+        self.log = log
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.attempts = 0
+
+    def __call__(self, cancel_token: CancellationToken):
+        self.attempts += 1
+        self.log.append(self.name)
+        self.started.set()
+        while not self.release.wait(0.01):
+            cancel_token.raise_if_cancelled()
+        return f"{self.name} done"
+
+
+async def wait_for(event: threading.Event):
+    await asyncio.to_thread(event.wait, 5)
+
+
+class PriorityTest(unittest.TestCase):
+    def test_queued_requests_start_by_priority_then_in_order(self):
+        log = []
+        scheduler = LLMScheduler(total_slots=1, preempt=False)
+        first = FakeRequest("turn", log)
+        queued = [
+            (Priority.BACKFILL, FakeRequest("backfill", log)),
+            (Priority.SUMMARY, FakeRequest("summary 1", log)),
+            (Priority.VALIDATION, FakeRequest("validation", log)),
+            (Priority.SUMMARY, FakeRequest("summary 2", log)),
+        ]
+
+        async def scenario():
+            running = asyncio.ensure_future(scheduler.submit(Priority.TURN, first))
+            await wait_for(first.started)
+            waiting = [asyncio.ensure_future(scheduler.submit(priority, fn)) for priority, fn in queued]
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.queue_depth(), 4)
+            for _, fn in queued:
+                fn.release.set()
+            first.release.set()
+            return await asyncio.gather(running, *waiting)
+
+        results = asyncio.run(scenario())
+        self.assertEqual(results[0], "turn done")
+        self.assertEqual(log, ["turn", "validation", "summary 1", "summary 2", "backfill"])
+
+    def test_a_class_does_not_take_more_than_its_limit(self):
+        log = []
+        scheduler = LLMScheduler(total_slots=2, limits={Priority.SUMMARY: 1})
+        summaries = [FakeRequest(f"summary {i}", log) for i in range(2)]
+
+        async def scenario():
+            tasks = [asyncio.ensure_future(scheduler.submit(Priority.SUMMARY, fn)) for fn in summaries]
+            await wait_for(summaries[0].started)
+            await asyncio.sleep(0.05)
+            self.assertEqual((scheduler.running_count, scheduler.queue_depth(Priority.SUMMARY)), (1, 1))
+            for fn in summaries:
+                fn.release.set()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        self.assertEqual(log, ["summary 0", "summary 1"])
+
+
+class PreemptionTest(unittest.TestCase):
+    def test_a_waiting_turn_preempts_background_work_which_is_requeued(self):
+        log = []
+        scheduler = LLMScheduler(total_slots=2)
+        plan = FakeRequest("plan", log)
+        backfill = FakeRequest("backfill", log)
+        turn = FakeRequest("turn", log)
+        other_turn = FakeRequest("other turn", log)
+
+        async def scenario():
+            background = [
+                asyncio.ensure_future(scheduler.submit(Priority.PLAN, plan)),
+                asyncio.ensure_future(scheduler.submit(Priority.BACKFILL, backfill)),
+            ]
+            await wait_for(plan.started)
+            await wait_for(backfill.started)
+            plan.started.clear()
+            backfill.started.clear()
+
+            # One waiting turn preempts only the lowest-priority request
+            turn.release.set()
+            self.assertEqual(await scheduler.submit(Priority.TURN, turn), "turn done")
+            await wait_for(backfill.started)
+            self.assertFalse(plan.started.is_set())
+            self.assertEqual((plan.attempts, backfill.attempts), (1, 2))
+
+            other_turn.release.set()
+            plan.release.set()
+            backfill.release.set()
+            self.assertEqual(await scheduler.submit(Priority.TURN, other_turn), "other turn done")
+            return await asyncio.gather(*background)
+
+        self.assertEqual(asyncio.run(scenario()), ["plan done", "backfill done"])
+        self.assertEqual(log[:4], ["plan", "backfill", "turn", "backfill"])
+
+    def test_turns_and_validation_are_not_preempted(self):
+        log = []
+        scheduler = LLMScheduler(total_slots=1)
+        validation = FakeRequest("validation", log)
+        turn = FakeRequest("turn", log)
+
+        async def scenario():
+            running = asyncio.ensure_future(scheduler.submit(Priority.VALIDATION, validation))
+            await wait_for(validation.started)
+            waiting = asyncio.ensure_future(scheduler.submit(Priority.TURN, turn))
+            await asyncio.sleep(0.05)
+            self.assertEqual(scheduler.queue_depth(Priority.TURN), 1)
+            validation.release.set()
+            turn.release.set()
+            await asyncio.gather(running, waiting)
+
+        asyncio.run(scenario())
+        self.assertEqual(validation.attempts, 1)
+        self.assertEqual(log, ["validation", "turn"])
+
+
+class CancellationTest(unittest.TestCase):
+    def test_a_request_cancelled_by_its_caller_fails_and_is_not_requeued(self):
+        log = []
+        scheduler = LLMScheduler(total_slots=1)
+        running = FakeRequest("running", log)
+        queued = FakeRequest("queued", log)
+        running_token, queued_token = CancellationToken(), CancellationToken()
+
+        async def scenario():
+            first = asyncio.ensure_future(scheduler.submit(Priority.PLAN, running, cancel_token=running_token))
+            await wait_for(running.started)
+            second = asyncio.ensure_future(scheduler.submit(Priority.SUMMARY, queued, cancel_token=queued_token))
+            await asyncio.sleep(0)
+
+            queued_token.cancel("Stopped")
+            with self.assertRaises(GenerationCancelled):
+                await second
+            self.assertEqual(scheduler.queue_depth(), 0)
+
+            running_token.cancel("Stopped")
+            with self.assertRaises(GenerationCancelled):
+                await first
+
+        asyncio.run(scenario())
+        self.assertEqual(log, ["running"])
+        self.assertEqual((scheduler.running_count, scheduler.queue_depth()), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests of the session registry (chats/session_registry.py): eviction and deleted sessions.
+
+Run from the repository root:
+    python -m pytest tests/test_session_registry.py   (or: python -m unittest tests.test_session_registry)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from chats.chat_manager import ChatManager, SessionNotFound  # noqa: E402
+from chats.events import SESSION_DELETED, get_event_bus  # noqa: E402
+from chats.session_registry import SessionRegistry  # noqa: E402
+from db.db_manager import DBManager  # noqa: E402
+from models.character import Character  # noqa: E402
+from utils import load_settings  # noqa: E402
+
+
+def make_registry(**kwargs) -> SessionRegistry:
+    db = DBManager(os.path.join(tempfile.mkdtemp(), "conversations.db"))
+    return SessionRegistry(load_settings(), {}, db=db, **kwargs)
+
+
+class EvictionTest(unittest.TestCase):
+    def test_the_session_just_used_and_running_sessions_are_kept(self):
+        registry = make_registry(max_sessions=1)
+        first = registry.get(registry.new_session())
+        first.automatic_running = True
+        second_id = registry.new_session()
+        second = registry.get(second_id)
+        # Over the limit, but one session runs automatic chat and the other was just used
+        self.assertEqual(registry.managers(), [first, second])
+
+        first.automatic_running = False
+        third = registry.get(registry.new_session())
+        self.assertEqual(registry.managers(), [third])
+
+    def test_the_last_viewer_leaving_stops_only_automatic_chat_it_could_have_started(self):
+        registry = make_registry()
+        for started_by, still_running in [("client", False), ("api", True)]:
+            with self.subTest(started_by=started_by):
+                session_id = registry.new_session()
+                manager = registry.acquire(session_id)
+                manager.auto_chat.start = lambda: None
+                manager.start_automatic_chat(started_by=started_by)
+                registry.release(session_id)
+                self.assertEqual(manager.automatic_running, still_running)
+
+    def test_the_registry_does_not_create_sessions(self):
+        registry = make_registry()
+        with self.assertRaises(SessionNotFound):
+            registry.get("no-such-session")
+        self.assertIsNone(registry.db.get_session("no-such-session"))
+
+
+class DeletedSessionTest(unittest.TestCase):
+    def test_a_held_manager_is_evicted_when_its_last_holder_releases_it(self):
+        registry = make_registry()
+        session_id = registry.new_session()
+        manager = registry.acquire(session_id)
+        events = []
+        get_event_bus().subscribe(session_id, events.append)
+        try:
+            registry.discard(session_id)
+        finally:
+            get_event_bus().unsubscribe(session_id, events.append)
+        registry.db.delete_session(session_id)
+
+        self.assertEqual([e.type for e in events], [SESSION_DELETED])
+        self.assertIn(manager, registry.managers())
+        with self.assertRaises(SessionNotFound):
+            registry.acquire(session_id)
+        registry.release(session_id)
+        self.assertNotIn(manager, registry.managers())
+        self.assertNotIn(session_id, [s['session_id'] for s in registry.list_sessions()])
+
+    def test_a_manager_built_while_the_session_is_deleted_is_dropped(self):
+        registry = make_registry()
+        session_id = registry.new_session()
+        building = threading.Event()
+        proceed = threading.Event()
+        create_manager = registry.create_manager
+
+        def slow_create_manager(sid):
+            building.set()
+            proceed.wait(5)
+            return create_manager(sid)
+
+        registry.create_manager = slow_create_manager
+
+        async def scenario():
+            request = asyncio.ensure_future(registry.get_async(session_id))
+            await asyncio.to_thread(building.wait, 5)
+            registry.discard(session_id)
+            registry.db.delete_session(session_id)
+            proceed.set()
+            with self.assertRaises(SessionNotFound):
+                await request
+
+        asyncio.run(scenario())
+        self.assertEqual(len(registry), 0)
+        self.assertIsNone(registry.db.get_session(session_id))
+
+
+class NextSpeakerTest(unittest.TestCase):
+    def test_messages_of_another_holder_of_the_session_move_the_next_speaker(self):
+        registry = make_registry()
+        session_id = registry.new_session()
+        manager = registry.get(session_id)
+        other = ChatManager(session_id=session_id, settings=registry.settings, db=registry.db)
+        for holder in (manager, other):
+            holder.characters = {name: Character.model_construct(name=name) for name in ("Ann", "Bob")}
+        try:
+            self.assertEqual(manager.next_speaker(), "Ann")
+            asyncio.run(other.add_message("Ann", "Hello", message_type="character"))
+            self.assertEqual(manager.next_speaker(), "Bob")
+            # A manager that has not seen any event reads the newest message once
+            third = ChatManager(session_id=session_id, settings=registry.settings, db=registry.db)
+            self.assertEqual(third.last_sender(), "Ann")
+            third.close()
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests of the deduplication of identical in-flight requests (llm/single_flight.py).
+
+Run from the repository root:
+    python -m pytest tests/test_single_flight.py   (or: python -m unittest tests.test_single_flight)
+"""
+import os
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "multipersona_chat_app"))
+
+from llm.cancellation import CancellationToken, GenerationCancelled  # noqa: E402
+from llm.single_flight import SingleFlight, request_fingerprint  # noqa: E402
+
+
+class FakeStream:
+    """Stands in for a streamed generate request: sends a first chunk, then waits to be finished or cancelled."""
+
+    def __init__(self, result: str = "Hello there"):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.finish = threading.Event()
+        self.lock = threading.Lock()
+
+    def request(self, cancel_token: CancellationToken = None):
+        def fn(on_partial):
+            with self.lock:
+                self.calls += 1
+            on_partial("Hello")
+            self.started.set()
+            while not self.finish.wait(0.01):
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+            on_partial(self.result)
+            return self.result
+        return fn
+
+
+def wait_for_followers(flight: SingleFlight, key: str, count: int = 1):
+    for _ in range(500):
+        with flight._lock:
+            current = flight._flights.get(key)
+        if current is not None and current.followers >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"No follower attached to {key}")
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight(poll_interval=0.01)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def test_fingerprints_separate_kinds_and_bodies(self):
+        self.assertEqual(request_fingerprint("generate", '{"a": 1}'), request_fingerprint("generate", b'{"a": 1}'))
+        self.assertNotEqual(request_fingerprint("generate", "x"), request_fingerprint("embedding", "x"))
+        self.assertNotEqual(request_fingerprint("generate", "x"), request_fingerprint("generate", "y"))
+
+    def test_a_follower_shares_the_request_and_its_partial_output(self):
+        stream = FakeStream()
+        leader = self.executor.submit(self.flight.do, "key", stream.request())
+        stream.started.wait(5)
+        partials = []
+        follower = self.executor.submit(self.flight.do, "key", stream.request(), partials.append)
+        wait_for_followers(self.flight, "key")
+        stream.finish.set()
+
+        self.assertEqual(leader.result(5), ("Hello there", False))
+        self.assertEqual(follower.result(5), ("Hello there", True))
+        self.assertEqual(stream.calls, 1)
+        # The follower got the output streamed before it attached, then every later chunk
+        self.assertEqual(partials, ["Hello", "Hello there"])
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_followers_retry_when_the_leader_is_cancelled(self):
+        stream = FakeStream()
+        leader_token = CancellationToken()
+        leader = self.executor.submit(self.flight.do, "key", stream.request(leader_token), None, leader_token)
+        stream.started.wait(5)
+        follower = self.executor.submit(self.flight.do, "key", stream.request())
+        wait_for_followers(self.flight, "key")
+        stream.started.clear()
+
+        leader_token.cancel("Stopped")
+        with self.assertRaises(GenerationCancelled):
+            leader.result(5)
+        # The follower sends the request itself, as the new leader
+        stream.started.wait(5)
+        stream.finish.set()
+        self.assertEqual(follower.result(5), ("Hello there", False))
+        self.assertEqual(stream.calls, 2)
+
+    def test_a_cancelled_follower_stops_waiting_without_cancelling_the_leader(self):
+        stream = FakeStream()
+        leader = self.executor.submit(self.flight.do, "key", stream.request())
+        stream.started.wait(5)
+        follower_token = CancellationToken()
+        follower = self.executor.submit(self.flight.do, "key", stream.request(), None, follower_token)
+        wait_for_followers(self.flight, "key")
+        follower_token.cancel("Stopped")
+        with self.assertRaises(GenerationCancelled):
+            follower.result(5)
+
+        stream.finish.set()
+        self.assertEqual(leader.result(5), ("Hello there", False))
+        self.assertEqual(stream.calls, 1)
+
+    def test_errors_of_the_leader_reach_its_followers(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def failing(on_partial):
+            started.set()
+            finish.wait(5)
+            raise ValueError("Bad response")
+
+        leader = self.executor.submit(self.flight.do, "key", failing)
+        started.wait(5)
+        follower = self.executor.submit(self.flight.do, "key", failing)
+        wait_for_followers(self.flight, "key")
+        finish.set()
+        for future in (leader, follower):
+            with self.assertRaises(ValueError):
+                future.result(5)
+
+
+if __name__ == '__main__':
+    unittest.main()